@@ -0,0 +1,206 @@
+import os
+import pickle
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from analysis.aggregates import combine, summarize
+from data.modules.column_store import encode_columns, decode_columns, categoricals_to_objects
+from data.modules.data_frames import DataFrameCreator
+from data.modules.data_loader import read_csv_file
+
+BACKENDS = ('mpi', 'shm')
+
+# Per pool process: the layout it is attached to, and the attached segments and arrays
+_attached = {'layout_name': None, 'segments': [], 'frames': None}
+
+
+def _open_segment(name):
+    """Attaches to an existing segment without registering it for cleanup by this process."""
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 has no track argument
+        from multiprocessing import resource_tracker
+        segment = SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+
+def _attach(layout_name):
+    """Maps the published column arrays into this pool process, once per published layout."""
+    if _attached['layout_name'] == layout_name:
+        return _attached['frames']
+
+    # Drop the views of the previous publication before closing its segments
+    _attached['frames'] = None
+    for segment in _attached['segments']:
+        try:
+            segment.close()
+        except BufferError:
+            pass  # A DataFrame still refers to it; the mapping goes away with the process
+
+    layout_segment = _open_segment(layout_name)
+    layout = pickle.loads(bytes(layout_segment.buf))  # Trailing padding after the pickle is ignored
+    segments = [layout_segment]
+
+    def attach_array(name, dtype, length):
+        segment = _open_segment(name)
+        segments.append(segment)
+        return np.ndarray((length,), dtype=np.dtype(dtype), buffer=segment.buf)
+
+    frames = {'test_offsets': attach_array(*layout['test_offsets'])}
+    for table, columns in layout['tables'].items():
+        arrays = {column: attach_array(*spec) for column, spec in columns['arrays'].items()}
+        frames[table] = (arrays, columns['meta'])
+
+    _attached.update(layout_name=layout_name, segments=segments, frames=frames)
+    return frames
+
+
+def _search_range(args):
+    """
+    Pool task: answers a batch of searches over one vehicle row range of the shared arrays,
+    returning the partial instead of the rows for every search with an aggregate.
+    """
+    from analysis.search_analysis import SearchAnalyzer
+
+    layout_name, start, stop, search_kwargs_batch, aggregates = args
+    frames = _attach(layout_name)
+    test_offsets = frames['test_offsets']
+    vehicle_df = decode_columns(*frames['vehicle'], start, stop)
+    test_df = decode_columns(*frames['test'], test_offsets[start], test_offsets[stop])
+
+    results = SearchAnalyzer(None, 0, 1).combined_search_batch(vehicle_df, test_df, search_kwargs_batch)
+    return summarize([categoricals_to_objects(frame) for frame in results], aggregates)
+
+
+def _load_file(args):
+    """Pool task: parses and cleans one CSV file and returns it with the bad values the cleaner counted."""
+    filename, data_cleaner, rows_per_file = args
+    data_cleaner.bad_values = {}
+    return read_csv_file(filename, data_cleaner, rows_per_file), data_cleaner.bad_values
+
+
+class SharedMemoryBackend:
+    """
+    Single-node execution backend that replaces mpiexec with a local process pool.
+
+    The vehicle and test columns are copied once into multiprocessing.shared_memory segments;
+    pool processes attach to those segments by name and scan row ranges in place, so no
+    partition is ever pickled between processes. Only the small per-range results travel back.
+    """
+
+    def __init__(self, processes=None, tasks_per_process=4):
+        self.processes = processes or os.cpu_count() or 1
+        self.tasks_per_process = tasks_per_process
+        # Start the pool before any GUI exists, so forked processes do not inherit Qt state
+        self.pool = get_context().Pool(self.processes)
+        self.segments = []
+        self.layout_name = None
+        self.num_vehicles = 0
+        self._published_source = None
+
+    def load_files(self, csv_files, data_cleaner, rows_per_file, progress=None):
+        """
+        Parses the CSV files in parallel, returning one cleaned DataFrame per file.
+
+        progress (an IngestProgress) is updated as each file comes back.
+        """
+        print(f"Shared-memory backend: parsing {len(csv_files)} files on {self.processes} processes")
+        frames = []
+        bad_values = {}
+        for filename, (frame, file_bad_values) in zip(csv_files, self.pool.imap(
+                _load_file, [(f, data_cleaner, rows_per_file) for f in csv_files])):
+            frames.append(frame)
+            if progress is not None:
+                for column, count in file_bad_values.items():
+                    bad_values[column] = bad_values.get(column, 0) + count
+                progress.file_done()
+                progress.update(len(frame), os.path.getsize(filename), bad_values)
+        if progress is not None:
+            progress.finish()
+        return frames
+
+    def _create_segment(self, data):
+        """Copies an array into a new segment and returns the (name, dtype, length) needed to attach it."""
+        segment = SharedMemory(create=True, size=max(1, data.nbytes))
+        np.ndarray(data.shape, dtype=data.dtype, buffer=segment.buf)[:] = data
+        self.segments.append(segment)
+        return segment.name, data.dtype.str, len(data)
+
+    def publish(self, vehicle_df, test_df):
+        """Copies the aligned vehicle and test columns into shared memory for the pool processes."""
+        self.release()
+        source = (vehicle_df, test_df)
+        vehicle_df, test_df, test_offsets = DataFrameCreator().align_by_vehicle(vehicle_df, test_df)
+
+        layout = {'tables': {}, 'test_offsets': self._create_segment(test_offsets)}
+        for table, df in (('vehicle', vehicle_df), ('test', test_df)):
+            arrays, meta = encode_columns(df)
+            layout['tables'][table] = {
+                'arrays': {column: self._create_segment(values) for column, values in arrays.items()},
+                'meta': meta,
+            }
+
+        layout_bytes = pickle.dumps(layout)
+        layout_segment = SharedMemory(create=True, size=len(layout_bytes))
+        layout_segment.buf[:len(layout_bytes)] = layout_bytes
+        self.segments.append(layout_segment)
+
+        self.layout_name = layout_segment.name
+        self.num_vehicles = len(vehicle_df)
+        self._published_source = source
+        print(f"Shared-memory backend: published {len(vehicle_df)} vehicles and {len(test_df)} tests")
+
+    def search(self, vehicle_df, test_df, search_kwargs):
+        """
+        Runs combined_search over the published data on the process pool.
+
+        Args:
+            vehicle_df (pd.DataFrame): The vehicle DataFrame (published on first use).
+            test_df (pd.DataFrame): The test DataFrame (published on first use).
+            search_kwargs (dict): combined_search keyword arguments.
+
+        Returns:
+            pd.DataFrame: The matching rows, in vehicle_id order.
+        """
+        return self.search_batch(vehicle_df, test_df, [search_kwargs])[0]
+
+    def search_batch(self, vehicle_df, test_df, search_kwargs_batch, aggregates=None):
+        """
+        Runs several searches over the published data with one shared scan per pool task.
+
+        Args:
+            aggregates (list, optional): An Aggregate or None per search; pool tasks return the
+                partials of aggregated searches, which are merged here.
+
+        Returns:
+            list: The matching rows of each search, in vehicle_id order, or its merged partial.
+        """
+        aggregates = aggregates or [None] * len(search_kwargs_batch)
+        if self._published_source is None or self._published_source[0] is not vehicle_df \
+                or self._published_source[1] is not test_df:
+            self.publish(vehicle_df, test_df)
+
+        num_tasks = max(1, min(self.num_vehicles, self.processes * self.tasks_per_process))
+        bounds = np.linspace(0, self.num_vehicles, num_tasks + 1).astype(int)
+        tasks = [(self.layout_name, int(start), int(stop), search_kwargs_batch, aggregates)
+                 for start, stop in zip(bounds[:-1], bounds[1:])]
+        task_results = self.pool.map(_search_range, tasks)
+        return [combine([results[index] for results in task_results], aggregate)
+                for index, aggregate in enumerate(aggregates)]
+
+    def release(self):
+        """Frees the shared memory segments of the current publication."""
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+        self.layout_name = None
+        self._published_source = None
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.release()
@@ -0,0 +1,240 @@
+import json
+import os
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from analysis.aggregates import create_aggregate
+from analysis.core import calculate_pass_rate_by_age, calculate_pass_rate_by_mileage
+from analysis.export import create_export
+from analysis.lookup import LOOKUP_FIELDS, lookup_key
+
+# The keys of the search_criteria dict built by MainWindow.search, with the values an empty form gives
+DEFAULT_CRITERIA = {'make': '', 'model': '', 'year': None, 'min_mileage': None, 'max_mileage': None,
+                    'min_test_date': None, 'max_test_date': None}
+ANALYSES = {'age': calculate_pass_rate_by_age, 'mileage': calculate_pass_rate_by_mileage}
+
+
+def normalize_criteria(query):
+    """
+    Checks a search request and fills in the keys it leaves out.
+
+    Missing keys get the values of an empty search form; test dates are 'YYYY-MM-DD' strings. A
+    request may also name an 'analysis' ('age' or 'mileage') to compute on its results, or an
+    'aggregate' (see analysis.aggregates) to get instead of its matching rows, or an 'export'
+    (see analysis.export) that has the workers write the rows to files. A 'vehicle_id' or
+    'test_id' turns it into a lookup of that vehicle's test history (or that one test), and the
+    other search keys are ignored.
+
+    Raises:
+        ValueError: If the request is not a dict, has unknown keys or values of the wrong type.
+    """
+    if not isinstance(query, dict):
+        raise ValueError("expected a JSON object")
+    unknown = set(query) - set(DEFAULT_CRITERIA) - set(LOOKUP_FIELDS) - {'analysis', 'aggregate', 'export'}
+    if unknown:
+        raise ValueError(f"unknown keys {sorted(unknown)}")
+    if query.get('analysis') not in (None, *ANALYSES):
+        raise ValueError(f"analysis must be one of {sorted(ANALYSES)}")
+    create_aggregate(query.get('aggregate'))
+    if create_export(query.get('export')) is not None and (query.get('aggregate') is not None
+                                                           or query.get('analysis') is not None):
+        raise ValueError("an export writes the matching rows, so it cannot have an aggregate or analysis")
+    for key in LOOKUP_FIELDS:
+        value = query.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int))):
+            raise ValueError(f"{key} must be a string or an integer")
+    if sum(bool(str(query.get(key) or '').strip()) for key in LOOKUP_FIELDS) > 1:
+        raise ValueError(f"give only one of {list(LOOKUP_FIELDS)}")
+    if lookup_key(query) is not None and (query.get('aggregate') is not None or query.get('export') is not None):
+        raise ValueError("a lookup cannot have an aggregate or export")
+    for key in ('make', 'model'):
+        if not isinstance(query.get(key) or '', str):
+            raise ValueError(f"{key} must be a string")
+    for key in ('year', 'min_mileage', 'max_mileage'):
+        value = query.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            raise ValueError(f"{key} must be an integer")
+    for key in ('min_test_date', 'max_test_date'):
+        value = query.get(key)
+        if value is not None:
+            try:
+                date.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be a date string YYYY-MM-DD")
+    if query.get('min_test_date') and query.get('max_test_date') and query['min_test_date'] > query['max_test_date']:
+        raise ValueError("min_test_date cannot be after max_test_date")
+    return {**DEFAULT_CRITERIA, **query}
+
+
+def request_criteria(query):
+    """
+    The search_criteria dict sent for a request: its search keys, with the values of an empty
+    form for missing ones, plus its aggregate, export or the id it looks up if it names one.
+    """
+    search_criteria = {key: query.get(key, default) for key, default in DEFAULT_CRITERIA.items()}
+    for key in ('aggregate', 'export'):
+        if query.get(key) is not None:
+            search_criteria[key] = query[key]
+    key = lookup_key(query)
+    if key is not None:
+        search_criteria[key[0]] = key[1]
+    return search_criteria
+
+
+def read_queries(path):
+    """
+    Reads one search_criteria dict per line of a JSON lines file.
+
+    Each line is checked by normalize_criteria. Blank lines and lines starting with # are skipped.
+
+    Returns:
+        list: The search_criteria dicts, in file order.
+    """
+    queries = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                queries.append(normalize_criteria(json.loads(line)))
+            except ValueError as e:  # json.JSONDecodeError is a ValueError too
+                raise ValueError(f"{path}:{line_number}: {e}")
+    return queries
+
+
+def latency_summary(latencies):
+    """Latency percentiles in seconds for a list of per-query latencies."""
+    if not latencies:
+        return {}
+    values = np.asarray(latencies)
+    return {
+        'min': float(values.min()),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+        'mean': float(values.mean()),
+    }
+
+
+class BatchRunner:
+    """
+    Runs a list of searches back to back through a SearchAnalyzer on rank 0 and writes the
+    results, the requested analyses and a latency summary to an output directory.
+
+    With export_format the matching rows of searches are not sent back to rank 0 but exported by
+    the workers, each query into a directory of its own (see analysis.export).
+    """
+
+    def __init__(self, search_analyzer, vehicle_df, test_df, output_dir, write_rows=True, group_size=1,
+                 export_format=None):
+        self.search_analyzer = search_analyzer
+        self.vehicle_df = vehicle_df
+        self.test_df = test_df
+        self.output_dir = output_dir
+        self.write_rows = write_rows
+        self.group_size = max(1, group_size)  # Queries sent to the workers together as one search_batch
+        self.export_format = export_format
+
+    def run(self, queries, errors=(Exception,)):
+        """
+        Executes every query and writes summary.json.
+
+        Queries are sent group_size at a time through search_batch, which answers a group with one
+        shared scan; every query of a group is reported with the group's latency.
+
+        Args:
+            queries (list): search_criteria dicts as returned by read_queries.
+            errors (tuple): Exception types that fail a single group instead of the whole batch.
+
+        Returns:
+            dict: The summary that was written.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        records = []
+        batch_started = time.perf_counter()
+
+        for first in range(0, len(queries), self.group_size):
+            group = list(enumerate(queries[first:first + self.group_size], start=first + 1))
+            search_criteria_batch = [self.export_criteria(index, query) for index, query in group]
+
+            started = time.perf_counter()
+            try:
+                group_results, query_stats = self.search_analyzer.search_batch_with_stats(
+                    self.vehicle_df, self.test_df, search_criteria_batch)
+                error = None
+            except errors as e:
+                group_results, query_stats, error = [None] * len(group), None, e
+            latency = time.perf_counter() - started
+
+            for (index, query), search_criteria, results in zip(group, search_criteria_batch, group_results):
+                analysis = query.get('analysis')
+                record = {'query': index, 'criteria': search_criteria, 'analysis': analysis, 'latency': latency}
+                if query_stats is not None:
+                    record['stats'] = query_stats.to_dict()  # Shared by every query of the group
+                records.append(record)
+                if error is not None:
+                    record['error'] = str(error)
+                    print(f"Batch: query {index} failed: {error}")
+                    continue
+                if 'export' in search_criteria:
+                    # The rows are in the export's files already; results lists those files
+                    record['export'] = search_criteria['export']['directory']
+                    record['files'] = len(results)
+                    record['rows'] = int(results['rows'].sum())
+                    print(f"Batch: query {index} exported {record['rows']} rows to {record['files']} files "
+                          f"in {latency:.3f}s")
+                    continue
+                record['rows'] = 0 if results is None else len(results)
+
+                if self.write_rows and record['rows']:
+                    record['results_file'] = self.write_frame(results, f"query_{index:04d}.csv")
+                if analysis and record['rows'] and 'aggregate' not in search_criteria:
+                    pass_rates = ANALYSES[analysis](results.copy())
+                    frame = pd.DataFrame({analysis: list(pass_rates), 'pass_rate': list(pass_rates.values())})
+                    record['analysis_file'] = self.write_frame(frame, f"query_{index:04d}_{analysis}.csv")
+                print(f"Batch: query {index} returned {record['rows']} rows in {latency:.3f}s")
+
+        elapsed = time.perf_counter() - batch_started
+        completed = [record['latency'] for record in records if 'error' not in record]
+        summary = {
+            'queries': len(records),
+            'failed': len(records) - len(completed),
+            'seconds': elapsed,
+            'queries_per_second': len(completed) / elapsed if elapsed > 0 else 0.0,
+            'latency': latency_summary(completed),
+            'records': records,
+        }
+        with open(os.path.join(self.output_dir, "summary.json"), 'w') as f:
+            json.dump(summary, f, indent=2, default=str)
+        self.print_summary(summary)
+        return summary
+
+    def export_criteria(self, index, query):
+        """
+        The search_criteria sent for a query, exporting its rows into the output directory when the
+        runner exports and the query returns rows that would be written.
+        """
+        search_criteria = request_criteria(query)
+        if (self.export_format and self.write_rows and 'export' not in search_criteria
+                and 'aggregate' not in search_criteria and lookup_key(query) is None and not query.get('analysis')):
+            search_criteria['export'] = {'directory': os.path.join(self.output_dir, f"query_{index:04d}"),
+                                         'format': self.export_format}
+        return search_criteria
+
+    def write_frame(self, frame, name):
+        path = os.path.join(self.output_dir, name)
+        frame.to_csv(path, index=False)
+        return name
+
+    def print_summary(self, summary):
+        latency = summary['latency']
+        print(f"Batch: {summary['queries']} queries ({summary['failed']} failed) in {summary['seconds']:.3f}s, "
+              f"{summary['queries_per_second']:.2f} queries/s")
+        if latency:
+            print("Batch: latency " + ", ".join(f"{name} {value * 1000:.1f} ms" for name, value in latency.items()))
+        print(f"Batch: results written to {self.output_dir}")
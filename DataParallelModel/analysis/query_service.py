@@ -0,0 +1,274 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from analysis.batch_runner import ANALYSES, normalize_criteria, request_criteria
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+class QueryService:
+    """
+    Local HTTP/JSON front end to the resident MPI workers, run on rank 0.
+
+    Requests are queued to a single engine thread that owns every call into the SearchAnalyzer,
+    so MPI is only ever driven from one thread. Identical requests that arrive while one is
+    queued or running share its answer, and the distinct requests that arrive within
+    batch_window seconds of each other go to the workers as one search_batch round-trip.
+    The GUI uses search() and is just one more client.
+
+    Endpoints:
+        GET  /health     Liveness and data size.
+        GET  /stats      Request, coalescing and batching counters.
+        POST /search     A search_criteria object, optionally with "limit"; returns matching rows, or
+                         the rows of the aggregate it names; with "vehicle_id" or "test_id" the
+                         history of that vehicle, or that one test.
+        POST /pass-rate  A search_criteria object with "by": "age" or "mileage"; returns pass rates.
+        GET  /complete   ?field=make|model&prefix=...[&make=...][&limit=N]; suggestions from the
+                         CompletionIndex, answered on the event loop without the workers.
+    """
+
+    def __init__(self, search_analyzer, vehicle_df, test_df, host="127.0.0.1", port=8765,
+                 batch_window=0.005, max_batch=32, max_rows=1000, errors=(), completion=None):
+        self.search_analyzer = search_analyzer
+        self.completion = completion
+        self.vehicle_df = vehicle_df
+        self.test_df = test_df
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_rows = max_rows
+        self.errors = errors  # Engine exceptions reported as 503 instead of 500, e.g. QueryError
+        self.engine = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-engine")
+        self.loop = None
+        self.thread = None
+        self.in_flight = {}  # request key -> future shared by every identical request
+        self.stats = {'requests': 0, 'coalesced': 0, 'batches': 0, 'searches': 0, 'largest_batch': 0,
+                      'errors': 0}
+        self._queue = None
+        self._stopping = None
+        self._ready = threading.Event()
+        self._startup_error = None
+
+    def start(self):
+        """Starts the event loop and the HTTP server in a background thread."""
+        self.thread = threading.Thread(target=self._run, name="query-service", daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        if self._startup_error is not None:
+            raise self._startup_error
+        print(f"Rank 0: Query service listening on http://{self.host}:{self.port}")
+
+    def serve_forever(self):
+        """Runs the service in the calling thread until interrupted (headless mode)."""
+        self.start()
+        try:
+            self.thread.join()
+        except KeyboardInterrupt:
+            print("Rank 0: Query service interrupted")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stops accepting requests and waits for the engine to finish the running batch."""
+        if self.loop is not None and self.thread is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self._stopping.set)
+            self.thread.join()
+        self.engine.shutdown(wait=True)
+
+    def search(self, search_criteria):
+        """
+        Thread-safe blocking search for in-process clients such as the GUI.
+
+        Returns:
+            pd.DataFrame: A private copy of the matching rows.
+        """
+        return self.search_with_stats(search_criteria)[0]
+
+    def search_with_stats(self, search_criteria):
+        """
+        Like search(), but also returns the QueryStats of the batch the search was answered in.
+
+        Returns:
+            tuple: (pd.DataFrame, QueryStats)
+        """
+        future = asyncio.run_coroutine_threadsafe(self.submit(search_criteria), self.loop)
+        results, stats = future.result()
+        return results.copy(), stats
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            self._startup_error = e
+            self._ready.set()
+        finally:
+            self.loop.close()
+
+    async def _serve(self):
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        batcher = asyncio.ensure_future(self._batcher())
+        self._ready.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            batcher.cancel()
+            for future in self.in_flight.values():
+                if not future.done():
+                    future.set_exception(RuntimeError("The query service is shutting down."))
+
+    async def submit(self, search_criteria):
+        """
+        Queues a search, or joins an identical one that is already queued or running.
+
+        Returns:
+            tuple: (pd.DataFrame, QueryStats); the stats cover the whole batch the search ran in.
+        """
+        search_criteria = request_criteria(search_criteria)
+        key = json.dumps(search_criteria, sort_keys=True)
+        self.stats['requests'] += 1
+        future = self.in_flight.get(key)
+        if future is None:
+            future = self.loop.create_future()
+            self.in_flight[key] = future
+            await self._queue.put((key, search_criteria))
+        else:
+            self.stats['coalesced'] += 1
+        # Shielded so that a client hanging up does not cancel the answer for the others
+        return await asyncio.shield(future)
+
+    async def _batcher(self):
+        """Collects queued searches for batch_window seconds and runs them as one batch."""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self.loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.stats['batches'] += 1
+            self.stats['searches'] += len(batch)
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+            try:
+                results, query_stats = await self.loop.run_in_executor(
+                    self.engine, self.search_analyzer.search_batch_with_stats, self.vehicle_df, self.test_df,
+                    [search_criteria for _, search_criteria in batch])
+            except Exception as e:
+                self.stats['errors'] += 1
+                for key, _ in batch:
+                    self.in_flight.pop(key).set_exception(e)
+                continue
+            for (key, _), result in zip(batch, results):
+                self.in_flight.pop(key).set_result((result, query_stats))
+
+    async def _handle(self, reader, writer):
+        try:
+            status, payload = await self._respond(reader)
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        except self.errors as e:
+            status, payload = 503, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+
+        body = json.dumps(payload, default=str).encode()
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        try:
+            writer.write(head.encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise ValueError("malformed request line")
+        method, path = request_line[0], request_line[1].split('?', 1)[0]
+        query = parse_qs(request_line[1].partition('?')[2])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length') or 0))
+
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok', 'vehicles': self.vehicle_rows()}
+        if method == 'GET' and path == '/stats':
+            return 200, dict(self.stats, in_flight=len(self.in_flight))
+        if method == 'GET' and path == '/complete':
+            return 200, self._complete(query)
+        if method == 'POST' and path in ('/search', '/pass-rate'):
+            request = json.loads(body or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+            if 'export' in request:
+                raise ValueError("exports write files on the server; run them from the GUI or batch.py")
+            if path == '/search':
+                return 200, await self._search(request)
+            return 200, await self._pass_rate(request)
+        return 404, {'error': f"no route for {method} {path}"}
+
+    async def _search(self, request):
+        limit = request.pop('limit', self.max_rows)
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit < 0:
+            raise ValueError("limit must be a non-negative integer")
+        results, query_stats = await self.submit(normalize_criteria(request))
+        rows = json.loads(results.head(limit).to_json(orient='records', date_format='iso'))
+        return {'rows': len(results), 'returned': len(rows), 'data': rows, 'stats': query_stats.to_dict()}
+
+    async def _pass_rate(self, request):
+        by = request.pop('by', 'age')
+        if by not in ANALYSES:
+            raise ValueError(f"by must be one of {sorted(ANALYSES)}")
+        if 'aggregate' in request:
+            raise ValueError("pass rates are computed from matching rows; send aggregates to /search")
+        results, _ = await self.submit(normalize_criteria(request))
+        if results.empty:
+            return {'by': by, 'rows': 0, 'pass_rates': {}}
+        # The analysis runs off the event loop but not on the engine thread, which stays free for MPI
+        pass_rates = await self.loop.run_in_executor(None, ANALYSES[by], results.copy())
+        return {'by': by, 'rows': len(results), 'pass_rates': {str(key): value for key, value in pass_rates.items()}}
+
+    def _complete(self, query):
+        if self.completion is None:
+            raise ValueError("no completion index loaded")
+        field = query.get('field', ['make'])[0]
+        prefix = query.get('prefix', [''])[0]
+        limit = query.get('limit', ['20'])[0]
+        if not limit.isdigit():
+            raise ValueError("limit must be a non-negative integer")
+        if field == 'make':
+            values = self.completion.complete_make(prefix, int(limit))
+        elif field == 'model':
+            values = self.completion.complete_model(prefix, query.get('make', [None])[0], int(limit))
+        else:
+            raise ValueError("field must be 'make' or 'model'")
+        return {'field': field, 'prefix': prefix, 'values': values}
+
+    def vehicle_rows(self):
+        if self.vehicle_df is not None:
+            return len(self.vehicle_df)
+        partition = self.search_analyzer.partition
+        return partition.node_ranges[-1][1] if partition is not None else 0
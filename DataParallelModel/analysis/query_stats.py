@@ -0,0 +1,115 @@
+import time
+from contextlib import contextmanager
+
+# Counters kept for every rank that scanned part of a query
+WORKER_COUNTERS = ('tasks', 'vehicles_scanned', 'tests_scanned', 'rows_matched', 'bytes_sent', 'bytes_received',
+                   'bytes_saved', 'compress_seconds', 'scan_seconds')
+
+
+class QueryStats:
+    """
+    Where the time and the data of one query (a batch of searches) went.
+
+    Filled in by SearchAnalyzer while the query runs and returned with its results by
+    search_batch_with_stats. Phases are wall-clock seconds on rank 0, workers holds per-rank
+    counters, and cache counts hits and misses of the caches and indexes the query could reuse.
+    Byte counts are taken on rank 0: what it sent to a rank and what it got back from it, and how
+    much compression saved on those messages (see analysis.transport).
+    """
+
+    def __init__(self, searches):
+        self.started = time.perf_counter()
+        self.searches = searches
+        self.phases = {}
+        self.workers = {}
+        self.cache = {}
+        self.rows_matched = []
+        self.wall_seconds = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        """Adds the time spent in the enclosed block to the named phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def worker(self, rank):
+        """The counters of one rank, created on first use."""
+        if rank not in self.workers:
+            self.workers[rank] = dict.fromkeys(WORKER_COUNTERS, 0)
+        return self.workers[rank]
+
+    def count(self, name, amount=1):
+        """Counts a cache or index event, e.g. 'aligned_frames_hit'."""
+        self.cache[name] = self.cache.get(name, 0) + amount
+
+    def finish(self, results):
+        """Records the matches of every search and stops the clock."""
+        self.rows_matched = [0 if frame is None else len(frame) for frame in results]
+        self.wall_seconds = time.perf_counter() - self.started
+        return self
+
+    @property
+    def bytes_sent(self):
+        return sum(counters['bytes_sent'] for counters in self.workers.values())
+
+    @property
+    def bytes_received(self):
+        return sum(counters['bytes_received'] for counters in self.workers.values())
+
+    @property
+    def bytes_saved(self):
+        return sum(counters['bytes_saved'] for counters in self.workers.values())
+
+    @property
+    def compress_seconds(self):
+        return sum(counters['compress_seconds'] for counters in self.workers.values())
+
+    def to_dict(self):
+        """A JSON-friendly copy, as written by the batch runner and the query service."""
+        return {
+            'searches': self.searches,
+            'rows_matched': self.rows_matched,
+            'wall_seconds': self.wall_seconds,
+            'phases': dict(self.phases),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'bytes_saved': self.bytes_saved,
+            'compress_seconds': self.compress_seconds,
+            'cache': dict(self.cache),
+            'workers': {str(rank): dict(counters) for rank, counters in sorted(self.workers.items())},
+        }
+
+    def summary_lines(self):
+        """Human-readable lines for the GUI's statistics panel."""
+        lines = [f"Wall time: {self.wall_seconds * 1000:.1f} ms for {self.searches} search(es), "
+                 f"{sum(self.rows_matched)} rows matched"]
+        if self.phases:
+            lines.append("Phases: " + ", ".join(f"{name} {seconds * 1000:.1f} ms"
+                                                for name, seconds in self.phases.items()))
+        lines.append(f"Data: {format_bytes(self.bytes_sent)} sent, {format_bytes(self.bytes_received)} received")
+        if self.bytes_saved > 0:
+            lines.append(f"Compression: {format_bytes(self.bytes_saved)} saved, "
+                         f"{self.compress_seconds * 1000:.1f} ms compressing and decompressing")
+        if self.cache:
+            lines.append("Cache/index: " + ", ".join(f"{name} {count}" for name, count in sorted(self.cache.items())))
+        for rank, counters in sorted(self.workers.items()):
+            lines.append(f"Rank {rank}: {counters['tasks']} task(s), {counters['vehicles_scanned']} vehicles and "
+                         f"{counters['tests_scanned']} tests scanned, {counters['rows_matched']} rows matched, "
+                         f"scan {counters['scan_seconds'] * 1000:.1f} ms, "
+                         f"{format_bytes(counters['bytes_sent'])} sent to it, "
+                         f"{format_bytes(counters['bytes_received'])} back")
+        return lines
+
+
+def format_bytes(count):
+    for unit in ('B', 'KB', 'MB'):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GB"
@@ -1,11 +1,58 @@
+import os
+import time
+
+import numpy as np
 import pandas as pd
-from mpi4py import MPI
+
+from analysis.aggregates import RegionalCounters, RegionalPassRates, combine, finalize, split_aggregates, summarize
+from analysis.export import clear_export, empty_parts, part_name, split_exports, write_manifest, write_part
+from analysis.lookup import FrameSource, IdIndex, history, lookup_key
+from analysis.query_stats import QueryStats
+from analysis.transport import codec
+from data.modules.column_store import categoricals_to_objects
+from data.modules.data_frames import DataFrameCreator
+from data.modules.date_index import DateIndex, date_mask, date_values
+from data.modules.zone_maps import search_conditions
+from tracing import tracer
+
+try:
+    from mpi4py import MPI
+except ImportError:  # The shared-memory backend runs without MPI
+    MPI = None
+
+# Columns of every search result, in display order
+RESULT_COLUMNS = ['test_id', 'vehicle_id', 'test_date', 'test_class_id', 'test_type',
+                  'test_result', 'test_mileage', 'postcode_area', 'make', 'model',
+                  'colour', 'fuel_type', 'cylinder_capacity', 'first_use_date']
+
+# Point-to-point messages carrying lookup answers to rank 0
+LOOKUP_TAG = 1
+
+
+def test_date_bounds(min_test_date=None, max_test_date=None):
+    """
+    The Timestamps [start, stop) a test-date search keeps tests in, None for an open end.
+
+    Dates are 'YYYY-MM-DD' strings; max_test_date is inclusive, so stop is the day after it.
+    """
+    start = pd.Timestamp(min_test_date) if min_test_date else None
+    stop = pd.Timestamp(max_test_date) + pd.Timedelta(days=1) if max_test_date else None
+    return start, stop
+
 
 class SearchAnalyzer:
-    def __init__(self, comm, rank, size):
+    def __init__(self, comm, rank, size, backend=None, partition=None):
         self.comm = comm
         self.rank = rank
         self.size = size
+        self.backend = backend  # None for MPI, else a local execution backend such as SharedMemoryBackend
+        self.partition = partition  # NodeSharedFrames or MappedColumnStore when every rank reads its own rows
+        # Indexes built and reused by the last combined_search_batch, reported in QueryStats
+        self.index_counters = {'indexes_built': 0, 'index_lookups': 0}
+        # (source, IdIndex, Bloom filters of every rank) once the first lookup has built them
+        self._lookup = None
+        # RegionalCounters of this rank's share once the first regional search has built them
+        self._regional = None
 
     def search_by_make(self, df, make):
         """Searches for vehicles of a specific make."""
@@ -23,72 +70,493 @@ class SearchAnalyzer:
         """Searches for tests within a specific mileage range."""
         return df[(df['test_mileage'] >= min_mileage) & (df['test_mileage'] <= max_mileage)]
 
-    def distribute_search(self, vehicle_df, test_df, make=None, model=None, year=None, min_mileage=None, max_mileage=None):
+    def search_by_test_date(self, df, min_test_date=None, max_test_date=None, date_index=None):
+        """
+        Searches for tests taken between two dates, both included; a missing date leaves that end open.
+
+        With the partition's date_index over df's rows they are found by binary search instead of
+        comparing every row.
+        """
+        start, stop = test_date_bounds(min_test_date, max_test_date)
+        if date_index is None:
+            return df[date_mask(df['test_date'], start, stop)]
+        return df[date_index.mask(start, stop, df['test_date'])]
+
+    def search(self, vehicle_df, test_df, search_criteria):
+        """
+        Runs a search on whichever execution backend the application was started with.
+
+        With MPI the criteria are broadcast from rank 0 and every process joins distribute_search_batch.
+
+        Args:
+            vehicle_df (pd.DataFrame): The vehicle DataFrame (rank 0 only).
+            test_df (pd.DataFrame): The test DataFrame (rank 0 only).
+            search_criteria (dict): The search_criteria dict built by MainWindow.search.
+
+        Returns:
+            pd.DataFrame: The matching rows on rank 0, None elsewhere.
+        """
+        return self.search_batch(vehicle_df, test_df, [search_criteria])[0]
+
+    def search_batch(self, vehicle_df, test_df, search_criteria_batch):
+        """
+        Runs several searches in one collective round.
+
+        With MPI the whole batch is broadcast once and every process answers all searches over its
+        share before a single gather. A search whose criteria name an 'aggregate' (see
+        analysis.aggregates) returns the aggregate's DataFrame instead of its matching rows; only
+        the aggregate's partials are gathered.
+
+        Args:
+            vehicle_df (pd.DataFrame): The vehicle DataFrame (rank 0 only).
+            test_df (pd.DataFrame): The test DataFrame (rank 0 only).
+            search_criteria_batch (list): search_criteria dicts as built by MainWindow.search.
+
+        Returns:
+            list: The matching rows of each search on rank 0, None elsewhere.
+        """
+        return self.search_batch_with_stats(vehicle_df, test_df, search_criteria_batch)[0]
+
+    def search_with_stats(self, vehicle_df, test_df, search_criteria):
+        """
+        Runs a search like search() and also returns what it cost.
+
+        Returns:
+            tuple: (pd.DataFrame of matching rows, QueryStats) on rank 0, (None, None) elsewhere.
+        """
+        results, stats = self.search_batch_with_stats(vehicle_df, test_df, [search_criteria])
+        return (results[0], stats) if results is not None else (None, None)
+
+    def search_batch_with_stats(self, vehicle_df, test_df, search_criteria_batch):
+        """
+        Runs several searches like search_batch and also returns what the query cost: rows scanned
+        and matched per rank, bytes shipped each way, wall time per phase and index hits.
+
+        Returns:
+            tuple: (list of matching rows per search, QueryStats) on rank 0, (None, None) elsewhere.
+        """
+        stats = QueryStats(len(search_criteria_batch))
+        if self.backend is None:
+            with tracer.span("bcast criteria", "comm"), stats.phase("bcast"):
+                search_criteria_batch = self.comm.bcast(search_criteria_batch, root=0)
+            results = self.distribute_search_batch(vehicle_df, test_df, search_criteria_batch, stats)
+            return (results, stats.finish(results)) if results is not None else (None, None)
+
+        lookups = [lookup_key(search_criteria) for search_criteria in search_criteria_batch]
+        if any(lookups):
+            # Lookups are answered from rank 0's own id index; the backend only gets the searches
+            return self.local_lookup_batch(vehicle_df, test_df, search_criteria_batch, lookups, stats)
+        with tracer.span("query", "query", searches=len(search_criteria_batch)), stats.phase("backend search"):
+            criteria_batch, exports = split_exports(search_criteria_batch)
+            search_kwargs_batch, aggregates = split_aggregates(criteria_batch)
+            for export in filter(None, exports):
+                clear_export(export)
+            if vehicle_df is None or vehicle_df.empty or test_df is None or test_df.empty:
+                results = summarize([pd.DataFrame(columns=RESULT_COLUMNS) for _ in search_criteria_batch], aggregates)
+            else:
+                results = self.backend.search_batch(vehicle_df, test_df, search_kwargs_batch, aggregates)
+            # Rank 0 is the only process, so it writes every export as a single file
+            results = finalize([rows if export is None else write_part(rows, export, part_name(0, export))
+                                for rows, export in zip(results, exports)], aggregates)
+            results = self.finish_exports(search_criteria_batch, exports, results)
+        tracer.flush()
+        return results, stats.finish(results)
+
+    def distribute_search(self, vehicle_df, test_df, make=None, model=None, year=None, min_mileage=None, max_mileage=None,
+                          min_test_date=None, max_test_date=None):
+        """Distributes a single search among MPI processes; see distribute_search_batch."""
+        search_criteria = {'make': make, 'model': model, 'year': year,
+                           'min_mileage': min_mileage, 'max_mileage': max_mileage,
+                           'min_test_date': min_test_date, 'max_test_date': max_test_date}
+        results = self.distribute_search_batch(vehicle_df, test_df, [search_criteria])
+        return results[0] if results is not None else None
+
+    def distribute_search_batch(self, vehicle_df, test_df, search_criteria_batch, stats=None):
         """
-        Distributes the search operation among MPI processes.
+        Distributes a batch of searches among MPI processes.
+
+        With node shared windows or the column store every process searches its own share; otherwise
+        rank 0 scatters aligned chunks first. An out-of-core column store hands the share out in
+        blocks that are scanned one after another, and zones of a share that the partition's
+        ZoneMap rules out are not read at all. Every rank sends its scan counters along with its
+        results, and rank 0 puts them into stats when given.
         """
         print(f"Rank {self.rank}: Entering distribute_search")  # Debug print
+        if stats is None:
+            stats = QueryStats(len(search_criteria_batch))
+        lookups = [lookup_key(search_criteria) for search_criteria in search_criteria_batch]
+        if any(lookups):
+            return self.distribute_lookup_batch(vehicle_df, test_df, search_criteria_batch, lookups, stats)
+
+        criteria_batch, exports = split_exports(search_criteria_batch)
+        search_kwargs_batch, aggregates = split_aggregates(criteria_batch)
+        if any(exports):
+            # Earlier files go before any rank writes new ones
+            if self.rank == 0:
+                for export in filter(None, exports):
+                    clear_export(export)
+            self.comm.Barrier()
+        with tracer.span("query", "query", searches=len(search_criteria_batch)):
+            with stats.phase("distribute"):
+                regional = self.regional_partials(search_kwargs_batch, aggregates)
+                if regional is not None:
+                    # Answered from the share's counters; no row is read or scanned
+                    blocks, zones_skipped = [], None
+                    if self.rank == 0:
+                        stats.count('regional_counters_used', len(search_kwargs_batch))
+                elif self.partition is not None:
+                    # Every rank scans its own share of its node's shared window; nothing is scattered
+                    with tracer.span("read rows", "partition"):
+                        blocks, zones_skipped = self.local_blocks(search_kwargs_batch)
+                    if self.rank == 0:
+                        stats.count('shares_read_locally', self.size)
+                else:
+                    blocks, zones_skipped = [(*self.scatter_frames(vehicle_df, test_df, stats), None)], None
+
+            # Perform the searches on each worker node in one shared scan per block
+            scan_started = time.perf_counter()
+            with tracer.span("search", "compute"):
+                if regional is not None:
+                    local_results, vehicles_scanned, tests_scanned, rows_matched = regional, 0, 0, 0
+                    self.index_counters = {}
+                else:
+                    local_results, vehicles_scanned, tests_scanned, rows_matched = \
+                        self.scan_blocks(blocks, search_kwargs_batch, aggregates)
+            local_stats = {
+                'vehicles_scanned': vehicles_scanned,
+                'tests_scanned': tests_scanned,
+                'rows_matched': rows_matched,
+                'scan_seconds': time.perf_counter() - scan_started,
+                'indexes': dict(self.index_counters),
+            }
+            if zones_skipped is not None:
+                local_stats['indexes']['zones_skipped'] = zones_skipped
+            stats.add_time("scan", local_stats['scan_seconds'])
+
+            if any(exports):
+                # Every rank writes its own matches; only the names of the files are gathered
+                with tracer.span("export rows", "serialize"), stats.phase("export"):
+                    local_results = [self.export_rows(rows, export) if export is not None else rows
+                                     for rows, export in zip(local_results, exports)]
+
+            # Debug print after combined_search
+            print(f"Rank {self.rank}: combined_search completed for {len(local_results)} searches, "
+                  f"{local_stats['rows_matched']} rows")
+
+            # Gather the results from all worker nodes, serialized here so that their size is known;
+            # rank 0's own share never leaves the process and is not compressed
+            with tracer.span("serialize results", "serialize"):
+                message = codec.dumps((local_results, local_stats), compress=self.rank != 0)
+            with tracer.span("gather results", "comm", bytes=len(message)), stats.phase("gather"):
+                messages = self.comm.gather(message, root=0)
+            print(f"Rank {self.rank}: Gather completed")  # Debug print
+
+            if self.rank == 0:
+                with tracer.span("deserialize results", "serialize"), stats.phase("gather"):
+                    gathered = [codec.loads(message, stats.worker(rank)) for rank, message in enumerate(messages)]
+                for rank, (message, (rank_results, rank_stats)) in enumerate(zip(messages, gathered)):
+                    counters = stats.worker(rank)
+                    counters['tasks'] += 1
+                    counters['bytes_received'] += len(message)
+                    for name, count in rank_stats.pop('indexes').items():
+                        stats.count(name, count)
+                    for name, value in rank_stats.items():
+                        counters[name] += value
 
+                # Combine the results on the master node, search by search
+                with tracer.span("aggregate results", "aggregate"), stats.phase("merge"):
+                    combined_results = finalize([combine([rank_results[index] for rank_results, _ in gathered],
+                                                         aggregate)
+                                                 for index, aggregate in enumerate(aggregates)], aggregates)
+                combined_results = self.finish_exports(search_criteria_batch, exports, combined_results)
+            else:
+                combined_results = None
+
+        if tracer.enabled:
+            # Every rank was started with the same --trace, so all of them join this gather
+            tracer.flush(self.comm.gather(tracer.drain(), root=0))
+        return combined_results
+
+    def export_rows(self, rows, export):
+        """
+        Writes this rank's matches of an exported search: to a file of its own, or for a single_file
+        export into the export's one CSV file, which all ranks write together.
+
+        Returns:
+            pd.DataFrame: The part rows (see analysis.export) this rank adds to the manifest.
+        """
+        if not export['single_file']:
+            return write_part(rows, export, part_name(self.rank, export))
+
+        # Each rank writes its text at the offset where that of the ranks before it ends, so the
+        # file holds the rows in rank order, the same order a search returns them in
+        text = rows.to_csv(index=False, header=self.rank == 0).encode()
+        offset = self.comm.exscan(len(text)) or 0
+        size = self.comm.allreduce(len(text))
+        num_rows = self.comm.reduce(len(rows), root=0)
+        name = part_name(0, export)
+        path = os.path.join(export['directory'], name)
+        handle = MPI.File.Open(self.comm, path + ".partial", MPI.MODE_WRONLY | MPI.MODE_CREATE)
+        try:
+            handle.Set_size(size)
+            handle.Write_at_all(offset, text)
+        finally:
+            handle.Close()
+        if self.rank != 0:
+            return empty_parts()
+        os.replace(path + ".partial", path)
+        return pd.DataFrame({'file': [name], 'rows': [num_rows], 'bytes': [size]})
+
+    @staticmethod
+    def finish_exports(search_criteria_batch, exports, results):
+        """Writes the manifest of every exported search, whose result is the list of its files in row order."""
+        return [parts if export is None else write_manifest(export, parts, search_criteria)
+                for search_criteria, export, parts in zip(search_criteria_batch, exports, results)]
+
+    def lookup_index(self, vehicle_df, test_df):
+        """
+        Collective on first use: builds this rank's id index and gathers the Bloom filters of all
+        ranks on rank 0.
+
+        With a partition every rank indexes its own share; otherwise rank 0 holds all rows and is
+        the only rank with an index.
+
+        Returns:
+            tuple: (source of the indexed rows, IdIndex or None, Bloom filters per rank on rank 0)
+        """
+        if self._lookup is None:
+            with tracer.span("build lookup index", "partition"):
+                if self.partition is not None:
+                    start, stop = self.partition.rank_range()
+                    source, index = self.partition, IdIndex(self.partition.blocks(start, stop), start)
+                elif self.rank == 0 and vehicle_df is not None and not vehicle_df.empty and test_df is not None:
+                    source = FrameSource(vehicle_df, test_df)
+                    index = IdIndex(source.blocks())
+                else:
+                    source = index = None
+            if index is not None:
+                print(f"Rank {self.rank}: Lookup index over {len(index)} vehicles")
+            filters = self.comm.gather(index.filters if index is not None else None, root=0)
+            self._lookup = (source, index, filters)
+        return self._lookup
+
+    def local_lookup_batch(self, vehicle_df, test_df, search_criteria_batch, lookups, stats):
+        """
+        Answers the lookups of a batch on rank 0 alone, for the local execution backends, and the
+        other searches of the batch through search_batch_with_stats.
+        """
+        results = [None] * len(search_criteria_batch)
+        searches = [position for position, key in enumerate(lookups) if key is None]
+        if searches:
+            search_results, search_stats = self.search_batch_with_stats(
+                vehicle_df, test_df, [search_criteria_batch[position] for position in searches])
+            for position, rows in zip(searches, search_results):
+                results[position] = rows
+            for name, seconds in search_stats.phases.items():
+                stats.add_time(name, seconds)
+        with tracer.span("lookup", "query", lookups=len(lookups) - len(searches)), stats.phase("lookup"):
+            if self._lookup is None and vehicle_df is not None and not vehicle_df.empty:
+                source = FrameSource(vehicle_df, test_df)
+                self._lookup = (source, IdIndex(source.blocks()), None)
+            source, index, _ = self._lookup or (None, None, None)
+            for position, key in enumerate(lookups):
+                if key is not None:
+                    results[position] = history(source, index, *key, RESULT_COLUMNS) if index is not None \
+                        else pd.DataFrame(columns=RESULT_COLUMNS)
+                    stats.count('lookups')
+        tracer.flush()
+        return results, stats.finish(results)
+
+    def distribute_lookup_batch(self, vehicle_df, test_df, search_criteria_batch, lookups, stats):
+        """
+        Answers the lookups of a batch from the ranks' id indexes; the other searches of the batch
+        run through distribute_search_batch as usual.
+
+        Every rank tests its own Bloom filters and answers the lookups they may hold in a single
+        point-to-point message, while rank 0 tests its copies of all ranks' filters to know whom to
+        wait for. Ranks that cannot hold an id read no rows and send nothing; a Bloom false positive
+        costs one empty answer.
+        """
+        results = [None] * len(search_criteria_batch)
+        searches = [position for position, key in enumerate(lookups) if key is None]
+        if searches:
+            search_results = self.distribute_search_batch(
+                vehicle_df, test_df, [search_criteria_batch[position] for position in searches], stats)
+            if self.rank == 0:
+                for position, rows in zip(searches, search_results):
+                    results[position] = rows
+
+        with tracer.span("lookup", "query", lookups=len(lookups) - len(searches)), stats.phase("lookup"):
+            source, index, filters = self.lookup_index(vehicle_df, test_df)
+            answers = {}
+            if index is not None:
+                for position, key in enumerate(lookups):
+                    if key is not None and key[1] in index.filters[key[0]]:
+                        answers[position] = history(source, index, *key, RESULT_COLUMNS)
+
+            if self.rank != 0:
+                if answers:
+                    with tracer.span("send lookup", "comm"):
+                        self.comm.send(codec.dumps(answers), dest=0, tag=LOOKUP_TAG)
+            else:
+                candidates = {position: [rank for rank, rank_filters in enumerate(filters)
+                                         if rank_filters is not None and key[1] in rank_filters[key[0]]]
+                              for position, key in enumerate(lookups) if key is not None}
+                gathered = {0: answers}
+                for rank in sorted({rank for ranks in candidates.values() for rank in ranks} - {0}):
+                    with tracer.span("recv lookup", "comm", rank=rank):
+                        message = self.comm.recv(source=rank, tag=LOOKUP_TAG)
+                    gathered[rank] = codec.loads(message, stats.worker(rank))
+                    stats.worker(rank)['bytes_received'] += len(message)
+                for rank, rank_answers in gathered.items():
+                    if rank_answers:
+                        counters = stats.worker(rank)
+                        counters['tasks'] += 1
+                        counters['rows_matched'] += sum(len(rows) for rows in rank_answers.values())
+
+                for position, ranks in candidates.items():
+                    found = [gathered[rank][position] for rank in ranks if not gathered[rank][position].empty]
+                    results[position] = found[0] if found else pd.DataFrame(columns=RESULT_COLUMNS)
+                    stats.count('lookups')
+                    stats.count('lookup_ranks_contacted', len(ranks))
+                    stats.count('bloom_false_positives', len(ranks) - len(found))
+
+        if tracer.enabled:
+            tracer.flush(self.comm.gather(tracer.drain(), root=0))
+        return results if self.rank == 0 else None
+
+    def local_blocks(self, search_kwargs_batch):
+        """
+        This rank's share of the partition as blocks, leaving out the zones no search of the batch
+        can match.
+
+        Returns:
+            tuple: (blocks, number of zones skipped, or None when the zone map was not consulted)
+        """
+        start, stop = self.partition.rank_range()
+        zone_map = self.partition.zone_map
+        ranges, skipped = [(start, stop)], None
+        if zone_map is not None and any(search_conditions(search_kwargs) for search_kwargs in search_kwargs_batch):
+            zone_ranges, skipped = zone_map.ranges(start, stop, search_kwargs_batch)
+            if skipped:
+                # An empty range still yields empty frames, so every rank sends results of the usual shape
+                ranges = zone_ranges or [(start, start)]
+        if not skipped and self.partition.block_rows is None:
+            # The whole share fits in memory: the partition's cached frames
+            return [(*self.partition.local_frames(), self.partition.date_index(start, stop))], skipped
+        return self.partition_blocks(ranges), skipped
+
+    def regional_partials(self, search_kwargs_batch, aggregates):
+        """
+        The regional_pass_rates partials of this rank's share for a batch whose searches are all
+        regional ones filtering on make, model and year only, or None when the batch must be scanned.
+
+        The counters are built from the partition on first use and kept, so later such batches
+        read no rows. Every rank decides the same way from the batch alone.
+        """
+        if self.partition is None or not all(
+                isinstance(aggregate, RegionalPassRates) and RegionalCounters.covers(search_kwargs)
+                for search_kwargs, aggregate in zip(search_kwargs_batch, aggregates)):
+            return None
+        if self._regional is None:
+            with tracer.span("build regional counters", "partition"):
+                self._regional = RegionalCounters.build(self.partition.local_blocks())
+            print(f"Rank {self.rank}: Regional counters over {len(self._regional.counts)} groups")
+        return [self._regional.partial(search_kwargs) for search_kwargs in search_kwargs_batch]
+
+    def scan_blocks(self, blocks, search_kwargs_batch, aggregates=None):
+        """
+        Runs a batch of searches over (vehicle_df, test_df, date_index) blocks one after another.
+
+        Each search's matches are joined in block order, or for an aggregated search (aggregates
+        holds an Aggregate or None per search) turned into a partial per block and merged.
+        index_counters sums the counters of all blocks. Out of core only one block of the column
+        store is decoded at a time.
+
+        Returns:
+            tuple: (results or partials per search, vehicles scanned, tests scanned, rows matched)
+        """
+        aggregates = aggregates or [None] * len(search_kwargs_batch)
+        block_results = [[] for _ in search_kwargs_batch]
+        counters = {'indexes_built': 0, 'index_lookups': 0}
+        vehicles_scanned = tests_scanned = rows_matched = num_blocks = 0
+        for local_vehicle_df, local_test_df, date_index in blocks:
+            with tracer.span("scan block", "compute", rows=len(local_vehicle_df)):
+                results = [categoricals_to_objects(search_results) for search_results in
+                           self.combined_search_batch(local_vehicle_df, local_test_df, search_kwargs_batch,
+                                                      date_index)]
+            rows_matched += sum(len(search_results) for search_results in results)
+            for index, search_results in enumerate(summarize(results, aggregates)):
+                block_results[index].append(search_results)
+            for name, count in self.index_counters.items():
+                counters[name] += count
+            vehicles_scanned += len(local_vehicle_df)
+            tests_scanned += len(local_test_df)
+            num_blocks += 1
+        if num_blocks > 1:
+            counters['blocks_scanned'] = num_blocks
+        self.index_counters = counters
+        local_results = [parts[0] if len(parts) == 1 and aggregate is None else combine(parts, aggregate)
+                         for parts, aggregate in zip(block_results, aggregates)]
+        return local_results, vehicles_scanned, tests_scanned, rows_matched
+
+    def partition_blocks(self, ranges):
+        """
+        The partition's blocks over vehicle row ranges as scan_blocks takes them: a block per range,
+        or per block_rows vehicles out of core, each with the date index of its tests.
+        """
+        for range_start, range_stop in ranges:
+            for start, stop in self.partition.block_ranges(range_start, range_stop):
+                yield (*self.partition.frames(start, stop), self.partition.date_index(start, stop))
+
+    def scatter_frames(self, vehicle_df, test_df, stats=None):
+        """
+        Sends every process its chunk of rank 0's DataFrames.
+
+        Both frames are aligned by vehicle_id and cut into contiguous vehicle ranges, so each chunk
+        holds complete vehicles together with all of their tests. Chunks for other ranks are
+        compressed when the codec expects that to pay off. Rank 0 records the size of each chunk
+        and what compression saved in stats when given.
+        """
         if self.rank == 0:
-            # Master node
-            # Check if DataFrames are empty
-            if vehicle_df is None or vehicle_df.empty:
-                print("Rank 0: vehicle_df is empty. Returning empty results.")
-                return pd.DataFrame()  # Return an empty DataFrame
-
-            if test_df is None or test_df.empty:
-                print("Rank 0: test_df is empty. Returning empty results.")
-                return pd.DataFrame()
-
-            # Divide the data into chunks for each worker
-            vehicle_chunks = [pd.DataFrame() for _ in range(self.size)]
-            test_chunks = [pd.DataFrame() for _ in range(self.size)]
-
-            if vehicle_df is not None:
-                vehicle_df.reset_index(drop=True, inplace=True)
-                vehicle_chunks = [vehicle_df[i::self.size] for i in range(self.size)]
-            if test_df is not None:
-                test_chunks = [test_df[i::self.size] for i in range(self.size)]
+            if vehicle_df is None or test_df is None:
+                vehicle_df, test_df = pd.DataFrame(columns=['vehicle_id']), pd.DataFrame(columns=['vehicle_id'])
+            with tracer.span("align frames", "partition", rows=len(vehicle_df)):
+                vehicle_df, test_df, test_offsets = DataFrameCreator().align_by_vehicle(vehicle_df, test_df)
+                bounds = [len(vehicle_df) * i // self.size for i in range(self.size + 1)]
+                vehicle_chunks = [vehicle_df.iloc[bounds[i]:bounds[i + 1]] for i in range(self.size)]
+                test_chunks = [test_df.iloc[test_offsets[bounds[i]]:test_offsets[bounds[i + 1]]]
+                               for i in range(self.size)]
 
             # Debug prints for master node
-            print(f"Rank {self.rank}: vehicle_chunks length: {len(vehicle_chunks)}")
-            print(f"Rank {self.rank}: test_chunks length: {len(test_chunks)}")
             for i, chunk in enumerate(vehicle_chunks):
                 print(f"Rank {self.rank}: vehicle_chunks[{i}] shape: {chunk.shape}")
             for i, chunk in enumerate(test_chunks):
                 print(f"Rank {self.rank}: test_chunks[{i}] shape: {chunk.shape}")
 
+            with tracer.span("serialize chunks", "serialize"):
+                chunks = [codec.dumps(chunk, stats.worker(rank) if stats is not None else None, compress=rank != 0)
+                          for rank, chunk in enumerate(zip(vehicle_chunks, test_chunks))]
+            if stats is not None:
+                for rank, chunk in enumerate(chunks):
+                    stats.worker(rank)['bytes_sent'] += len(chunk)
+                stats.count('shares_scattered', len(chunks))
         else:
-            vehicle_chunks = None
-            test_chunks = None
+            chunks = None
 
-        # Scatter the data chunks to worker nodes
-        local_vehicle_df = self.comm.scatter(vehicle_chunks, root=0)
-        local_test_df = self.comm.scatter(test_chunks, root=0)
+        # Scatter the data chunks to worker nodes, one message per process
+        with tracer.span("scatter frames", "comm"):
+            chunk = self.comm.scatter(chunks, root=0)
+        with tracer.span("deserialize chunk", "serialize", bytes=len(chunk)):
+            local_vehicle_df, local_test_df = codec.loads(chunk)
 
         # Debug prints for all nodes
-        print(f"Rank {self.rank}: Received local_vehicle_df with shape: {local_vehicle_df.shape if local_vehicle_df is not None else 'None'}")
-        print(f"Rank {self.rank}: Received local_test_df with shape: {local_test_df.shape if local_test_df is not None else 'None'}")
-
-        # Perform search on each worker node
-        local_results = self.combined_search(local_vehicle_df, local_test_df, make, model, year, min_mileage, max_mileage)
-
-        # Debug print after combined_search
-        print(f"Rank {self.rank}: combined_search completed, results shape: {local_results.shape if local_results is not None else 'None'}")
-
-        # Gather the results from all worker nodes
-        all_results = self.comm.gather(local_results, root=0)
-        print(f"Rank {self.rank}: Gather completed")  # Debug print
-
-        if self.rank == 0:
-            # Combine the results on the master node
-            combined_results = pd.concat(all_results)
-            return combined_results
-        else:
-            return None
+        print(f"Rank {self.rank}: Received local_vehicle_df with shape: {local_vehicle_df.shape}")
+        print(f"Rank {self.rank}: Received local_test_df with shape: {local_test_df.shape}")
+        return local_vehicle_df, local_test_df
 
     def combined_search(self, local_vehicle_df, local_test_df, make=None, model=None, year=None, min_mileage=None,
-                        max_mileage=None):
+                        max_mileage=None, min_test_date=None, max_test_date=None, date_index=None):
         """
         Performs a combined search based on multiple criteria.
 
@@ -100,9 +568,13 @@ class SearchAnalyzer:
             year (int, optional): The year of first use to search for.
             min_mileage (int, optional): The minimum mileage.
             max_mileage (int, optional): The maximum mileage.
+            min_test_date (str, optional): The first test date, as YYYY-MM-DD.
+            max_test_date (str, optional): The last test date, as YYYY-MM-DD.
+            date_index (DateIndex, optional): The partition's date index over the local tests.
 
         Returns:
-            pd.DataFrame: A DataFrame containing the matching results.
+            pd.DataFrame: A DataFrame containing the matching results. With a test date range only
+            the tests taken in it are returned.
         """
 
         print(f"Rank {self.rank}: Entering combined_search")
@@ -126,22 +598,157 @@ class SearchAnalyzer:
             # Filter vehicles based on the vehicle_ids from the filtered tests
             filtered_vehicles = filtered_vehicles[filtered_vehicles['vehicle_id'].isin(filtered_vehicle_ids)]
 
+        # A test date range keeps only the tests taken in it
+        matching_tests = local_test_df
+        if min_test_date or max_test_date:
+            matching_tests = self.search_by_test_date(local_test_df, min_test_date, max_test_date, date_index)
+
         # Merge to get all details
-        if not filtered_vehicles.empty and not local_test_df.empty:
-            merged_df = pd.merge(filtered_vehicles, local_test_df, on='vehicle_id')
+        if not filtered_vehicles.empty and not matching_tests.empty:
+            merged_df = pd.merge(filtered_vehicles, matching_tests, on='vehicle_id')
         else:
             # Create an empty DataFrame with the desired columns if one of them is empty
-            merged_df = pd.DataFrame(columns=['test_id', 'vehicle_id', 'test_date', 'test_class_id', 'test_type',
-                                              'test_result', 'test_mileage', 'postcode_area', 'make', 'model',
-                                              'colour', 'fuel_type', 'cylinder_capacity', 'first_use_date'])
+            merged_df = pd.DataFrame(columns=RESULT_COLUMNS)
 
         # Select and reorder columns to match the desired output
-        columns_to_display = ['test_id', 'vehicle_id', 'test_date', 'test_class_id', 'test_type',
-                              'test_result', 'test_mileage', 'postcode_area', 'make', 'model',
-                              'colour', 'fuel_type', 'cylinder_capacity', 'first_use_date']
-
         # More robust column selection
-        merged_df = merged_df.reindex(columns=columns_to_display, fill_value=None)
+        merged_df = merged_df.reindex(columns=RESULT_COLUMNS, fill_value=None)
 
         print(f"Rank {self.rank}: Exiting combined_search")
         return merged_df
+
+    def combined_search_batch(self, local_vehicle_df, local_test_df, search_kwargs_batch, date_index=None):
+        """
+        Answers several combined searches in a single scan over the local vehicles and tests.
+
+        Everything the searches filter on is prepared once for the whole batch: vehicle positions
+        grouped by make and by model, the first-use year, the tests sorted by mileage and by test
+        date, and the tests grouped by vehicle. A test date range is a binary search per run of the
+        partition's date_index, which is sorted once at load time; frames from elsewhere are sorted
+        by date here. Each search then picks its vehicles from those indexes and gathers their
+        tests from the per-vehicle runs instead of filtering and merging the frames again, so extra
+        searches cost little more than the size of their results.
+
+        Args:
+            local_vehicle_df (pd.DataFrame): The local vehicle DataFrame.
+            local_test_df (pd.DataFrame): The local test DataFrame.
+            search_kwargs_batch (list): combined_search keyword arguments, one dict per search.
+            date_index (DateIndex, optional): The partition's date index over the local tests.
+
+        Returns:
+            list: For each search, the DataFrame combined_search would return for it.
+        """
+        self.index_counters = {'indexes_built': 0, 'index_lookups': 0}
+        if len(search_kwargs_batch) < 2 or local_vehicle_df.empty or local_test_df.empty:
+            return [self.combined_search(local_vehicle_df, local_test_df, date_index=date_index, **search_kwargs)
+                    for search_kwargs in search_kwargs_batch]
+
+        print(f"Rank {self.rank}: Entering combined_search_batch with {len(search_kwargs_batch)} searches")
+        num_vehicles = len(local_vehicle_df)
+
+        # vehicle_id codes shared by both frames; missing ids match each other, as in pd.merge
+        codes, uniques = pd.factorize(pd.concat([local_vehicle_df['vehicle_id'], local_test_df['vehicle_id']],
+                                                ignore_index=True), use_na_sentinel=False)
+        vehicle_codes, test_codes = codes[:num_vehicles], codes[num_vehicles:]
+        # Tests grouped by vehicle, keeping their order within each vehicle
+        tests_by_vehicle = np.argsort(test_codes, kind='stable')
+        test_counts = np.bincount(test_codes, minlength=len(uniques))
+        test_starts = np.concatenate(([0], np.cumsum(test_counts)[:-1]))
+
+        make_groups = model_groups = years = None
+        mileage_order = sorted_mileage = None
+
+        results = []
+        for search_kwargs in search_kwargs_batch:
+            make, model, year = search_kwargs.get('make'), search_kwargs.get('model'), search_kwargs.get('year')
+            min_mileage, max_mileage = search_kwargs.get('min_mileage'), search_kwargs.get('max_mileage')
+            min_test_date, max_test_date = search_kwargs.get('min_test_date'), search_kwargs.get('max_test_date')
+            selected = None  # Sorted vehicle positions; None while every vehicle still matches
+            test_mask = None  # Test rows in the test date range; None without one
+
+            if make:
+                if make_groups is None:
+                    make_groups = local_vehicle_df.groupby('make', observed=True, sort=False).indices
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                selected = self._select(selected, make_groups.get(make.upper()))
+            if model:
+                if model_groups is None:
+                    model_groups = local_vehicle_df.groupby('model', observed=True, sort=False).indices
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                selected = self._select(selected, model_groups.get(model.upper()))
+            if year:
+                if years is None:
+                    years = pd.to_datetime(local_vehicle_df['first_use_date']).dt.year.to_numpy()
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                selected = np.flatnonzero(years == year) if selected is None else selected[years[selected] == year]
+            if min_mileage is not None and max_mileage is not None:
+                if mileage_order is None:
+                    mileage = pd.to_numeric(local_test_df['test_mileage'], errors='coerce').to_numpy(dtype=float)
+                    mileage_order = np.argsort(mileage, kind='stable')  # NaN sorts last and never matches
+                    sorted_mileage = mileage[mileage_order][:np.count_nonzero(~np.isnan(mileage))]
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                low = np.searchsorted(sorted_mileage, min_mileage, side='left')
+                high = np.searchsorted(sorted_mileage, max_mileage, side='right')
+                tested = np.zeros(len(uniques), dtype=bool)
+                tested[test_codes[mileage_order[low:high]]] = True
+                selected = np.flatnonzero(tested[vehicle_codes]) if selected is None \
+                    else selected[tested[vehicle_codes[selected]]]
+            if min_test_date or max_test_date:
+                if date_index is None:
+                    date_index = DateIndex.build(date_values(local_test_df['test_date']))
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                start, stop = test_date_bounds(min_test_date, max_test_date)
+                test_mask = date_index.mask(start, stop, local_test_df['test_date'])
+                dated = np.zeros(len(uniques), dtype=bool)
+                dated[test_codes[test_mask]] = True
+                selected = np.flatnonzero(dated[vehicle_codes]) if selected is None \
+                    else selected[dated[vehicle_codes[selected]]]
+
+            if selected is None:
+                selected = np.arange(num_vehicles)
+            results.append(self._gather_matches(local_vehicle_df, local_test_df, selected, vehicle_codes,
+                                                tests_by_vehicle, test_counts, test_starts, test_mask))
+
+        print(f"Rank {self.rank}: Exiting combined_search_batch")
+        return results
+
+    @staticmethod
+    def _select(selected, positions):
+        """Narrows a sorted array of vehicle positions (None meaning all) to those in positions."""
+        if positions is None:
+            return np.empty(0, dtype=np.intp)
+        if selected is None:
+            return positions
+        return np.intersect1d(selected, positions, assume_unique=True)
+
+    @staticmethod
+    def _gather_matches(vehicle_df, test_df, selected, vehicle_codes, tests_by_vehicle, test_counts, test_starts,
+                        test_mask=None):
+        """
+        Pairs the selected vehicles with all of their tests (only those in test_mask when given), in
+        the row order pd.merge produces: vehicles in their own order, and each vehicle's tests in theirs.
+        """
+        if len(selected) == 0:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        selected_codes = vehicle_codes[selected]
+        counts = test_counts[selected_codes]
+        total = int(counts.sum())
+        vehicle_take = np.repeat(selected, counts)
+        run_offsets = np.repeat(test_starts[selected_codes] - (np.cumsum(counts) - counts), counts)
+        test_take = tests_by_vehicle[run_offsets + np.arange(total)]
+        if test_mask is not None:
+            keep = test_mask[test_take]
+            vehicle_take, test_take = vehicle_take[keep], test_take[keep]
+
+        data = {}
+        for column in RESULT_COLUMNS:
+            if column == 'vehicle_id' or (column in vehicle_df.columns and column not in test_df.columns):
+                data[column] = vehicle_df[column].array.take(vehicle_take)
+            elif column in test_df.columns and column not in vehicle_df.columns:
+                data[column] = test_df[column].array.take(test_take)
+        return pd.DataFrame(data).reindex(columns=RESULT_COLUMNS, fill_value=None)
@@ -1,40 +1,176 @@
-from data.modules.data_cleaner import DataCleaner
-from data.modules.data_loader import DataLoader
-import gui.gui_main as gui  # Import the GUI code
+import argparse
 import os
-from mpi4py import MPI
+from startup import StartupReport
+from tracing import tracer
+
+startup = StartupReport()  # Created first so that the report covers the imports below
+
+from data.modules.data_cleaner import DataCleaner
+from data.modules.data_loader import DataLoader, MPI
+from analysis.backends import BACKENDS
+from analysis.completion import CompletionIndex
+from analysis.transport import codec, MODES as COMPRESSION_MODES
 import pandas as pd
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank()
-size = comm.Get_size()
 
-def main():
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MOT data analysis (data parallel model)")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.environ.get("MOT_BACKEND", "mpi"),
+                        help="'mpi' runs under mpiexec, 'shm' runs on a local process pool without MPI")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of pool processes for the 'shm' backend (default: all cores)")
+    parser.add_argument("--no-shared-windows", action="store_true",
+                        help="Scatter rank 0's data on every search instead of using per-node MPI shared windows")
+    parser.add_argument("--distributed-tables", action="store_true",
+                        help="Build the vehicle and test tables as per-rank shards (hashed by vehicle_id) "
+                             "instead of on rank 0, and cache them per rank")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="Out-of-core mode: spill the ingest to disk and scan the column store in blocks so "
+                             "that each rank stays within about this many MB")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Print how long every rank took to import, load and get ready")
+    parser.add_argument("--eager-gui-imports", action="store_true",
+                        help="Import PyQt5 and Matplotlib on every rank, as before, to compare startup")
+    parser.add_argument("--serve", action="store_true",
+                        help="Also answer search and pass-rate requests over HTTP/JSON on rank 0")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the query service on localhost")
+    parser.add_argument("--no-gui", action="store_true",
+                        help="Run only the query service on rank 0, without a window")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="Record per-rank spans and write them as a Chrome trace (chrome://tracing, Perfetto)")
+    parser.add_argument("--compression", choices=COMPRESSION_MODES, default="off",
+                        help="Compress result frames and partitions sent between ranks; 'auto' picks zlib, lzma "
+                             "or no compression per message")
+    parser.add_argument("--link-bandwidth", type=float, default=1000,
+                        help="MB/s a message gets on the interconnect; lower values make compression pay off sooner")
+    return parser.parse_args()
+
+
+def start_backend(args):
+    """Creates the execution backend chosen on the command line and the matching communicator."""
+    if args.backend == "shm":
+        from analysis.backends import SharedMemoryBackend
+        backend = SharedMemoryBackend(args.processes)
+        return backend, None, 0, 1
+    comm = MPI.COMM_WORLD
+    return None, comm, comm.Get_rank(), comm.Get_size()
+
+
+def load_data(args, backend, comm, rank, size, rows_per_file=None):
+    """
+    Loads the data on every rank and decides where each rank reads its rows from.
+
+    rows_per_file overrides how many rows are read from each CSV file (benchmarks use it).
+
+    Returns:
+        tuple: (vehicle_df, test_df, partition); the frames are only held by rank 0, and not even
+        there when the column store is mapped, the tables are distributed or out of core.
+    """
     # Initialize DataCleaner and DataLoader
     data_cleaner = DataCleaner()
 
     # Set load_all_rows to False to load 50,000 rows, True to load 1,000,000 rows
     load_all_rows = False
-    rows_per_file = 1000 if not load_all_rows else 1000000
+    if rows_per_file is None:
+        rows_per_file = 1000 if not load_all_rows else 1000000
 
-    data_loader = DataLoader(data_cleaner, rows_per_file)
+    data_loader = DataLoader(data_cleaner, rows_per_file, backend=backend)
     # Distribute work and get the DataFrames on the master node
 
-    if os.path.isfile("database/local_db/vehicle_df.pkl"):
-        if rank == 0:
-            print("Loading data from Pickle files...")
-            vehicle_df = pd.read_pickle("database/local_db/vehicle_df.pkl")
-            test_df = pd.read_pickle("database/local_db/test_df.pkl")
-            print("DataFrames loaded from Pickle files.")
-        else:
-            vehicle_df = None
-            test_df = None
+    partition = None
+    vehicle_df = test_df = None
+    if args.distributed_tables and backend is None and size > 1:
+        # Every rank builds, caches and searches its own shard; no rank holds the full tables
+        return vehicle_df, test_df, data_loader.distribute_tables()
+    if args.memory_budget and backend is None:
+        # Ingest and scans stay within the budget; the column store is the only copy of the tables
+        return vehicle_df, test_df, data_loader.load_out_of_core(args.memory_budget * 1e6)
+    if backend is None and data_loader.open_column_store():
+        # Every rank maps its own row range of the column files; nothing is unpickled
+        print(f"Rank {rank}: Mapped column store with {data_loader.store.num_vehicles} vehicles")
+        partition = data_loader.store
     else:
-        print("Loading data from CSV...")
-        vehicle_df, test_df = data_loader.distribute_work()
+        if os.path.isfile("database/local_db/vehicle_df.pkl"):
+            if rank == 0:
+                print("Loading data from Pickle files...")
+                vehicle_df = pd.read_pickle("database/local_db/vehicle_df.pkl")
+                test_df = pd.read_pickle("database/local_db/test_df.pkl")
+                print("DataFrames loaded from Pickle files.")
+        else:
+            print("Loading data from CSV...")
+            vehicle_df, test_df = data_loader.distribute_work()
 
+        if backend is None and data_loader.save_column_store(vehicle_df, test_df):
+            partition = data_loader.store
+
+    # Otherwise place one copy of the columns per node in MPI shared windows
+    if partition is None and backend is None and size > 1 and not args.no_shared_windows:
+        from data.modules.shared_window import NodeSharedFrames
+        partition = NodeSharedFrames(comm)
+        partition.distribute(vehicle_df, test_df)
+
+    return vehicle_df, test_df, partition
+
+
+def start_service(args, backend, comm, rank, size, vehicle_df, test_df, partition, completion=None):
+    """Starts the HTTP/JSON query service on rank 0 in front of a SearchAnalyzer of its own."""
+    from analysis.search_analysis import SearchAnalyzer
+    from analysis.query_service import QueryService
+    search_analyzer = SearchAnalyzer(comm, rank, size, backend, partition)
+    return QueryService(search_analyzer, vehicle_df, test_df, port=args.port, completion=completion)
+
+
+def serve_headless(service, backend, comm, size):
+    """Runs the query service without a window until interrupted, then releases the workers."""
+    try:
+        service.serve_forever()
+    finally:
+        if backend is not None:
+            backend.close()
+        elif size > 1:
+            # Release the workers waiting for the next search criteria
+            comm.bcast(None, root=0)
+
+
+def main():
+    args = parse_args()
+    if args.eager_gui_imports:
+        import gui.gui_main  # noqa: F401
+    startup.mark("imports")
+
+    backend, comm, rank, size = start_backend(args)
+    if args.trace:
+        tracer.enable(rank, args.trace)
+    codec.configure(args.compression, args.link_bandwidth * 1e6)
+    vehicle_df, test_df, partition = load_data(args, backend, comm, rank, size)
+    # Make and model suggestions are answered from rank 0's own index, never by the workers
+    completion = CompletionIndex.gather(comm, rank, vehicle_df, partition)
+    tracer.flush()  # The other ranks' ingest spans follow with their first query results
+    startup.mark("data")
+
+    # Only rank 0 imports the GUI stack; the other ranks stay headless
+    if rank == 0 and not args.no_gui:
+        from gui.gui_main import gui_main
+        startup.mark("gui imports")
+    if args.startup_report:
+        startup.report(comm, rank)
+
+    if rank == 0:
+        service = None
+        if args.serve or args.no_gui:
+            service = start_service(args, backend, comm, rank, size, vehicle_df, test_df, partition, completion)
+        if args.no_gui:
+            serve_headless(service, backend, comm, size)
+        else:
+            if service is not None:
+                service.start()
+            gui_main(comm, rank, size, vehicle_df, test_df, backend, partition, service, completion)
+    else:
+        from worker import worker_main
+        worker_main(comm, rank, size, vehicle_df, test_df, partition)
+        if codec.enabled:
+            print(f"Rank {rank}: {codec.summary()}")
 
-    # Start the GUI and SearchAnalyzer
-    gui.gui_main(comm, rank, size, vehicle_df, test_df)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,472 @@
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from data.modules.date_index import DATE_INDEX_FILES, DateIndex
+from data.modules.zone_maps import ZONE_ROWS, ZoneMap
+
+# String columns with a different value on (nearly) every row. A category list of them would grow
+# with the table, so they are stored as fixed-width byte strings instead
+ID_COLUMNS = ('vehicle_id', 'test_id')
+# Most distinct values the column store writer keeps for a category column; a column that
+# outgrows it is stored as byte strings, like the ID_COLUMNS
+MAX_CATEGORIES = 1 << 16
+# Codes converted to byte strings at a time when a category column outgrows MAX_CATEGORIES
+CONVERT_ROWS = 1 << 20
+
+
+def column_kind(series, byte_columns=ID_COLUMNS):
+    """How encode_columns stores a column: 'datetime', 'numeric', 'bytes' or 'category'."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    if pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        return 'numeric'
+    if series.name in byte_columns:
+        return 'bytes'
+    return 'category'
+
+
+def encode_bytes(series):
+    """Strings as UTF-8 in a byte string array as wide as the longest one; missing values become b''."""
+    return series.astype(object).where(series.notna(), '').astype(str).str.encode('utf-8').to_numpy(dtype=bytes)
+
+
+def decode_bytes(values):
+    """The strings of an encode_bytes array, with None for the empty ones."""
+    strings = pd.Series(values, copy=False).str.decode('utf-8').to_numpy(dtype=object)
+    strings[values == b''] = None
+    return strings
+
+
+def encode_columns(df, categories=None, byte_columns=ID_COLUMNS):
+    """
+    Splits a DataFrame into plain numpy arrays that can live in shared or mapped memory.
+
+    String columns become int32 category codes (-1 for missing), except the byte_columns, which
+    become fixed-width byte strings; datetimes become int64 nanoseconds and numeric columns are
+    kept as they are.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to encode.
+        categories (dict, optional): Category lists to reuse for some columns.
+        byte_columns (collection): String columns to store as byte strings, the ID_COLUMNS by default.
+
+    Returns:
+        tuple: (arrays, meta) where arrays maps column names to numpy arrays and meta holds
+        everything decode_columns needs to rebuild the DataFrame.
+    """
+    categories = categories or {}
+    arrays = {}
+    meta = {'columns': list(df.columns), 'kinds': {}, 'categories': {}, 'length': len(df)}
+
+    for column in df.columns:
+        series = df[column]
+        kind = column_kind(series, byte_columns)
+        if kind == 'datetime':
+            arrays[column] = series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+            meta['kinds'][column] = 'datetime'
+        elif kind == 'numeric':
+            arrays[column] = series.to_numpy()
+            meta['kinds'][column] = 'numeric'
+        elif kind == 'bytes':
+            arrays[column] = encode_bytes(series)
+            meta['kinds'][column] = 'bytes'
+        else:
+            categorical = pd.Categorical(series, categories=categories.get(column))
+            arrays[column] = categorical.codes.astype(np.int32)
+            meta['kinds'][column] = 'category'
+            meta['categories'][column] = list(categorical.categories)
+
+    return arrays, meta
+
+
+def decode_columns(arrays, meta, start=0, stop=None):
+    """
+    Rebuilds a DataFrame over a row range of encoded column arrays.
+
+    Numeric and datetime columns are views of the underlying arrays; category columns come back
+    as pandas Categoricals over the stored codes and byte string columns as plain strings.
+
+    Args:
+        arrays (dict): Column name to numpy array, as produced by encode_columns.
+        meta (dict): The meta dictionary produced by encode_columns.
+        start (int): First row to include.
+        stop (int, optional): Row after the last one to include.
+
+    Returns:
+        pd.DataFrame: The decoded rows.
+    """
+    data = {}
+    for column in meta['columns']:
+        values = arrays[column][start:stop]
+        kind = meta['kinds'][column]
+        if kind == 'datetime':
+            data[column] = values.view('datetime64[ns]')
+        elif kind == 'bytes':
+            data[column] = decode_bytes(values)
+        elif kind == 'category':
+            data[column] = pd.Categorical.from_codes(values, categories=meta['categories'][column])
+        else:
+            data[column] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def categoricals_to_objects(df):
+    """Turns Categorical columns back into plain object columns, matching DataFrames built from CSV."""
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+COLUMN_STORE_DIR = "database/local_db/columns"
+
+# Scanning a block takes about this many bytes per stored byte: the decoded columns, the search
+# indexes and the matches turned back into Python strings
+SCAN_BYTES_PER_STORED_BYTE = 20
+
+
+def write_column_store(vehicle_df, test_df, directory=COLUMN_STORE_DIR):
+    """
+    Writes the vehicle and test DataFrames as one raw binary file per column.
+
+    The frames are aligned by vehicle_id first, so a vehicle row range maps onto a contiguous
+    test row range through the stored test_offsets. The manifest is written last and marks the
+    store as complete. A ZoneMap and a DateIndex of the aligned rows are stored along with the
+    columns.
+
+    Args:
+        vehicle_df (pd.DataFrame): The vehicle DataFrame.
+        test_df (pd.DataFrame): The test DataFrame.
+        directory (str): Where to write the column files.
+    """
+    writer = ColumnStoreWriter(directory)
+    writer.append(vehicle_df, test_df)
+    writer.close()
+
+
+class ColumnStoreWriter:
+    """
+    Writes the column store a part at a time, for tables that do not fit in memory at once.
+
+    Every part is aligned by vehicle_id on its own and appended to the column files, so each
+    vehicle must come in one part together with all of its tests. Category columns are encoded
+    against category lists that grow as parts bring new values, at most MAX_CATEGORIES each, so
+    the writer's memory does not grow with the rows: a column that brings more, such as vehicle
+    models, is switched to byte strings and the codes written so far are rewritten as the strings
+    they stand for. Byte string files are rewritten wider when a
+    part brings a longer value, and later parts are converted to the column types of the first.
+    The tests of every part are sorted by date as one run of the store's DateIndex. close() writes
+    the categories and, last, the manifest.
+    """
+
+    def __init__(self, directory=COLUMN_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self.files = {}
+        self.schema = {}      # table -> {'columns', 'kinds', 'dtypes'}
+        self.categories = {}  # (table, column) -> {value: code}, in code order
+        self.byte_columns = {}  # table -> columns stored as byte strings
+        self.num_vehicles = 0
+        self.num_tests = 0
+        self.zone_maps = []   # One ZoneMap per appended part
+        self.date_runs = []   # First test row of every part's DateIndex run
+
+    def _file(self, name):
+        if name not in self.files:
+            self.files[name] = open(os.path.join(self.directory, f"{name}.bin"), 'wb')
+        return self.files[name]
+
+    def _widen(self, table, column, dtype):
+        """Rewrites a byte string column file written so far with a wider dtype."""
+        name = f"{table}.{column}"
+        self.files.pop(name).close()
+        path = os.path.join(self.directory, f"{name}.bin")
+        np.fromfile(path, dtype=self.schema[table]['dtypes'][column]).astype(dtype).tofile(path)
+        self.files[name] = open(path, 'ab')
+        self.schema[table]['dtypes'][column] = np.dtype(dtype).str
+
+    def _conform(self, table, df):
+        """Brings a later part to the columns and types of the first one."""
+        spec = self.schema.get(table)
+        if spec is None:
+            return df
+        df = df[spec['columns']].copy()
+        for column in spec['columns']:
+            kind = spec['kinds'][column]
+            if kind == 'datetime' and column_kind(df[column]) != 'datetime':
+                df[column] = pd.to_datetime(df[column])
+            elif kind == 'numeric' and df[column].dtype.str != spec['dtypes'][column]:
+                df[column] = df[column].astype(spec['dtypes'][column])
+            elif kind != column_kind(df[column]) and kind in ('bytes', 'category'):
+                df[column] = df[column].astype(object)
+        return df
+
+    def _categories(self, table, series):
+        """The category list of a column, extended by the values it has not seen yet, or None past MAX_CATEGORIES."""
+        known = self.categories.setdefault((table, series.name), {})
+        for value in pd.unique(series.dropna()):
+            known.setdefault(value, len(known))
+            if len(known) > MAX_CATEGORIES:
+                return None
+        return list(known)
+
+    def _to_bytes(self, table, column):
+        """Switches a category column to byte strings, rewriting the codes written so far as their values."""
+        categories = pd.Index(list(self.categories.pop((table, column))), dtype=object)
+        self.byte_columns[table].add(column)
+        print(f"Column store: {table} column {column} has more than {MAX_CATEGORIES} distinct values, "
+              f"storing it as byte strings")
+        spec = self.schema.get(table)
+        if spec is None:
+            return  # Nothing written yet
+        name = f"{table}.{column}"
+        self.files.pop(name).close()
+        path = os.path.join(self.directory, f"{name}.bin")
+        codes = np.memmap(path, dtype=np.int32, mode='r') if os.path.getsize(path) else np.empty(0, np.int32)
+        dtype = encode_bytes(pd.Series(categories)).dtype
+        with open(path + f".{os.getpid()}", 'wb') as f:
+            for start in range(0, len(codes), CONVERT_ROWS):
+                values = pd.Series(pd.Categorical.from_codes(codes[start:start + CONVERT_ROWS], categories=categories))
+                encode_bytes(values).astype(dtype).tofile(f)
+        del codes
+        os.replace(path + f".{os.getpid()}", path)
+        self.files[name] = open(path, 'ab')
+        spec['kinds'][column] = 'bytes'
+        spec['dtypes'][column] = dtype.str
+
+    def append(self, vehicle_df, test_df):
+        """Encodes a part and appends it to the column files."""
+        from data.modules.data_frames import DataFrameCreator
+
+        vehicle_df, test_df, test_offsets = DataFrameCreator().align_by_vehicle(vehicle_df, test_df)
+        (test_offsets[:-1] + self.num_tests).astype(np.int64).tofile(self._file("test_offsets"))
+        self.zone_maps.append(ZoneMap.build(vehicle_df, test_df, test_offsets, start=self.num_vehicles))
+        for table, df in (('vehicle', vehicle_df), ('test', test_df)):
+            df = self._conform(table, df)
+            byte_columns = self.byte_columns.setdefault(table, set(ID_COLUMNS))
+            categories = {}
+            for column in df.columns:
+                if column_kind(df[column], byte_columns) == 'category':
+                    column_categories = self._categories(table, df[column])
+                    if column_categories is None:
+                        self._to_bytes(table, column)
+                    else:
+                        categories[column] = column_categories
+            arrays, meta = encode_columns(df, categories, byte_columns)
+            if table not in self.schema:
+                self.schema[table] = {
+                    'columns': meta['columns'],
+                    'kinds': meta['kinds'],
+                    'dtypes': {column: values.dtype.str for column, values in arrays.items()},
+                }
+            dtypes = self.schema[table]['dtypes']
+            for column, values in arrays.items():
+                if meta['kinds'][column] == 'bytes':
+                    if values.dtype.itemsize > np.dtype(dtypes[column]).itemsize:
+                        self._widen(table, column, values.dtype)
+                    values = values.astype(dtypes[column])
+                np.ascontiguousarray(values).tofile(self._file(f"{table}.{column}"))
+            if table == 'test' and meta['kinds'].get('test_date') == 'datetime':
+                run = DateIndex.build(arrays['test_date'], start=self.num_tests)
+                run.order.astype(np.int64).tofile(self._file(DATE_INDEX_FILES['order']))
+                run.dates.tofile(self._file(DATE_INDEX_FILES['dates']))
+                self.date_runs.append(self.num_tests)
+        self.num_vehicles += len(vehicle_df)
+        self.num_tests += len(test_df)
+
+    def close(self):
+        """Finishes the column files and the date index, and writes the categories, the zone map and the manifest."""
+        np.array([self.num_tests], dtype=np.int64).tofile(self._file("test_offsets"))
+        if self.date_runs:
+            np.array(self.date_runs + [self.num_tests], dtype=np.int64).tofile(self._file(DATE_INDEX_FILES['bounds']))
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+        categories = {table: {column: list(self.categories[(table, column)])
+                              for column, kind in spec['kinds'].items() if kind == 'category'}
+                      for table, spec in self.schema.items()}
+        with open(os.path.join(self.directory, "categories.pkl"), 'wb') as f:
+            pickle.dump(categories, f)
+        zone_map = ZoneMap.concat(self.zone_maps)
+        if zone_map is not None:
+            zone_map.save(self.directory)
+        manifest = {'num_vehicles': self.num_vehicles, 'num_tests': self.num_tests, 'tables': self.schema}
+        with open(os.path.join(self.directory, "manifest.json"), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Column store written to {self.directory}: {self.num_vehicles} vehicles, {self.num_tests} tests")
+
+
+class MappedColumnStore:
+    """
+    Read-only, memory-mapped view of the column files written by write_column_store.
+
+    Every rank maps only the row range it scans, so opening the store costs a manifest read,
+    the OS page cache is shared by all ranks on a host, and the data may be larger than RAM.
+    Offers the same frames/holds/rank_range interface as NodeSharedFrames, treating every rank
+    as able to read every row. With a memory_budget (bytes per rank) a share is read in blocks
+    of block_rows vehicles, so that scanning one block stays within the budget. zone_map tells
+    which row ranges a search can skip, and date_index() finds the tests of a date range.
+    """
+
+    cross_domain = True
+
+    def __init__(self, directory=COLUMN_STORE_DIR, rank=0, size=1, exclude_root=False, memory_budget=None):
+        self.directory = directory
+        self.rank = rank
+        self.size = size
+        self.exclude_root = exclude_root
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.num_vehicles = self.manifest['num_vehicles']
+        self.block_rows = self._block_rows(memory_budget) if memory_budget else None
+        self.node_range = (0, self.num_vehicles)
+        self.node_ranges = [self.node_range]
+        self.rank_nodes = [0] * size
+        self._categories = None
+        self._local_frames = None
+        self._zone_map = None
+        self._date_index = None
+
+    @staticmethod
+    def exists(directory=COLUMN_STORE_DIR):
+        return os.path.isfile(os.path.join(directory, "manifest.json"))
+
+    def categories(self):
+        """The category lists of every table, loaded on first use; they stay small as ids are not among them."""
+        if self._categories is None:
+            with open(os.path.join(self.directory, "categories.pkl"), 'rb') as f:
+                self._categories = pickle.load(f)
+        return self._categories
+
+    @property
+    def zone_map(self):
+        """
+        The ZoneMap stored with the columns. Stores written before zone maps existed get one built
+        from the columns on first use, saved for the next run when the directory is writable.
+        """
+        if self._zone_map is None:
+            self._zone_map = ZoneMap.load(self.directory)
+        if self._zone_map is None:
+            print(f"Rank {self.rank}: Building the zone map of {self.directory}")
+            step = ZONE_ROWS * 256
+            zone_maps = []
+            for start in range(0, self.num_vehicles, step):
+                stop = min(start + step, self.num_vehicles)
+                vehicle_df, test_df = self.frames(start, stop)
+                offsets = self._map("test_offsets", np.int64, start, stop + 1)
+                zone_maps.append(ZoneMap.build(vehicle_df, test_df, offsets - offsets[0], start=start))
+            self._zone_map = ZoneMap.concat(zone_maps)
+            if self._zone_map is not None:
+                try:
+                    self._zone_map.save(self.directory)
+                except OSError:
+                    pass
+        return self._zone_map
+
+    def date_index(self, start, stop):
+        """
+        The DateIndex of the tests of a vehicle row range, or None when the store has no test dates.
+        Stores written before date indexes existed get one built on first use, saved for the next
+        run when the directory is writable.
+        """
+        if self._date_index is None:
+            self._date_index = DateIndex.load(self.directory)
+        if self._date_index is None:
+            if self.manifest['tables']['test']['kinds'].get('test_date') != 'datetime':
+                return None
+            print(f"Rank {self.rank}: Building the date index of {self.directory}")
+            self._date_index = DateIndex.build(self._map("test.test_date", np.int64, 0, self.manifest['num_tests']))
+            try:
+                self._date_index.save(self.directory)
+            except OSError:
+                pass
+        return self._date_index.window(*self._test_range(start, stop))
+
+    def _map(self, name, dtype, start, stop):
+        dtype = np.dtype(dtype)
+        if stop <= start:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.directory, f"{name}.bin"), dtype=dtype, mode='r',
+                         offset=start * dtype.itemsize, shape=(stop - start,))
+
+    def _table(self, table, start, stop):
+        spec = self.manifest['tables'][table]
+        arrays = {column: self._map(f"{table}.{column}", spec['dtypes'][column], start, stop)
+                  for column in spec['columns']}
+        meta = {'columns': spec['columns'], 'kinds': spec['kinds'], 'categories': self.categories()[table]}
+        return decode_columns(arrays, meta)
+
+    def frames(self, start, stop):
+        """
+        Maps a vehicle row range with its matching tests.
+
+        Returns:
+            tuple: (vehicle_df, test_df) over read-only memory maps of the column files.
+        """
+        return self._table('vehicle', start, stop), self._table('test', *self._test_range(start, stop))
+
+    def _test_range(self, start, stop):
+        """The test rows of a vehicle row range."""
+        offsets = self._map("test_offsets", np.int64, start, stop + 1)
+        return (int(offsets[0]), int(offsets[-1])) if len(offsets) else (0, 0)
+
+    def _block_rows(self, memory_budget):
+        """Vehicle rows per block, from the stored bytes of a vehicle and its average tests."""
+        tables = self.manifest['tables']
+        row_bytes = {table: sum(np.dtype(dtype).itemsize for dtype in spec['dtypes'].values())
+                     for table, spec in tables.items()}
+        tests_per_vehicle = self.manifest['num_tests'] / max(1, self.num_vehicles)
+        vehicle_bytes = row_bytes.get('vehicle', 0) + tests_per_vehicle * row_bytes.get('test', 0)
+        return max(1, int(memory_budget / (max(1, vehicle_bytes) * SCAN_BYTES_PER_STORED_BYTE)))
+
+    def blocks(self, start, stop):
+        """
+        Maps a vehicle row range block by block.
+
+        Yields:
+            tuple: (vehicle_df, test_df) for every block_rows vehicles of the range, or once for
+            the whole range without a memory budget.
+        """
+        for block_start, block_stop in self.block_ranges(start, stop):
+            yield self.frames(block_start, block_stop)
+
+    def block_ranges(self, start, stop):
+        """The vehicle row ranges blocks() maps a range in."""
+        step = self.block_rows or max(1, stop - start)
+        return [(block_start, min(block_start + step, stop)) for block_start in range(start, max(stop, start + 1), step)]
+
+    def local_blocks(self):
+        """This rank's share as blocks; the cached local frames when there is no memory budget."""
+        if self.block_rows is None:
+            return [self.local_frames()]
+        return self.blocks(*self.rank_range())
+
+    def holds(self, start, stop):
+        return 0 <= start and stop <= self.num_vehicles
+
+    def rank_range(self, exclude_root=None):
+        """The disjoint share of the vehicle rows scanned by this rank."""
+        exclude_root = self.exclude_root if exclude_root is None else exclude_root
+        scanners = list(range(1, self.size)) if exclude_root and self.size > 1 else list(range(self.size))
+        if self.rank not in scanners:
+            return 0, 0
+        index = scanners.index(self.rank)
+        rows = self.num_vehicles
+        return rows * index // len(scanners), rows * (index + 1) // len(scanners)
+
+    def local_frames(self):
+        """The frames over this rank's own share, mapped once and cached."""
+        if self._local_frames is None:
+            self._local_frames = self.frames(*self.rank_range())
+        return self._local_frames
+
+    def free(self):
+        self._local_frames = None
@@ -1,9 +1,87 @@
 import pandas as pd
 import csv
 import os
-from mpi4py import MPI
 
+from data.modules.column_store import MappedColumnStore, write_column_store
 from data.modules.data_frames import DataFrameCreator
+from data.modules.distributed_frames import DistributedDataFrameCreator, DistributedFrames
+from data.modules.ingest_progress import IngestProgress
+from data.modules.spill import SpillWriter, build_column_store, bucket_count, chunk_rows
+from tracing import tracer
+
+try:
+    from mpi4py import MPI
+except ImportError:  # The shared-memory backend runs without MPI
+    MPI = None
+
+# Rows parsed between two progress updates; the update itself only checks the clock
+PROGRESS_ROWS = 1000
+
+
+def read_csv_file(filename, data_cleaner, rows_per_file, start_row=0, progress=None):
+    """
+    Processes a portion of a CSV file, cleans the data, and returns a Pandas DataFrame.
+
+    Kept at module level so that process pools can run it without a loader instance.
+
+    Args:
+        filename (str): The path to the CSV file.
+        data_cleaner (DataCleaner): Cleans each row.
+        rows_per_file (int): Maximum number of rows to read.
+        start_row (int): The row number to start processing from.
+        progress (IngestProgress, optional): Gets the row, byte and bad value counts every
+            PROGRESS_ROWS rows and decides itself whether it is time to report.
+
+    Returns:
+        pandas.DataFrame: A DataFrame containing the cleaned data.
+    """
+    frames = list(iter_csv_chunks(filename, data_cleaner, rows_per_file, rows_per_file, start_row, progress))
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def iter_csv_chunks(filename, data_cleaner, rows_per_file, chunk_rows, start_row=0, progress=None):
+    """
+    Reads and cleans a portion of a CSV file like read_csv_file, handing the rows out in chunks.
+
+    Only one chunk of cleaned rows is held at a time, so files larger than memory can be parsed.
+
+    Args:
+        chunk_rows (int): Maximum number of rows per DataFrame.
+        (The other arguments are those of read_csv_file.)
+
+    Yields:
+        pandas.DataFrame: The cleaned rows, at least one (possibly empty) DataFrame per file.
+    """
+    data = []
+    rows = reported_rows = reported_bytes = 0
+    with open(filename, 'r') as f:
+        reader = csv.DictReader(f)
+        for i, row in enumerate(reader):
+            if i < start_row:
+                continue
+            if i >= start_row + rows_per_file:
+                break
+
+            cleaned_row = data_cleaner.clean_row(row)
+            data.append(cleaned_row)
+            rows += 1
+
+            if progress is not None and rows % PROGRESS_ROWS == 0:
+                consumed = f.buffer.tell()  # Bytes handed to the text decoder so far
+                progress.update(rows - reported_rows, consumed - reported_bytes, data_cleaner.bad_values)
+                reported_rows, reported_bytes = rows, consumed
+
+            if len(data) >= chunk_rows:
+                yield pd.DataFrame(data)
+                data = []
+
+    if progress is not None:
+        # The rest of the file counts as done, even when rows_per_file stopped reading early
+        progress.file_done()
+        progress.update(rows - reported_rows, os.path.getsize(filename) - reported_bytes,
+                        data_cleaner.bad_values)
+    if data or rows == 0:
+        yield pd.DataFrame(data)
 
 
 class DataLoader:
@@ -11,14 +89,58 @@ class DataLoader:
     Handles loading and distributing the MOT dataset using MPI.
     """
 
-    def __init__(self, data_cleaner, rows_per_file=1000000):
+    def __init__(self, data_cleaner, rows_per_file=1000000, backend=None):
         if rows_per_file <= 0:
             raise ValueError("rows_per_file must be a positive integer.")
         self.data_cleaner = data_cleaner
         self.rows_per_file = rows_per_file
-        self.comm = MPI.COMM_WORLD
-        self.rank = self.comm.Get_rank()
-        self.size = self.comm.Get_size()
+        self.backend = backend
+        if backend is not None or MPI is None:
+            # Single process driving a local backend
+            self.comm = None
+            self.rank = 0
+            self.size = 1
+        else:
+            self.comm = MPI.COMM_WORLD
+            self.rank = self.comm.Get_rank()
+            self.size = self.comm.Get_size()
+        self.store = None  # MappedColumnStore once every rank can map the column files
+        self.progress = None  # IngestProgress while CSV files are parsed
+        self.memory_budget = None  # Bytes per rank in out-of-core mode
+        self.spill = None  # SpillWriter while an out-of-core ingest parses
+
+    def open_column_store(self):
+        """
+        Collective: maps the memory-mapped column store if every rank can see it.
+
+        Each rank then searches its own row range straight from the column files, so nothing is
+        unpickled or scattered. Ranks on a host without the store files (no shared filesystem)
+        make everyone fall back to rank 0's in-memory frames.
+
+        Returns:
+            bool: Whether the store was opened.
+        """
+        with tracer.span("open column store", "ingest"):
+            if self.comm is not None:
+                self.comm.Barrier()
+            visible = MappedColumnStore.exists()
+            if self.comm is not None:
+                visible = all(self.comm.allgather(visible))
+            if visible:
+                self.store = MappedColumnStore(rank=self.rank, size=self.size, memory_budget=self.memory_budget)
+        return visible
+
+    def save_column_store(self, vehicle_df, test_df):
+        """
+        Collective: writes rank 0's frames as the column store and maps it on every rank.
+
+        Returns:
+            bool: Whether the store was opened.
+        """
+        if self.rank == 0 and vehicle_df is not None and test_df is not None:
+            with tracer.span("write column store", "ingest"):
+                write_column_store(vehicle_df, test_df)
+        return self.open_column_store()
 
     def process_file(self, filename, start_row):
         """
@@ -31,27 +153,132 @@ class DataLoader:
         Returns:
             pandas.DataFrame: A DataFrame containing the cleaned data.
         """
-        data = []
-        with open(filename, 'r') as f:
-            reader = csv.DictReader(f)
-            for i, row in enumerate(reader):
-                if i < start_row:
-                    continue
-                if i >= start_row + self.rows_per_file:
-                    break
-
-                cleaned_row = self.data_cleaner.clean_row(row)
-                data.append(cleaned_row)
+        with tracer.span("parse file", "ingest", file=os.path.basename(filename)):
+            return read_csv_file(filename, self.data_cleaner, self.rows_per_file, start_row, self.progress)
 
-                if (i + 1) % 1000 == 0:
-                    print(f"Rank {self.rank}: Processed {i + 1} rows from {filename}")
+    def spill_file(self, filename):
+        """
+        Parses a CSV file in chunks that fit the memory budget and spills each one right away.
 
-        return pd.DataFrame(data)
+        Returns:
+            int: The number of rows spilled.
+        """
+        rows = 0
+        with tracer.span("parse file", "ingest", file=os.path.basename(filename)):
+            for df_chunk in iter_csv_chunks(filename, self.data_cleaner, self.rows_per_file,
+                                            chunk_rows(self.memory_budget), 0, self.progress):
+                self.spill.add(df_chunk)
+                rows += len(df_chunk)
+        return rows
 
     def distribute_work(self):
         """
         Distributes the work of loading and cleaning data among MPI processes.
         """
+        if self.backend is not None:
+            return self.backend_distribute_work()
+
+        local_df = self.parse_files()
+
+        # Gather data on master for further processing (optional)
+        with tracer.span("gather files", "comm", rows=len(local_df)):
+            all_data = self.comm.gather(local_df, root=0)
+
+        if self.rank == 0:
+            # If needed, combine data from all workers
+            # final_df = pd.concat(all_data, ignore_index=True)
+            final_df = pd.concat(all_data, ignore_index=True)
+            print("Data loading and cleaning complete.")
+            # ... (Further processing on master, if required)
+            # Ensure 'vehicle_id' is a column
+
+
+            with tracer.span("build frames", "ingest", rows=len(final_df)):
+                df_creator = DataFrameCreator()
+                vehicle_df, test_df = df_creator.create_data_frames(final_df)
+
+            with tracer.span("write pickle cache", "serialize"):
+                # Create the directory
+                os.makedirs("database/local_db", exist_ok=True)
+                vehicle_df.to_pickle("database/local_db/vehicle_df.pkl")
+                test_df.to_pickle("database/local_db/test_df.pkl")
+
+            return vehicle_df, test_df  # Return the DataFrames
+        else:
+            return None, None
+
+    def distribute_tables(self):
+        """
+        Collective: builds the vehicle and test tables as per-rank shards instead of on rank 0.
+
+        Every rank keeps the rows it parsed, and DistributedDataFrameCreator moves each vehicle with
+        its tests to the rank its vehicle_id hashes to. The shards are cached per rank, and later
+        starts with the same number of ranks load them without touching the CSV files.
+
+        Returns:
+            DistributedFrames: This rank's shard.
+        """
+        partition = DistributedFrames.open(self.comm)
+        if partition is not None:
+            return partition
+
+        local_df = self.parse_files()
+        vehicle_df, test_df = DistributedDataFrameCreator(self.comm).create_data_frames(local_df)
+        partition = DistributedFrames(self.comm, vehicle_df, test_df)
+        partition.save()
+        return partition
+
+    def load_out_of_core(self, memory_budget):
+        """
+        Collective: opens the column store for scans in blocks that fit memory_budget bytes per
+        rank, building it out of core first when there is none.
+
+        The CSV files are parsed in chunks that every rank spills to hash buckets by vehicle_id
+        right away (see SpillWriter). Rank 0 then turns one bucket at a time into vehicle and test
+        tables and appends them to the column store, so no rank ever holds the full tables. Like
+        the column store itself, this needs a filesystem shared by all ranks.
+
+        Returns:
+            MappedColumnStore: The store, reading at most block_rows vehicles at a time.
+        """
+        self.memory_budget = memory_budget
+        if not self.open_column_store():
+            self.spill_ingest()
+            self.open_column_store()
+        print(f"Rank {self.rank}: Out-of-core column store with {self.store.num_vehicles} vehicles, "
+              f"{self.store.block_rows} per block")
+        return self.store
+
+    def spill_ingest(self):
+        """Collective: parses every rank's files into spill buckets and builds the column store on rank 0."""
+        self.parse_files(spill=True)
+        spilled = self.comm.gather(self.spill.close(), root=0)
+        num_buckets = self.spill.num_buckets
+        self.spill = None
+        error = None
+        if self.rank == 0:
+            missing = [path for paths in spilled for path in paths.values() if not os.path.exists(path)]
+            if missing:
+                error = (f"{len(missing)} spill files of other ranks are not visible on rank 0 "
+                         f"(e.g. {missing[0]}); out-of-core ingest needs a shared filesystem")
+        error = self.comm.bcast(error, root=0)
+        if error is not None:
+            raise RuntimeError(error)
+        if self.rank == 0:
+            with tracer.span("build column store", "ingest"):
+                build_column_store(spilled, num_buckets)
+
+    def parse_files(self, spill=False):
+        """
+        Collective: rank 0 deals the CSV files out round-robin and every rank parses its own.
+
+        Args:
+            spill (bool): Spill the rows to hash buckets on disk (self.spill) within the memory
+                budget instead of returning them.
+
+        Returns:
+            pd.DataFrame: The cleaned rows of this rank's files (empty when spilling).
+        """
         if self.rank == 0:  # Master node
             print( os.getcwd())
             # "DataParallelModel/data/test_result_2022"
@@ -61,40 +288,50 @@ class DataLoader:
                 chunks[i % self.size].append(file)
 
             print(f"Master node: Found {len(csv_files)} CSV files.")
+            total_bytes = sum(map(os.path.getsize, csv_files))
         else:
             chunks = None
+            total_bytes = 0
+        self.progress = IngestProgress(self.comm, self.rank, total_bytes=total_bytes)
 
         # Scatter the work
-        files_to_process = self.comm.scatter(chunks, root=0)
+        with tracer.span("scatter files", "comm"):
+            files_to_process = self.comm.scatter(chunks, root=0)
+        if spill:
+            num_buckets = bucket_count(total_bytes, self.memory_budget) if self.rank == 0 else None
+            self.spill = SpillWriter(self.rank, self.comm.bcast(num_buckets, root=0))
 
         local_df = pd.DataFrame()
         for file in files_to_process:
             print(f"Rank {self.rank} processing {file}")
-            df_chunk = self.process_file(file, 0)
-            local_df = pd.concat([local_df, df_chunk], ignore_index=True)
+            if spill:
+                self.spill_file(file)
+            else:
+                df_chunk = self.process_file(file, 0)
+                local_df = pd.concat([local_df, df_chunk], ignore_index=True)
             print(f"Rank {self.rank} finished processing {file}")
 
-        # Gather data on master for further processing (optional)
-        all_data = self.comm.gather(local_df, root=0)
-
+        self.progress.finish()
         if self.rank == 0:
-            # If needed, combine data from all workers
-            # final_df = pd.concat(all_data, ignore_index=True)
-            final_df = pd.concat(all_data, ignore_index=True)
-            print("Data loading and cleaning complete.")
-            # ... (Further processing on master, if required)
-            # Ensure 'vehicle_id' is a column
+            self.progress.wait_for(range(1, self.size))
+            self.progress.print_summary()
+        return local_df
 
+    def backend_distribute_work(self):
+        """Parses the CSV files on the local process pool of the execution backend."""
+        csv_files = [f"database/test_result_2022/{f}" for f in os.listdir('database/test_result_2022') if f.endswith('.csv')]
+        self.progress = IngestProgress(total_bytes=sum(map(os.path.getsize, csv_files)))
+        all_data = self.backend.load_files(csv_files, self.data_cleaner, self.rows_per_file, self.progress)
+        self.progress.print_summary()
+        final_df = pd.concat(all_data, ignore_index=True)
+        print("Data loading and cleaning complete.")
 
-            df_creator = DataFrameCreator()
-            vehicle_df, test_df = df_creator.create_data_frames(final_df)
+        df_creator = DataFrameCreator()
+        vehicle_df, test_df = df_creator.create_data_frames(final_df)
 
-            if not os.path.exists("databaselocal_db"):
-                # Create the directory
-                os.makedirs("database/local_db")
-            vehicle_df.to_pickle("database/local_db/vehicle_df.pkl")
-            test_df.to_pickle("database/local_db/test_df.pkl")
+        if not os.path.exists("database/local_db"):
+            os.makedirs("database/local_db")
+        vehicle_df.to_pickle("database/local_db/vehicle_df.pkl")
+        test_df.to_pickle("database/local_db/test_df.pkl")
 
-            return vehicle_df, test_df  # Return the DataFrames
-        else:
-            return None, None
\ No newline at end of file
+        return vehicle_df, test_df
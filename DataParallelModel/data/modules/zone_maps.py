@@ -0,0 +1,156 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Vehicles per zone; zones are the ranges the scheduler can skip
+ZONE_ROWS = 2048
+# Columns with per-zone statistics, by table
+ZONE_COLUMNS = {'vehicle': ('first_use_date', 'cylinder_capacity'), 'test': ('test_mileage', 'test_date')}
+DATE_COLUMNS = ('first_use_date', 'test_date')
+ZONE_MAP_FILE = "zone_map.pkl"
+
+EPOCH = pd.Timestamp(0)
+
+
+def day_number(value):
+    """Days since 1970-01-01 of a date, the unit zone maps keep dates in."""
+    return (pd.Timestamp(value) - EPOCH).days
+
+
+def zone_values(series):
+    """A column as float64 for the zone statistics: dates as day numbers, NaN for missing values."""
+    if series.name in DATE_COLUMNS:
+        days = (pd.to_datetime(series, errors='coerce') - EPOCH).dt.days
+        return days.to_numpy(dtype=float, na_value=np.nan)
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+def search_conditions(search_kwargs):
+    """
+    The (column, low, high) ranges a combined search's matches must fall in, in zone units.
+
+    An empty list means the search can match anywhere, e.g. a make or model search.
+    """
+    conditions = []
+    year = search_kwargs.get('year')
+    if year:
+        conditions.append(('first_use_date', day_number(f"{year}-01-01"), day_number(f"{year}-12-31")))
+    min_mileage, max_mileage = search_kwargs.get('min_mileage'), search_kwargs.get('max_mileage')
+    if min_mileage is not None and max_mileage is not None:
+        conditions.append(('test_mileage', min_mileage, max_mileage))
+    min_test_date, max_test_date = search_kwargs.get('min_test_date'), search_kwargs.get('max_test_date')
+    if min_test_date or max_test_date:
+        conditions.append(('test_date', day_number(min_test_date) if min_test_date else -np.inf,
+                           day_number(max_test_date) if max_test_date else np.inf))
+    return conditions
+
+
+class ZoneMap:
+    """
+    Minimum, maximum and null count of a few columns per zone of aligned vehicle rows.
+
+    Zone i covers the global vehicle rows bounds[i]:bounds[i + 1]; vehicle columns are summarised
+    over those vehicles and test columns over their tests. ranges() narrows a row range to the
+    zones that may hold a match for at least one search of a batch, so the others are neither
+    shipped nor scanned. Dates are kept as day numbers.
+    """
+
+    def __init__(self, bounds, stats):
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.stats = stats  # column -> {'min': array, 'max': array, 'nulls': array}, one entry per zone
+
+    @classmethod
+    def build(cls, vehicle_df, test_df, test_offsets, start=0, zone_rows=ZONE_ROWS):
+        """
+        Summarises aligned frames, where the tests of vehicle row i are
+        test_df[test_offsets[i]:test_offsets[i + 1]] and the first vehicle is global row start.
+        """
+        num_vehicles = len(vehicle_df)
+        bounds = np.append(np.arange(0, num_vehicles, zone_rows), num_vehicles)
+        num_zones = len(bounds) - 1
+        vehicle_zones = np.arange(num_vehicles) // zone_rows
+        test_offsets = np.asarray(test_offsets, dtype=np.int64)
+        test_zones = np.repeat(vehicle_zones, np.diff(test_offsets))
+        test_df = test_df.iloc[test_offsets[0]:test_offsets[-1]]
+
+        stats = {}
+        for table, df, zones in (('vehicle', vehicle_df, vehicle_zones), ('test', test_df, test_zones)):
+            for column in ZONE_COLUMNS[table]:
+                if column not in df.columns:
+                    continue
+                values = pd.Series(zone_values(df[column]))
+                grouped = values.groupby(zones)
+                stats[column] = {
+                    'min': grouped.min().reindex(range(num_zones)).to_numpy(dtype=float),
+                    'max': grouped.max().reindex(range(num_zones)).to_numpy(dtype=float),
+                    'nulls': values.isna().groupby(zones).sum().reindex(range(num_zones), fill_value=0)
+                                   .to_numpy(dtype=np.int64),
+                }
+        return cls(bounds + start, stats)
+
+    @classmethod
+    def concat(cls, zone_maps):
+        """Joins the maps of consecutive row ranges, in row order."""
+        zone_maps = [zone_map for zone_map in zone_maps if zone_map is not None]
+        if not zone_maps:
+            return None
+        bounds = np.concatenate([zone_map.bounds[:-1] for zone_map in zone_maps] + [zone_maps[-1].bounds[-1:]])
+        columns = set.intersection(*(set(zone_map.stats) for zone_map in zone_maps))
+        stats = {column: {name: np.concatenate([zone_map.stats[column][name] for zone_map in zone_maps])
+                          for name in ('min', 'max', 'nulls')}
+                 for column in columns}
+        return cls(bounds, stats)
+
+    def save(self, directory):
+        """Writes the map next to the cache it describes, replacing any earlier one in one step."""
+        path = os.path.join(directory, ZONE_MAP_FILE)
+        with open(path + f".{os.getpid()}", 'wb') as f:
+            pickle.dump((self.bounds, self.stats), f)
+        os.replace(path + f".{os.getpid()}", path)
+
+    @classmethod
+    def load(cls, directory):
+        """The map saved in directory, or None when there is none."""
+        path = os.path.join(directory, ZONE_MAP_FILE)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return cls(*pickle.load(f))
+
+    @property
+    def num_zones(self):
+        return len(self.bounds) - 1
+
+    def may_match(self, search_kwargs):
+        """Per zone, whether the search can have a match there."""
+        keep = np.ones(self.num_zones, dtype=bool)
+        for column, low, high in search_conditions(search_kwargs):
+            if column in self.stats:
+                # NaN bounds (zones without a value) compare False, so such zones are skipped too
+                keep &= (self.stats[column]['min'] <= high) & (self.stats[column]['max'] >= low)
+        return keep
+
+    def ranges(self, start, stop, search_kwargs_batch):
+        """
+        The parts of the vehicle row range start:stop that a batch of searches needs to scan.
+
+        Returns:
+            tuple: (list of (start, stop) ranges in row order, number of zones skipped)
+        """
+        if not any(search_conditions(search_kwargs) for search_kwargs in search_kwargs_batch):
+            return [(start, stop)], 0
+        keep = np.zeros(self.num_zones, dtype=bool)
+        for search_kwargs in search_kwargs_batch:
+            keep |= self.may_match(search_kwargs)
+
+        overlapping = np.flatnonzero((self.bounds[:-1] < stop) & (self.bounds[1:] > start))
+        ranges = []
+        for zone in overlapping[keep[overlapping]]:
+            zone_start, zone_stop = max(start, int(self.bounds[zone])), min(stop, int(self.bounds[zone + 1]))
+            if ranges and ranges[-1][1] == zone_start:
+                ranges[-1] = (ranges[-1][0], zone_stop)
+            else:
+                ranges.append((zone_start, zone_stop))
+        return ranges, int(np.count_nonzero(~keep[overlapping]))
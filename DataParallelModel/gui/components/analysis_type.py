@@ -1,8 +1,14 @@
 # gui/components/analysis_type.py
 
-from PyQt5.QtWidgets import QGroupBox, QVBoxLayout, QRadioButton
+from PyQt5.QtWidgets import QGroupBox, QVBoxLayout, QHBoxLayout, QRadioButton, QLabel, QDoubleSpinBox, QSpinBox, QComboBox
 
 class AnalysisTypeGroup(QGroupBox):
+    """
+    The analysis to run in Analysis Mode. Age and mileage pass rates are computed from the matching
+    rows; the other types are aggregates (see analysis.aggregates) that the workers compute, so the
+    search returns their summary instead of the rows.
+    """
+
     def __init__(self):
         super().__init__("Analysis Type")
         layout = QVBoxLayout()
@@ -10,8 +16,97 @@ class AnalysisTypeGroup(QGroupBox):
         self.analysis_age_radio = QRadioButton("Analyze by Age")
         self.analysis_age_radio.setChecked(True)  # Default selection
         self.analysis_mileage_radio = QRadioButton("Analyze by Mileage")
+        self.mileage_quantiles_radio = QRadioButton("Mileage Quantiles by Age")
+        self.top_pass_rates_radio = QRadioButton("Top-K Pass Rates")
+        self.distinct_vehicles_radio = QRadioButton("Distinct Vehicles")
+        self.regional_radio = QRadioButton("Pass Rate by Postcode Area")
 
         layout.addWidget(self.analysis_age_radio)
         layout.addWidget(self.analysis_mileage_radio)
+        layout.addWidget(self.mileage_quantiles_radio)
+        layout.addWidget(self.top_pass_rates_radio)
+        layout.addWidget(self.distinct_vehicles_radio)
+        layout.addWidget(self.regional_radio)
+
+        # Relative error of the quantile sketches
+        accuracy_layout = QHBoxLayout()
+        accuracy_layout.addWidget(QLabel("Quantile accuracy (%):"))
+        self.accuracy_spin = QDoubleSpinBox()
+        self.accuracy_spin.setRange(0.1, 10.0)
+        self.accuracy_spin.setSingleStep(0.5)
+        self.accuracy_spin.setValue(1.0)
+        accuracy_layout.addWidget(self.accuracy_spin)
+        layout.addLayout(accuracy_layout)
+
+        # Grouping, size and direction of the top-K ranking
+        ranking_layout = QHBoxLayout()
+        self.group_by_combo = QComboBox()
+        for label, group_by in (("Make + Model", "make_model"), ("Make", "make"), ("Model", "model")):
+            self.group_by_combo.addItem(label, group_by)
+        self.order_combo = QComboBox()
+        for label, order in (("Worst", "worst"), ("Best", "best")):
+            self.order_combo.addItem(label, order)
+        self.k_spin = QSpinBox()
+        self.k_spin.setRange(1, 100)
+        self.k_spin.setValue(10)
+        ranking_layout.addWidget(self.order_combo)
+        ranking_layout.addWidget(self.k_spin)
+        ranking_layout.addWidget(QLabel("by"))
+        ranking_layout.addWidget(self.group_by_combo)
+        layout.addLayout(ranking_layout)
+
+        min_tests_layout = QHBoxLayout()
+        min_tests_layout.addWidget(QLabel("Minimum tests:"))
+        self.min_tests_spin = QSpinBox()
+        self.min_tests_spin.setRange(1, 1000000)
+        self.min_tests_spin.setValue(50)
+        min_tests_layout.addWidget(self.min_tests_spin)
+        layout.addLayout(min_tests_layout)
+
+        # Grouping of the distinct vehicle counts
+        distinct_layout = QHBoxLayout()
+        distinct_layout.addWidget(QLabel("Distinct vehicles per:"))
+        self.distinct_group_combo = QComboBox()
+        for label, group_by in (("Search", None), ("Make", "make"), ("Model", "model"),
+                                ("Make + Model", "make_model"), ("Postcode Area", "postcode_area")):
+            self.distinct_group_combo.addItem(label, group_by)
+        distinct_layout.addWidget(self.distinct_group_combo)
+        layout.addLayout(distinct_layout)
+
+        # Order of the postcode areas; areas below the minimum number of tests are left out
+        regional_layout = QHBoxLayout()
+        regional_layout.addWidget(QLabel("Sort areas by:"))
+        self.regional_sort_combo = QComboBox()
+        for label, sort_by in (("Pass Rate", "pass_rate"), ("Tests", "tests")):
+            self.regional_sort_combo.addItem(label, sort_by)
+        regional_layout.addWidget(self.regional_sort_combo)
+        layout.addLayout(regional_layout)
 
         self.setLayout(layout)
+
+    def analysis_type(self):
+        if self.mileage_quantiles_radio.isChecked():
+            return "mileage_quantiles"
+        if self.top_pass_rates_radio.isChecked():
+            return "top_pass_rates"
+        if self.distinct_vehicles_radio.isChecked():
+            return "distinct_vehicles"
+        if self.regional_radio.isChecked():
+            return "regional_pass_rates"
+        return "age" if self.analysis_age_radio.isChecked() else "mileage"
+
+    def aggregate(self):
+        """The search_criteria 'aggregate' for the chosen analysis, or None for row-based analyses."""
+        if self.analysis_type() == "mileage_quantiles":
+            return {'name': 'mileage_quantiles', 'quantiles': [0.5, 0.9],
+                    'relative_accuracy': self.accuracy_spin.value() / 100}
+        if self.analysis_type() == "top_pass_rates":
+            return {'name': 'top_pass_rates', 'group_by': self.group_by_combo.currentData(),
+                    'k': self.k_spin.value(), 'min_tests': self.min_tests_spin.value(),
+                    'order': self.order_combo.currentData()}
+        if self.analysis_type() == "distinct_vehicles":
+            return {'name': 'distinct_vehicles', 'group_by': self.distinct_group_combo.currentData()}
+        if self.analysis_type() == "regional_pass_rates":
+            return {'name': 'regional_pass_rates', 'sort_by': self.regional_sort_combo.currentData(),
+                    'min_tests': self.min_tests_spin.value()}
+        return None
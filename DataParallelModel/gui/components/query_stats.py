@@ -0,0 +1,97 @@
+import time
+from collections import deque
+
+from PyQt5.QtWidgets import (
+    QGroupBox, QVBoxLayout, QWidget, QTableWidget, QTableWidgetItem, QPlainTextEdit, QAbstractItemView, QHeaderView
+)
+
+from analysis.query_stats import format_bytes
+
+
+class QueryStatsGroup(QGroupBox):
+    """
+    Collapsible panel with the statistics of the last queries.
+
+    The table lists one query per row, newest first; selecting a row shows where its time and
+    data went. Unchecking the title collapses the panel.
+    """
+
+    COLUMNS = ["Time", "Search", "Rows", "Wall ms", "Sent", "Received"]
+
+    def __init__(self, history_size=20, parent=None):
+        super().__init__("Query Statistics", parent)
+        self.history = deque(maxlen=history_size)  # (time, search_criteria, QueryStats), oldest first
+
+        self.setCheckable(True)
+        self.setChecked(False)  # Collapsed until the user opens it
+        self.toggled.connect(self.set_expanded)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.itemSelectionChanged.connect(self.show_selected)
+
+        self.details = QPlainTextEdit()
+        self.details.setReadOnly(True)
+
+        self.contents = QWidget()
+        contents_layout = QVBoxLayout()
+        contents_layout.setContentsMargins(0, 0, 0, 0)
+        contents_layout.addWidget(self.table)
+        contents_layout.addWidget(self.details)
+        self.contents.setLayout(contents_layout)
+        self.contents.setVisible(False)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.contents)
+        self.setLayout(layout)
+
+    def set_expanded(self, expanded):
+        self.contents.setVisible(expanded)
+
+    def add(self, search_criteria, stats):
+        """Adds a finished query to the history and selects it."""
+        self.history.append((time.strftime("%H:%M:%S"), search_criteria, stats))
+        self.table.setRowCount(len(self.history))
+        for row, (finished, criteria, query_stats) in enumerate(reversed(self.history)):
+            values = [finished, describe_criteria(criteria), str(sum(query_stats.rows_matched)),
+                      f"{query_stats.wall_seconds * 1000:.1f}", format_bytes(query_stats.bytes_sent),
+                      format_bytes(query_stats.bytes_received)]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        self.table.selectRow(0)
+        self.show_selected()
+
+    def show_selected(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows or not self.history:
+            self.details.clear()
+            return
+        _, _, stats = self.history[len(self.history) - 1 - rows[0].row()]
+        self.details.setPlainText("\n".join(stats.summary_lines()))
+
+
+def describe_criteria(search_criteria):
+    """A short text for a search_criteria dict, e.g. 'FORD FOCUS 2012, 0-60000 miles'."""
+    for key, label in (('vehicle_id', 'vehicle'), ('test_id', 'test')):
+        if search_criteria.get(key):
+            return f"{label} {search_criteria[key]}"
+    parts = [str(search_criteria[key]).upper() for key in ('make', 'model') if search_criteria.get(key)]
+    if search_criteria.get('year'):
+        parts.append(str(search_criteria['year']))
+    text = " ".join(parts)
+    if search_criteria.get('min_mileage') is not None and search_criteria.get('max_mileage') is not None:
+        text += f"{', ' if text else ''}{search_criteria['min_mileage']}-{search_criteria['max_mileage']} miles"
+    min_test_date, max_test_date = search_criteria.get('min_test_date'), search_criteria.get('max_test_date')
+    if min_test_date or max_test_date:
+        text += f"{', ' if text else ''}tested {min_test_date or '...'} to {max_test_date or '...'}"
+    text = text or "(all vehicles)"
+    if search_criteria.get('aggregate'):
+        text += f" [{search_criteria['aggregate']['name']}]"
+    if search_criteria.get('export'):
+        text += f" [export {search_criteria['export']['format']}]"
+    return text
@@ -1,9 +1,21 @@
-from PyQt5.QtWidgets import QGroupBox, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton
+from PyQt5.QtCore import Qt, QStringListModel
+from PyQt5.QtWidgets import QGroupBox, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QCompleter, QComboBox
 
 class SearchCriteriaGroup(QGroupBox):
-    def __init__(self, search_callback):
+    """
+    The search form. With a CompletionIndex the make and model fields suggest values as the user
+    types; model suggestions follow the make entered above it. A test date range keeps only the
+    tests taken in it; either end may be left open. An id entered under Lookup replaces the other
+    criteria with that vehicle's test history, or that one test.
+    """
+
+    # Suggestions shown at most per keystroke
+    COMPLETION_LIMIT = 50
+
+    def __init__(self, search_callback, completion=None):
         super().__init__("Search Criteria")
         self.search_callback = search_callback
+        self.completion = completion
 
         search_layout = QVBoxLayout()
 
@@ -38,9 +50,51 @@ class SearchCriteriaGroup(QGroupBox):
         mileage_layout.addWidget(self.max_mileage_edit)
         search_layout.addLayout(mileage_layout)
 
+        # Test date range
+        test_date_layout = QHBoxLayout()
+        test_date_layout.addWidget(QLabel("Tested From:"))
+        self.min_test_date_edit = QLineEdit()
+        self.min_test_date_edit.setPlaceholderText("YYYY-MM-DD")
+        test_date_layout.addWidget(self.min_test_date_edit)
+        test_date_layout.addWidget(QLabel("To:"))
+        self.max_test_date_edit = QLineEdit()
+        self.max_test_date_edit.setPlaceholderText("YYYY-MM-DD")
+        test_date_layout.addWidget(self.max_test_date_edit)
+        search_layout.addLayout(test_date_layout)
+
+        # Lookup by id
+        lookup_layout = QHBoxLayout()
+        lookup_layout.addWidget(QLabel("Lookup:"))
+        self.lookup_field_combo = QComboBox()
+        self.lookup_field_combo.addItem("Vehicle ID", "vehicle_id")
+        self.lookup_field_combo.addItem("Test ID", "test_id")
+        lookup_layout.addWidget(self.lookup_field_combo)
+        self.lookup_edit = QLineEdit()
+        lookup_layout.addWidget(self.lookup_edit)
+        search_layout.addLayout(lookup_layout)
+
+        if completion is not None:
+            self.make_completer = self.add_completer(self.make_edit, self.complete_make)
+            self.model_completer = self.add_completer(self.model_edit, self.complete_model)
+
         # Search Button
         self.search_button = QPushButton("Search")
         self.search_button.clicked.connect(self.search_callback)
         search_layout.addWidget(self.search_button)
 
         self.setLayout(search_layout)
+
+    def add_completer(self, line_edit, refresh):
+        """Attaches a completer whose suggestions refresh() replaces on every edit."""
+        completer = QCompleter(QStringListModel(), self)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        line_edit.setCompleter(completer)
+        line_edit.textEdited.connect(refresh)
+        return completer
+
+    def complete_make(self, text):
+        self.make_completer.model().setStringList(self.completion.complete_make(text, self.COMPLETION_LIMIT))
+
+    def complete_model(self, text):
+        models = self.completion.complete_model(text, self.make_edit.text(), self.COMPLETION_LIMIT)
+        self.model_completer.model().setStringList(models)
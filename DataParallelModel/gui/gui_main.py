@@ -1,31 +1,25 @@
 import sys
 from PyQt5.QtWidgets import QApplication
-from mpi4py import MPI
 from gui.main_window import MainWindow
-from analysis.search_analysis import SearchAnalyzer
 
 
-def gui_main(comm, rank, size, vehicle_df, test_df):
+def gui_main(comm, rank, size, vehicle_df, test_df, backend=None, partition=None, service=None, completion=None):
+    """
+    Runs the window on rank 0. The other ranks never get here; they run worker.worker_main
+    without importing the GUI stack.
+    """
     app = QApplication(sys.argv)
 
-    # Create and show the main window only for the master process
-    if rank == 0:
-        main_window = MainWindow(comm, rank, size, vehicle_df, test_df)
-        main_window.show()
-    else:
-        # Worker processes need a SearchAnalyzer instance but not a GUI
-        search_analyzer = SearchAnalyzer(comm, rank, size)
-        # Keep worker processes alive to participate in the search
-        while True:
-            # Receive search criteria
-            search_criteria = comm.bcast(None, root=0)
+    # Create and show the main window
+    main_window = MainWindow(comm, rank, size, vehicle_df, test_df, backend, partition, service, completion)
+    main_window.show()
 
-            if search_criteria is not None:
-                # Perform search
-                search_analyzer.distribute_search(vehicle_df, test_df, **search_criteria)
-            else:
-                # Exit condition (optional, for graceful termination)
-                break
-
-    if rank == 0:
-        sys.exit(app.exec_())
+    exit_code = app.exec_()
+    if service is not None:
+        service.stop()
+    if backend is not None:
+        backend.close()
+    elif size > 1:
+        # Release the workers waiting for the next search criteria
+        comm.bcast(None, root=0)
+    sys.exit(exit_code)
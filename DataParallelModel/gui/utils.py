@@ -60,6 +60,78 @@ def draw_figure(canvas, result, analysis_type, make, model):
     canvas.figure = fig  # Set the figure on the canvas
     canvas.draw()
 
+def draw_quantiles(canvas, result, make, model):
+    """Plots one curve per quantile column (p50, p90, ...) of a mileage_quantiles result against age."""
+    fig = Figure()
+    axis = fig.add_subplot(111)
+    for column in result.columns:
+        if column.startswith("p"):
+            axis.plot(result["age"], result[column], marker="o", label=column)
+    axis.set_xlabel("Age (Years)")
+    axis.set_ylabel("Mileage at Test")
+    axis.set_title(f"Mileage Quantiles by Age for {make} {model}")
+    axis.legend()
+    canvas.figure = fig
+    canvas.draw()
+
+def draw_ranking(canvas, result, order):
+    """Plots a top_pass_rates result as horizontal bars, first rank at the top."""
+    fig = Figure()
+    axis = fig.add_subplot(111)
+    group_columns = [column for column in result.columns if column in ("make", "model")]
+    labels = result[group_columns].astype(str).agg(" ".join, axis=1)
+    axis.barh(range(len(result)), result["pass_rate"] * 100)
+    axis.set_yticks(range(len(result)))
+    axis.set_yticklabels(labels)
+    axis.invert_yaxis()
+    axis.set_xlabel("Pass Rate (%)")
+    axis.set_title(f"{order.capitalize()} {len(result)} Pass Rates by {' and '.join(group_columns).title()}")
+    fig.tight_layout()
+    canvas.figure = fig
+    canvas.draw()
+
+def draw_distinct(canvas, result, make, model, limit=30):
+    """Plots a distinct_vehicles result as bars, the groups with the most vehicles first."""
+    fig = Figure()
+    axis = fig.add_subplot(111)
+    group_columns = [column for column in result.columns if column not in ("tests", "distinct_vehicles")]
+    if group_columns:
+        result = result.sort_values("distinct_vehicles", ascending=False).head(limit)
+        labels = result[group_columns].astype(str).agg(" ".join, axis=1)
+    else:
+        labels = ["All matching tests"]
+    axis.bar(range(len(result)), result["distinct_vehicles"])
+    axis.set_xticks(range(len(result)))
+    axis.set_xticklabels(labels, rotation=45, ha="right")
+    axis.set_ylabel("Distinct Vehicles (estimated)")
+    axis.set_title(f"Distinct Vehicles for {make} {model}")
+    fig.tight_layout()
+    canvas.figure = fig
+    canvas.draw()
+
+def draw_regional(canvas, result, sort_by, make, model, limit=40):
+    """
+    Plots a regional_pass_rates result as bars in its sorted order, the pass rate of each postcode
+    area with its number of tests on a second axis.
+    """
+    fig = Figure()
+    axis = fig.add_subplot(111)
+    result = result.head(limit)
+    positions = range(len(result))
+    axis.bar(positions, result["pass_rate"] * 100, label="Pass rate")
+    axis.set_xticks(positions)
+    axis.set_xticklabels(result["postcode_area"], rotation=90)
+    axis.set_xlabel("Postcode Area")
+    axis.set_ylabel("Pass Rate (%)")
+    tests_axis = axis.twinx()
+    tests_axis.plot(positions, result["tests"], "o", color="tab:orange", label="Tests")
+    tests_axis.set_ylabel("Tests")
+    sort_label = "Pass Rate" if sort_by == "pass_rate" else "Tests"
+    axis.set_title(f"Pass Rate by Postcode Area for {make} {model} (sorted by {sort_label})")
+    fig.tight_layout()
+    canvas.figure = fig
+    canvas.draw()
+
 class MatplotlibCanvas(FigureCanvas):
     """
     A custom widget to display Matplotlib figures in PyQt5.
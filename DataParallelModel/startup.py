@@ -0,0 +1,51 @@
+import resource
+import sys
+import time
+
+# Modules whose presence on a rank shows that the GUI stack was imported there
+GUI_MODULES = ('PyQt5', 'matplotlib')
+
+
+class StartupReport:
+    """
+    Records how long each startup phase takes on a rank and how heavy the rank ends up.
+
+    app.py creates it before importing anything but the standard library and marks the end of
+    each phase. report() gathers every rank's marks on rank 0 and prints one line per rank, so
+    runs with and without --eager-gui-imports can be compared.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.modules_at_start = len(sys.modules)
+        self.phases = []
+
+    def mark(self, phase):
+        """Records the time since the previous mark under the given phase name."""
+        now = time.perf_counter() - self.started
+        previous = self.phases[-1][2] if self.phases else 0.0
+        self.phases.append((phase, now - previous, now))
+
+    def summary(self, rank):
+        # ru_maxrss is in kilobytes on Linux
+        return {
+            'rank': rank,
+            'phases': [(phase, seconds) for phase, seconds, _ in self.phases],
+            'total': self.phases[-1][2] if self.phases else 0.0,
+            'modules': len(sys.modules) - self.modules_at_start,
+            'gui': [name for name in GUI_MODULES if name in sys.modules],
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+    def report(self, comm, rank):
+        """Collective when comm is given: prints every rank's startup on rank 0."""
+        summary = self.summary(rank)
+        summaries = comm.gather(summary, root=0) if comm is not None else [summary]
+        if rank != 0:
+            return
+        print("Startup report (seconds since process start):")
+        for entry in summaries:
+            phases = ", ".join(f"{phase} {seconds:.3f}" for phase, seconds in entry['phases'])
+            gui = ", ".join(entry['gui']) or "none"
+            print(f"  Rank {entry['rank']}: {phases}; total {entry['total']:.3f}s, "
+                  f"{entry['modules']} modules imported, GUI modules: {gui}, max RSS {entry['max_rss_mb']:.1f} MB")
@@ -0,0 +1,135 @@
+import atexit
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Records timed spans on one rank and writes the spans of every rank as a Chrome trace.
+
+    Spans are buffered in memory on the rank that records them. Other ranks hand their buffer to
+    rank 0 with their query results (drain() there, collect() on rank 0), and rank 0 appends the
+    spans that arrived to the trace file after every query, so a flush costs only what is new.
+    The file is in the JSON array trace format and opens in chrome://tracing or
+    https://ui.perfetto.dev, with one row per rank, so stragglers and communication stalls show
+    up on one timeline. The closing bracket is added at exit; both viewers also load a file that
+    lacks it, e.g. after a crash.
+
+    Tracing is off until enable() is called; span() then costs next to nothing.
+    """
+
+    def __init__(self, max_events=500000):
+        self.enabled = False
+        self.rank = 0
+        self.path = None
+        self.events = []  # Spans recorded on this rank and not yet handed on
+        # Rank 0: spans of every rank not yet written, oldest dropped first
+        self.collected = deque(maxlen=max_events)
+        self.ranks = set()  # Ranks whose name rows are in the file already
+        self.file = None
+        # perf_counter is per process; the offset puts every rank's spans on the shared wall clock
+        self.offset = time.time() - time.perf_counter()
+        self.lock = threading.Lock()
+
+    def enable(self, rank, path=None):
+        """Starts recording on this rank; rank 0 writes the trace to path."""
+        self.enabled = True
+        self.rank = rank
+        self.path = path
+        if rank == 0 and path:
+            atexit.register(self.close)
+
+    @contextmanager
+    def span(self, name, category="compute", **args):
+        """
+        Times the enclosed block as one span.
+
+        Args:
+            name (str): What the block does, e.g. "search" or "send task".
+            category (str): ingest, partition, serialize, comm, compute or aggregate.
+            **args: Extra details shown when the span is selected, e.g. rows or bytes.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, started, time.perf_counter(), args)
+
+    def add(self, name, category, started, stopped, args=None):
+        """Records a span from two perf_counter readings."""
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (started + self.offset) * 1e6,
+            'dur': (stopped - started) * 1e6,
+            'pid': self.rank,
+            'tid': threading.get_native_id(),
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+    def drain(self):
+        """Returns this rank's buffered spans and empties the buffer."""
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def collect(self, events):
+        """Rank 0: keeps spans received from another rank."""
+        if events:
+            self.collected.extend(events)
+
+    def flush(self, gathered=()):
+        """
+        Rank 0: adds its own spans and any gathered span lists, then appends them to the trace file.
+
+        Does nothing on other ranks, whose spans must reach rank 0 through drain() first.
+        """
+        if not self.enabled or self.rank != 0:
+            return
+        self.collect(self.drain())
+        for events in gathered:
+            self.collect(events)
+        if self.path:
+            self.write()
+
+    def write(self):
+        """Appends the spans collected since the last write, naming every rank seen for the first time."""
+        if self.file is None:
+            self.file = open(self.path, 'w')
+            self.file.write("[\n")
+            separator = ""
+        else:
+            separator = ",\n"
+        events = list(self.collected)
+        self.collected.clear()
+        for rank in sorted(({event['pid'] for event in events} | {self.rank}) - self.ranks):
+            events += [{'name': 'process_name', 'ph': 'M', 'pid': rank, 'args': {'name': f"Rank {rank}"}},
+                       {'name': 'process_sort_index', 'ph': 'M', 'pid': rank, 'args': {'sort_index': rank}}]
+            self.ranks.add(rank)
+        if events:
+            self.file.write(separator + ",\n".join(json.dumps(event) for event in events))
+            self.file.flush()
+
+    def close(self):
+        """Rank 0: writes what is left and ends the JSON array, making the file strict JSON."""
+        if self.file is None and not (self.enabled and self.rank == 0 and self.path):
+            return
+        self.flush()
+        self.file.write("\n]\n")
+        self.file.close()
+        self.file = None
+        self.enabled = False
+
+
+# The tracer of this process; app.py enables it with --trace
+tracer = Tracer()
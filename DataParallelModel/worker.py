@@ -0,0 +1,23 @@
+from analysis.search_analysis import SearchAnalyzer
+
+
+def worker_main(comm, rank, size, vehicle_df, test_df, partition=None):
+    """
+    Headless entry point for worker ranks.
+
+    Workers never show a window, so only the data and analysis layers are imported here; PyQt5
+    and Matplotlib are left to rank 0.
+    """
+    # Worker processes need a SearchAnalyzer instance but not a GUI
+    search_analyzer = SearchAnalyzer(comm, rank, size, partition=partition)
+    # Keep worker processes alive to participate in the search
+    while True:
+        # Receive the next batch of search criteria
+        search_criteria_batch = comm.bcast(None, root=0)
+
+        if search_criteria_batch is not None:
+            # Perform the searches
+            search_analyzer.distribute_search_batch(vehicle_df, test_df, search_criteria_batch)
+        else:
+            # Rank 0 closed its window
+            break
@@ -0,0 +1,506 @@
+import math
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+# Aggregate classes by the name a search_criteria 'aggregate' spec gives
+AGGREGATES = {}
+
+
+def register(cls):
+    """
+    Class decorator making an Aggregate available under its name.
+
+    Raises:
+        TypeError: If the class leaves an abstract method unimplemented, so the mistake shows up
+            on import rather than in the middle of a distributed query.
+    """
+    if cls.__abstractmethods__:
+        raise TypeError(f"aggregate {cls.name!r} does not implement {sorted(cls.__abstractmethods__)}")
+    AGGREGATES[cls.name] = cls
+    return cls
+
+
+def create_aggregate(spec):
+    """
+    Builds the Aggregate a search_criteria 'aggregate' spec asks for.
+
+    Args:
+        spec (dict): {'name': ...} plus the parameters of that aggregate, or None.
+
+    Returns:
+        Aggregate: The aggregate, or None when spec is None.
+
+    Raises:
+        ValueError: If the name is unknown or the parameters are invalid.
+    """
+    if spec is None:
+        return None
+    if not isinstance(spec, dict) or spec.get('name') not in AGGREGATES:
+        raise ValueError(f"aggregate must be an object with a name from {sorted(AGGREGATES)}")
+    params = {key: value for key, value in spec.items() if key != 'name'}
+    try:
+        return AGGREGATES[spec['name']](**params)
+    except TypeError as e:
+        raise ValueError(f"bad parameters for aggregate {spec['name']!r}: {e}")
+
+
+def split_aggregates(search_criteria_batch):
+    """
+    Separates the aggregates from a batch of search_criteria dicts.
+
+    Returns:
+        tuple: (the criteria without their 'aggregate' key, an Aggregate or None per search)
+    """
+    criteria_batch = [{key: value for key, value in search_criteria.items() if key != 'aggregate'}
+                      for search_criteria in search_criteria_batch]
+    aggregates = [create_aggregate(search_criteria.get('aggregate')) for search_criteria in search_criteria_batch]
+    return criteria_batch, aggregates
+
+
+def summarize(results, aggregates):
+    """Replaces the matching rows of every aggregated search by its partial."""
+    return [rows if aggregate is None else aggregate.partial(rows) for rows, aggregate in zip(results, aggregates)]
+
+
+def combine(parts, aggregate):
+    """Joins one search's results from several ranks, tasks or blocks: rows are concatenated, partials merged."""
+    return pd.concat(parts) if aggregate is None else aggregate.merge(parts)
+
+
+def finalize(results, aggregates):
+    """Turns the merged partials of the aggregated searches into their result DataFrames."""
+    return [rows if aggregate is None else aggregate.finalize(rows) for rows, aggregate in zip(results, aggregates)]
+
+
+def vehicle_age(rows):
+    """Years between first use and the test, as calculate_pass_rate_by_age counts them."""
+    return pd.to_datetime(rows['test_date']).dt.year - pd.to_datetime(rows['first_use_date']).dt.year
+
+
+class Aggregate(ABC):
+    """
+    A summary of a search's matching rows, computed where the rows are.
+
+    Every rank (task, block) turns its share of the matching rows into a small picklable partial,
+    rank 0 merges the partials and finalize turns the merged partial into the DataFrame that is
+    returned as the search's result. Merging must not depend on how the rows were split, so the
+    result is the same for any number of ranks. Only partials travel, never the rows. A subclass
+    that leaves out one of the methods below cannot be instantiated.
+    """
+
+    name = None
+
+    @abstractmethod
+    def spec(self):
+        """The search_criteria 'aggregate' value that recreates this aggregate."""
+
+    @abstractmethod
+    def partial(self, rows):
+        """The partial of one share of a search's matching rows."""
+
+    @abstractmethod
+    def merge(self, partials):
+        """One partial summarising the rows of several partials."""
+
+    @abstractmethod
+    def finalize(self, partial):
+        """The search's result DataFrame from the merged partial."""
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative error bound, after DDSketch.
+
+    Positive values are counted in logarithmic buckets: bucket i holds the values in
+    (gamma^(i-1), gamma^i] with gamma = (1 + alpha) / (1 - alpha), and a quantile is answered with
+    the middle of its bucket, within relative_accuracy (alpha) of the true value of that rank.
+    Zeros and negative values share one bucket of their own. Merging adds bucket counts, so the
+    sketches of any split of the data merge into the sketch of all of it. Beyond max_buckets the
+    lowest buckets are collapsed, which only coarsens the lowest quantiles.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        positive = values[values > 0]
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        self._collapse()
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge quantile sketches of different accuracy")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+        return self
+
+    def _collapse(self):
+        if len(self.buckets) <= self.max_buckets:
+            return
+        keys = sorted(self.buckets)
+        lowest = keys[:len(keys) - self.max_buckets + 1]
+        self.buckets[lowest[-1]] = sum(self.buckets.pop(key) for key in lowest)
+
+    def quantile(self, q):
+        """The value at quantile q (0 to 1), or NaN for an empty sketch."""
+        if self.count == 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                break
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+
+def bit_lengths(values):
+    """int.bit_length() of every value of a uint64 array, by halving with shifts rather than through floats."""
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >> np.uint64(shift) != 0
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    return lengths + values.astype(np.int64)
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct-count sketch (HyperLogLog) over 64-bit hashes.
+
+    The first precision bits of a value's hash pick one of 2^precision registers, which keeps the
+    longest run of leading zeros seen in the remaining bits. The standard error of the estimate is
+    about 1.04 / sqrt(2^precision), 1.6% for the default 4 KB of registers. Merging takes the
+    register-wise maximum, so sketches of any split of the data merge into the sketch of all of it
+    however many times a value occurs in each part.
+    """
+
+    def __init__(self, precision=12):
+        if isinstance(precision, bool) or not isinstance(precision, int) or not 4 <= precision <= 18:
+            raise ValueError("precision must be an integer from 4 to 18")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @staticmethod
+    def hash_values(values):
+        """64-bit hashes that are the same on every rank (unlike hash(), which is salted per process)."""
+        return pd.util.hash_pandas_object(pd.Series(values).astype(str), index=False).to_numpy()
+
+    def add(self, values):
+        hashes = self.hash_values(values)
+        if not len(hashes):
+            return
+        width = 64 - self.precision
+        registers = (hashes >> np.uint64(width)).astype(np.intp)
+        rest = hashes & np.uint64((1 << width) - 1)
+        np.maximum.at(self.registers, registers, (width - bit_lengths(rest) + 1).astype(np.uint8))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLog sketches of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # Linear counting is more accurate for small counts
+        return float(raw)
+
+
+@register
+class MileageQuantiles(Aggregate):
+    """
+    Quantiles of the mileage at test, per vehicle age, from one QuantileSketch per age.
+
+    The result has one row per age with the number of tests and a column per quantile (p50, p90).
+    """
+
+    name = 'mileage_quantiles'
+
+    def __init__(self, quantiles=(0.5, 0.9), relative_accuracy=0.01):
+        quantiles = list(quantiles)
+        if not quantiles or not all(isinstance(q, (int, float)) and 0 <= q <= 1 for q in quantiles):
+            raise ValueError("quantiles must be numbers between 0 and 1")
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+        QuantileSketch(relative_accuracy)  # Checks the accuracy before any rank sees it
+
+    def spec(self):
+        return {'name': self.name, 'quantiles': self.quantiles, 'relative_accuracy': self.relative_accuracy}
+
+    def partial(self, rows):
+        sketches = {}
+        if rows.empty:
+            return sketches
+        mileage = pd.to_numeric(rows['test_mileage'], errors='coerce')
+        for age, values in mileage.groupby(vehicle_age(rows)):
+            sketch = QuantileSketch(self.relative_accuracy)
+            sketch.add(values.to_numpy())
+            sketches[int(age)] = sketch
+        return sketches
+
+    def merge(self, partials):
+        merged = {}
+        for sketches in partials:
+            for age, sketch in sketches.items():
+                if age in merged:
+                    merged[age].merge(sketch)
+                else:
+                    merged[age] = sketch
+        return merged
+
+    def finalize(self, partial):
+        columns = ['tests'] + [f"p{q * 100:g}" for q in self.quantiles]
+        rows = [[sketch.count] + [sketch.quantile(q) for q in self.quantiles]
+                for age, sketch in sorted(partial.items())]
+        result = pd.DataFrame(rows, index=pd.Index(sorted(partial), name='age'), columns=columns)
+        return result.reset_index()
+
+
+@register
+class TopPassRates(Aggregate):
+    """
+    The k groups (makes, models or make and model pairs) with the best or worst pass rates.
+
+    Partials are pass and test counts per group, so merging them costs one row per group however
+    many tests matched. Groups with fewer than min_tests tests are left out of the ranking; ties
+    are broken by the number of tests, then by name, so the ranking does not depend on the split.
+    """
+
+    name = 'top_pass_rates'
+    GROUPINGS = {'make': ['make'], 'model': ['model'], 'make_model': ['make', 'model']}
+    ORDERS = ('best', 'worst')
+
+    def __init__(self, group_by='make_model', k=10, min_tests=1, order='worst'):
+        if group_by not in self.GROUPINGS:
+            raise ValueError(f"group_by must be one of {sorted(self.GROUPINGS)}")
+        if order not in self.ORDERS:
+            raise ValueError(f"order must be one of {list(self.ORDERS)}")
+        for key, value in (('k', k), ('min_tests', min_tests)):
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError(f"{key} must be a positive integer")
+        self.group_by = group_by
+        self.k = k
+        self.min_tests = min_tests
+        self.order = order
+        self.columns = self.GROUPINGS[group_by]
+
+    def spec(self):
+        return {'name': self.name, 'group_by': self.group_by, 'k': self.k, 'min_tests': self.min_tests,
+                'order': self.order}
+
+    def partial(self, rows):
+        if rows.empty:
+            empty = pd.DataFrame({column: pd.Series(dtype=object) for column in self.columns})
+            return empty.assign(passes=np.int64(0), tests=np.int64(0)).set_index(self.columns)
+        keys = [rows[column].astype(str) for column in self.columns]
+        passed = (rows['test_result'] == 'P').astype(np.int64)
+        counts = passed.groupby(keys).agg(['sum', 'size'])
+        counts.columns = ['passes', 'tests']
+        return counts
+
+    def merge(self, partials):
+        counts = pd.concat(partials)
+        return counts.groupby(level=list(range(counts.index.nlevels))).sum()
+
+    def finalize(self, partial):
+        counts = partial[partial['tests'] >= self.min_tests].reset_index()
+        counts['pass_rate'] = counts['passes'] / counts['tests']
+        counts = counts.sort_values(['pass_rate', 'tests'] + self.columns,
+                                    ascending=[self.order == 'worst', False] + [True] * len(self.columns))
+        ranked = counts.head(self.k).reset_index(drop=True)
+        ranked.insert(0, 'rank', range(1, len(ranked) + 1))
+        return ranked[['rank'] + self.columns + ['tests', 'passes', 'pass_rate']]
+
+
+@register
+class DistinctVehicles(Aggregate):
+    """
+    Approximate number of distinct vehicles among the matching tests, from HyperLogLog sketches.
+
+    Optionally per make, model, make and model, or postcode area. The result has one row per
+    group (a single row without grouping) with its number of tests and estimated distinct vehicles.
+    """
+
+    name = 'distinct_vehicles'
+    GROUPINGS = {None: [], 'make': ['make'], 'model': ['model'], 'make_model': ['make', 'model'],
+                 'postcode_area': ['postcode_area']}
+
+    def __init__(self, group_by=None, precision=12):
+        if group_by not in self.GROUPINGS:
+            raise ValueError(f"group_by must be null or one of {sorted(key for key in self.GROUPINGS if key)}")
+        self.group_by = group_by
+        self.precision = precision
+        self.columns = self.GROUPINGS[group_by]
+        HyperLogLog(precision)  # Checks the precision before any rank sees it
+
+    def spec(self):
+        return {'name': self.name, 'group_by': self.group_by, 'precision': self.precision}
+
+    def partial(self, rows):
+        """{group key tuple: (tests, sketch)}"""
+        counts = {}
+        if rows.empty:
+            return counts
+        if not self.columns:
+            groups = [((), rows['vehicle_id'])]
+        else:
+            keys = [rows[column].astype(str) for column in self.columns]
+            groups = rows['vehicle_id'].groupby(keys)
+        for key, vehicle_ids in groups:
+            sketch = HyperLogLog(self.precision)
+            sketch.add(vehicle_ids)
+            counts[key if isinstance(key, tuple) else (key,)] = (len(vehicle_ids), sketch)
+        return counts
+
+    def merge(self, partials):
+        merged = {}
+        for counts in partials:
+            for key, (tests, sketch) in counts.items():
+                if key in merged:
+                    merged_tests, merged_sketch = merged[key]
+                    merged[key] = (merged_tests + tests, merged_sketch.merge(sketch))
+                else:
+                    merged[key] = (tests, sketch)
+        return merged
+
+    def finalize(self, partial):
+        rows = [list(key) + [tests, round(sketch.estimate())] for key, (tests, sketch) in sorted(partial.items())]
+        if not rows and not self.columns:
+            rows = [[0, 0]]
+        return pd.DataFrame(rows, columns=self.columns + ['tests', 'distinct_vehicles'])
+
+
+@register
+class RegionalPassRates(Aggregate):
+    """
+    Pass rate and number of tests per postcode area of the matching tests.
+
+    Partials are pass and test counts per area, as for TopPassRates. Areas with fewer than
+    min_tests tests are left out; the rest are sorted by pass rate or by number of tests, highest
+    first, ties broken by the other measure and then by area.
+    """
+
+    name = 'regional_pass_rates'
+    SORTS = ('pass_rate', 'tests')
+
+    def __init__(self, sort_by='pass_rate', min_tests=1):
+        if sort_by not in self.SORTS:
+            raise ValueError(f"sort_by must be one of {list(self.SORTS)}")
+        if isinstance(min_tests, bool) or not isinstance(min_tests, int) or min_tests < 1:
+            raise ValueError("min_tests must be a positive integer")
+        self.sort_by = sort_by
+        self.min_tests = min_tests
+
+    def spec(self):
+        return {'name': self.name, 'sort_by': self.sort_by, 'min_tests': self.min_tests}
+
+    @staticmethod
+    def empty_partial():
+        return pd.DataFrame({'passes': pd.Series(dtype=np.int64), 'tests': pd.Series(dtype=np.int64)},
+                            index=pd.Index([], dtype=object, name='postcode_area'))
+
+    def partial(self, rows):
+        if rows.empty:
+            return self.empty_partial()
+        passed = (rows['test_result'] == 'P').astype(np.int64)
+        counts = passed.groupby(rows['postcode_area'].astype(str)).agg(['sum', 'size'])
+        counts.columns = ['passes', 'tests']
+        return counts
+
+    def merge(self, partials):
+        return pd.concat(partials).groupby(level=0).sum()
+
+    def finalize(self, partial):
+        counts = partial[partial['tests'] >= self.min_tests].reset_index()
+        counts['pass_rate'] = counts['passes'] / counts['tests']
+        other = 'tests' if self.sort_by == 'pass_rate' else 'pass_rate'
+        counts = counts.sort_values([self.sort_by, other, 'postcode_area'], ascending=[False, False, True])
+        return counts[['postcode_area', 'tests', 'passes', 'pass_rate']].reset_index(drop=True)
+
+
+class RegionalCounters:
+    """
+    Pass and test counts per make, model, first-use year and postcode area of a set of rows.
+
+    Built once, they answer every regional_pass_rates search that filters on nothing but make,
+    model and year without reading a row: the search's partial is the sum of the counters it
+    selects. Counters of disjoint row ranges are merged like partials.
+    """
+
+    LEVELS = ['make', 'model', 'year', 'postcode_area']
+
+    def __init__(self, counts):
+        self.counts = counts  # passes and tests, indexed by LEVELS
+
+    @classmethod
+    def build(cls, blocks):
+        """Counts the tests of (vehicle_df, test_df) blocks, each holding the tests of its vehicles."""
+        parts = []
+        for vehicle_df, test_df in blocks:
+            if vehicle_df.empty or test_df.empty:
+                continue
+            rows = pd.merge(vehicle_df[['vehicle_id', 'make', 'model', 'first_use_date']],
+                            test_df[['vehicle_id', 'test_result', 'postcode_area']], on='vehicle_id')
+            keys = [rows['make'].astype(str), rows['model'].astype(str),
+                    pd.to_datetime(rows['first_use_date']).dt.year, rows['postcode_area'].astype(str)]
+            passed = (rows['test_result'] == 'P').astype(np.int64)
+            counts = passed.groupby(keys, dropna=False).agg(['sum', 'size'])
+            counts.columns = ['passes', 'tests']
+            counts.index.names = cls.LEVELS
+            parts.append(counts)
+        return cls.merge([cls(counts) for counts in parts])
+
+    @classmethod
+    def merge(cls, counters):
+        parts = [counter.counts for counter in counters if counter is not None and not counter.counts.empty]
+        if not parts:
+            empty = pd.MultiIndex.from_arrays([[]] * len(cls.LEVELS), names=cls.LEVELS)
+            return cls(pd.DataFrame({'passes': pd.Series(dtype=np.int64), 'tests': pd.Series(dtype=np.int64)},
+                                    index=empty))
+        return cls(pd.concat(parts).groupby(level=cls.LEVELS, dropna=False).sum())
+
+    @staticmethod
+    def covers(search_kwargs):
+        """Whether a search filters on make, model and year only, so the counters can answer it."""
+        mileage = search_kwargs.get('min_mileage') is not None and search_kwargs.get('max_mileage') is not None
+        return not mileage and not search_kwargs.get('min_test_date') and not search_kwargs.get('max_test_date')
+
+    def partial(self, search_kwargs):
+        """The regional_pass_rates partial of a search the counters cover."""
+        counts = self.counts
+        selected = np.ones(len(counts), dtype=bool)
+        for level in ('make', 'model'):
+            if search_kwargs.get(level):
+                selected &= counts.index.get_level_values(level) == search_kwargs[level].upper()
+        if search_kwargs.get('year'):
+            selected &= counts.index.get_level_values('year') == search_kwargs['year']
+        if not selected.any():
+            return RegionalPassRates.empty_partial()
+        return counts[selected].groupby(level='postcode_area').sum()
@@ -0,0 +1,97 @@
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from tracing import tracer
+
+# Sorts after every character a make or model can hold, closing a prefix range
+PREFIX_END = '\U0010ffff'
+
+
+class CompletionIndex:
+    """
+    Sorted unique makes and models for as-you-type completion on rank 0.
+
+    Built once at load time from the distinct (make, model) pairs, so a lookup is two bisects over
+    a sorted list and never involves the workers. Keys are upper-case like the data and the
+    searches (see SearchAnalyzer.search_by_make), so completing a prefix in any case finds them.
+    Models are also kept per make, so model suggestions can follow the chosen make.
+    """
+
+    def __init__(self, pairs):
+        """
+        Args:
+            pairs (pd.DataFrame): Distinct vehicles' 'make' and 'model' columns; duplicates and
+                missing values are dropped here.
+        """
+        pairs = pairs[['make', 'model']].dropna().astype(str)
+        pairs = pairs.apply(lambda column: column.str.strip().str.upper())
+        pairs = pairs[(pairs['make'] != '') & (pairs['model'] != '')].drop_duplicates()
+        pairs = pairs.sort_values(['make', 'model'], ignore_index=True)
+        self.makes = sorted(pairs['make'].unique())
+        self.models = sorted(pairs['model'].unique())
+        self.models_by_make = {make: group.tolist() for make, group in pairs.groupby('make', sort=False)['model']}
+
+    @classmethod
+    def gather(cls, comm, rank, vehicle_df=None, partition=None):
+        """
+        Collective when a partition is given: builds the index on rank 0.
+
+        With a partition every rank contributes the distinct pairs of its own share, read block by
+        block and not cached, so rank 0 needs no rows of its own (column store, distributed tables);
+        otherwise rank 0 reads vehicle_df alone.
+
+        Returns:
+            CompletionIndex: The index on rank 0, None on the other ranks.
+        """
+        with tracer.span("build completion index", "ingest"):
+            if partition is None:
+                if rank != 0:
+                    return None
+                return cls(vehicle_df if vehicle_df is not None else pd.DataFrame(columns=['make', 'model']))
+
+            local_pairs = [distinct_pairs(vehicle_block)
+                           for vehicle_block, _ in partition.blocks(*partition.rank_range())]
+            local_pairs = [pairs for pairs in local_pairs if pairs is not None]
+            local_pairs = pd.concat(local_pairs, ignore_index=True).drop_duplicates() if local_pairs else None
+            gathered = comm.gather(local_pairs, root=0) if comm is not None else [local_pairs]
+            if rank != 0:
+                return None
+            gathered = [pairs for pairs in gathered if pairs is not None]
+            index = cls(pd.concat(gathered, ignore_index=True) if gathered
+                        else pd.DataFrame(columns=['make', 'model']))
+        print(f"Rank 0: Completion index with {len(index.makes)} makes and {len(index.models)} models")
+        return index
+
+    @staticmethod
+    def _complete(values, prefix, limit):
+        prefix = prefix.strip().upper()
+        start = bisect_left(values, prefix)
+        stop = bisect_left(values, prefix + PREFIX_END, lo=start)
+        return values[start:min(stop, start + limit)]
+
+    def complete_make(self, prefix, limit=20):
+        """The first limit makes starting with prefix, in sorted order."""
+        return self._complete(self.makes, prefix, limit)
+
+    def complete_model(self, prefix, make=None, limit=20):
+        """The first limit models starting with prefix, only those of make when one is given."""
+        make = (make or '').strip().upper()
+        values = self.models_by_make.get(make, []) if make else self.models
+        return self._complete(values, prefix, limit)
+
+
+def distinct_pairs(vehicle_df):
+    """The distinct (make, model) pairs of a vehicle frame, or None when it has no such columns."""
+    if vehicle_df is None or 'make' not in vehicle_df.columns or 'model' not in vehicle_df.columns:
+        return None
+    pairs = vehicle_df[['make', 'model']]
+    if all(isinstance(pairs[column].dtype, pd.CategoricalDtype) for column in pairs.columns):
+        # Column store blocks: deduplicate the integer codes before touching any strings
+        codes = np.stack([pairs['make'].cat.codes.to_numpy(), pairs['model'].cat.codes.to_numpy()], axis=1)
+        codes = np.unique(codes, axis=0)
+        codes = codes[(codes >= 0).all(axis=1)]
+        return pd.DataFrame({'make': pairs['make'].cat.categories[codes[:, 0]],
+                             'model': pairs['model'].cat.categories[codes[:, 1]]})
+    return pairs.drop_duplicates()
@@ -0,0 +1,164 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data.modules.column_store import categoricals_to_objects, decode_columns, encode_columns
+
+# CSV text, or numpy archives with one array per column encoded as in the column store
+EXPORT_FORMATS = ('csv', 'npz')
+MANIFEST_FILE = "manifest.json"
+# One row per file of an export, in row order
+PART_COLUMNS = ['file', 'rows', 'bytes']
+
+
+def create_export(spec):
+    """
+    Checks a search_criteria 'export' spec and fills in its defaults.
+
+    An exported search returns the files its rows were written to instead of the rows: every
+    worker writes its own share into the directory and rank 0 adds a manifest. With single_file
+    the data parallel ranks write one CSV file together through MPI-IO; the master-worker model
+    writes a file per task either way.
+
+    Args:
+        spec (dict): {'directory': ..., 'format': 'csv' or 'npz', 'single_file': bool}, or None.
+
+    Returns:
+        dict: The complete spec, or None when spec is None.
+
+    Raises:
+        ValueError: If the directory is missing or the format or single_file are invalid.
+    """
+    if spec is None:
+        return None
+    if not isinstance(spec, dict) or not isinstance(spec.get('directory'), str) or not spec['directory']:
+        raise ValueError("export must be an object with a directory")
+    unknown = set(spec) - {'directory', 'format', 'single_file'}
+    if unknown:
+        raise ValueError(f"unknown export keys {sorted(unknown)}")
+    export = {'directory': spec['directory'], 'format': spec.get('format', 'csv'),
+              'single_file': spec.get('single_file', False)}
+    if export['format'] not in EXPORT_FORMATS:
+        raise ValueError(f"export format must be one of {list(EXPORT_FORMATS)}")
+    if not isinstance(export['single_file'], bool):
+        raise ValueError("export single_file must be true or false")
+    if export['single_file'] and export['format'] != 'csv':
+        raise ValueError("only csv exports can be written as a single file")
+    return export
+
+
+def split_exports(search_criteria_batch):
+    """
+    Separates the exports from a batch of search_criteria dicts, like split_aggregates.
+
+    Returns:
+        tuple: (the criteria without their 'export' key, an export spec or None per search)
+
+    Raises:
+        ValueError: If a spec is invalid, or a search has both an export and an aggregate.
+    """
+    if any(search_criteria.get('export') is not None and search_criteria.get('aggregate') is not None
+           for search_criteria in search_criteria_batch):
+        raise ValueError("an exported search cannot have an aggregate")
+    criteria_batch = [{key: value for key, value in search_criteria.items() if key != 'export'}
+                      for search_criteria in search_criteria_batch]
+    exports = [create_export(search_criteria.get('export')) for search_criteria in search_criteria_batch]
+    return criteria_batch, exports
+
+
+def part_name(index, export):
+    """The file of the index-th share of an export; a share that is written twice gets the same file."""
+    return f"part-{index:010d}.{export['format']}"
+
+
+def empty_parts():
+    return pd.DataFrame({'file': pd.Series(dtype=object), 'rows': pd.Series(dtype=np.int64),
+                         'bytes': pd.Series(dtype=np.int64)})
+
+
+def clear_export(export):
+    """Creates the export directory, removing the files of an earlier export into it."""
+    directory = export['directory']
+    os.makedirs(directory, exist_ok=True)
+    for path in [os.path.join(directory, MANIFEST_FILE)] + glob.glob(os.path.join(directory, "part-*")):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def write_part(rows, export, name):
+    """
+    Writes a share of an export's rows to one file of its directory.
+
+    The file is written under a temporary name and renamed, so a reader, or a second copy of the
+    same task, never sees it half written. Shares without rows get no file.
+
+    Returns:
+        pd.DataFrame: The share's PART_COLUMNS row, or no row when nothing was written.
+    """
+    if rows.empty:
+        return empty_parts()
+    path = os.path.join(export['directory'], name)
+    temporary = f"{path}.{os.getpid()}"
+    try:
+        if export['format'] == 'csv':
+            rows.to_csv(temporary, index=False)
+        else:
+            arrays, meta = encode_columns(rows)
+            with open(temporary, 'wb') as f:
+                np.savez(f, meta=np.array(json.dumps(meta, default=str)), **{f"column/{column}": values
+                                                                              for column, values in arrays.items()})
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return pd.DataFrame({'file': [name], 'rows': [len(rows)], 'bytes': [os.path.getsize(path)]})
+
+
+def write_manifest(export, parts, search_criteria):
+    """
+    Writes the manifest of a finished export, listing its files in row order.
+
+    The manifest is written last and marks the export as complete.
+
+    Returns:
+        pd.DataFrame: parts, with a fresh index.
+    """
+    parts = parts.reset_index(drop=True)
+    manifest = {
+        'format': export['format'],
+        'criteria': {key: value for key, value in search_criteria.items() if key != 'export'},
+        'rows': int(parts['rows'].sum()),
+        'bytes': int(parts['bytes'].sum()),
+        'parts': [{'file': part.file, 'rows': int(part.rows), 'bytes': int(part.bytes)}
+                  for part in parts.itertuples()],
+    }
+    path = os.path.join(export['directory'], MANIFEST_FILE)
+    with open(path + f".{os.getpid()}", 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(path + f".{os.getpid()}", path)
+    return parts
+
+
+def read_export(directory):
+    """
+    Reads the rows of a finished export back into one DataFrame, in row order.
+
+    Raises:
+        FileNotFoundError: If the directory holds no manifest, e.g. because the export did not finish.
+    """
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    frames = []
+    for part in manifest['parts']:
+        path = os.path.join(directory, part['file'])
+        if manifest['format'] == 'csv':
+            frames.append(pd.read_csv(path))
+        else:
+            with np.load(path) as archive:
+                meta = json.loads(str(archive['meta']))
+                arrays = {column: archive[f"column/{column}"] for column in meta['columns']}
+            frames.append(categoricals_to_objects(decode_columns(arrays, meta)))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from data.modules.column_store import categoricals_to_objects
+
+# search_criteria keys that turn a search into a lookup of one vehicle's or one test's history
+LOOKUP_FIELDS = ('vehicle_id', 'test_id')
+# Ids hashed at a time while filling a Bloom filter, bounding the memory of the bit positions
+BLOOM_CHUNK = 1 << 16
+
+
+def lookup_key(search_criteria):
+    """The (field, id) a search_criteria dict looks up, or None for an ordinary search."""
+    for field in LOOKUP_FIELDS:
+        value = search_criteria.get(field)
+        if value is not None and str(value).strip():
+            return field, str(value).strip()
+    return None
+
+
+def id_hashes(values):
+    """64-bit hashes of ids as strings, the same on every rank (unlike hash(), which is salted per process)."""
+    return pd.util.hash_pandas_object(pd.Series(values).astype(str), index=False).to_numpy()
+
+
+def id_strings(series):
+    """Ids as plain strings, the form lookups compare them in whatever dtype the column has."""
+    return series.astype(str).to_numpy(dtype=object)
+
+
+def history(source, index, field, value, columns):
+    """
+    The rows a lookup returns: the vehicle holding the id paired with its tests in date order, only
+    the one test for a test_id; no rows when the index does not hold the id.
+
+    Args:
+        source: Anything with a frames(start, stop) method over the rows index was built from.
+        index (IdIndex): The hash index of those rows.
+        columns (list): The result columns, in display order.
+    """
+    row = index.vehicle_row(field, value)
+    if row is None:
+        return pd.DataFrame(columns=columns)
+    vehicle_df, test_df = (categoricals_to_objects(frame.copy()) for frame in source.frames(row, row + 1))
+    if field == 'test_id':
+        test_df = test_df[id_strings(test_df['test_id']) == value]
+    rows = pd.merge(vehicle_df, test_df, on='vehicle_id', how='left').reindex(columns=columns)
+    return rows.sort_values('test_date', kind='stable').reset_index(drop=True)
+
+
+class BloomFilter:
+    """
+    Bit array telling whether an id is possibly present or certainly absent.
+
+    Sized for capacity ids at the given false positive rate, about 9.6 bits per id at 1%; the
+    num_hashes bit positions of an id come from the two halves of its 64-bit hash (double hashing).
+    Small enough for the master to keep one per partition and id kind.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.num_bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, values):
+        hashes = id_hashes(values)
+        first = hashes >> np.uint64(32)
+        second = (hashes & np.uint64(0xFFFFFFFF)) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return ((first[:, None] + steps * second[:, None]) % np.uint64(self.num_bits)).astype(np.int64)
+
+    def add(self, values):
+        flags = np.unpackbits(self.bits, count=self.num_bits, bitorder='little').astype(bool)
+        for start in range(0, len(values), BLOOM_CHUNK):
+            flags[self._positions(values[start:start + BLOOM_CHUNK]).ravel()] = True
+        self.bits = np.packbits(flags, bitorder='little')
+
+    def __contains__(self, value):
+        positions = self._positions([value])[0]
+        return bool(np.all((self.bits[positions >> 3] >> (positions & 7)) & 1))
+
+
+class IdIndex:
+    """
+    Hash index from the vehicle and test ids of one partition to the global vehicle row holding them.
+
+    A lookup is one hash probe followed by reading that single vehicle row with its tests, so it
+    costs the same however many rows the partition has. The Bloom filters of both id sets are what
+    the partition shows the master, which then contacts only the partitions that may hold an id.
+    """
+
+    def __init__(self, blocks, start=0, error_rate=0.01):
+        """
+        Args:
+            blocks (iterable): (vehicle_df, test_df) blocks of consecutive vehicle rows, each with
+                the tests of its vehicles.
+            start (int): Global row of the first vehicle of the first block.
+            error_rate (float): False positive rate of the Bloom filters.
+        """
+        vehicle_ids, vehicle_rows, test_ids, test_rows = [], [], [], []
+        for vehicle_df, test_df in blocks:
+            ids = id_strings(vehicle_df['vehicle_id'])
+            positions = pd.Index(ids).get_indexer(id_strings(test_df['vehicle_id']))
+            found = positions >= 0
+            vehicle_ids.append(ids)
+            vehicle_rows.append(start + np.arange(len(ids), dtype=np.int64))
+            test_ids.append(id_strings(test_df['test_id'])[found])
+            test_rows.append(start + positions[found].astype(np.int64))
+            start += len(ids)
+
+        self.rows = {
+            'vehicle_id': self._unique(vehicle_ids, vehicle_rows),
+            'test_id': self._unique(test_ids, test_rows),
+        }
+        self.filters = {}
+        for field, rows in self.rows.items():
+            self.filters[field] = BloomFilter(len(rows), error_rate)
+            self.filters[field].add(rows.index.to_numpy())
+
+    @staticmethod
+    def _unique(ids, rows):
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=object)
+        rows = pd.Series(np.concatenate(rows) if rows else np.empty(0, dtype=np.int64), index=pd.Index(ids))
+        return rows[~rows.index.duplicated()]
+
+    def __len__(self):
+        return len(self.rows['vehicle_id'])
+
+    def vehicle_row(self, field, value):
+        """The global vehicle row holding an id, or None when this partition does not hold it."""
+        rows = self.rows[field]
+        position = rows.index.get_indexer([value])[0]
+        return None if position < 0 else int(rows.iloc[position])
+
+
+class FrameSource:
+    """
+    Vehicle row ranges of frames that are not aligned by vehicle, with their tests, like a
+    partition's frames(). Serves lookups where one process holds the whole tables itself.
+    """
+
+    def __init__(self, vehicle_df, test_df):
+        self.vehicle_df = vehicle_df
+        self.test_df = test_df
+        codes = pd.Index(id_strings(vehicle_df['vehicle_id'])).get_indexer(id_strings(test_df['vehicle_id']))
+        self.test_order = np.argsort(codes, kind='stable')
+        self.test_offsets = np.searchsorted(codes[self.test_order], np.arange(len(vehicle_df) + 1))
+
+    def frames(self, start, stop):
+        test_rows = self.test_order[self.test_offsets[start]:self.test_offsets[stop]]
+        return self.vehicle_df.iloc[start:stop], self.test_df.iloc[test_rows]
+
+    def blocks(self):
+        return [(self.vehicle_df, self.test_df)]
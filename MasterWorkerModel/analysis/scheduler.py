@@ -0,0 +1,195 @@
+from collections import deque
+
+
+class TaskScheduler:
+    """
+    Hands out small row-range tasks to workers on demand.
+
+    The rows to scan are first split into one contiguous home range per worker. A worker asking for
+    work gets the next task cut from the front of its own range; once its range is exhausted it
+    steals the back half of the largest range still owned by another worker. Task sizes adapt to
+    each worker's observed throughput so that every task takes roughly `target_task_seconds`.
+    """
+
+    def __init__(self, workers, ranges, min_task_rows=256, max_task_rows=50000, target_task_seconds=0.25,
+                 granularity=1, domains=None, cross_domain=True):
+        """
+        Args:
+            workers (list): The ranks of the workers taking part in the query.
+            ranges (list or dict): (start, stop) row ranges that have to be scanned, or a dict of such
+                lists keyed by domain when workers should start on the rows local to them.
+            min_task_rows (int): Smallest task handed out, in rows.
+            max_task_rows (int): Largest task handed out, in rows.
+            target_task_seconds (float): Wall time each task should take on its worker.
+            granularity (int): Task boundaries are kept on multiples of this many rows.
+            domains (dict, optional): Worker rank to domain (e.g. node id). Idle workers steal from
+                their own domain before stealing across domains.
+            cross_domain (bool): Whether rows of one domain may run on workers of another at all.
+                When False, workers only ever get rows of their own domain.
+        """
+        if not workers:
+            raise ValueError("TaskScheduler needs at least one worker.")
+
+        self.workers = list(workers)
+        self.domains = domains or {worker: 0 for worker in self.workers}
+        self.granularity = max(1, granularity)
+        self.min_task_rows = max(self.granularity, min_task_rows)
+        self.max_task_rows = max(self.min_task_rows, max_task_rows)
+        self.target_task_seconds = target_task_seconds
+        self.cross_domain = cross_domain
+
+        self.queues = {worker: deque() for worker in self.workers}
+        self.retry = deque()  # ranges handed back after a worker failed, served before anything else
+        self.throughput = {}  # rows per second, smoothed per worker
+        self.steals = 0
+        self.tasks_issued = 0
+
+        if not isinstance(ranges, dict):
+            ranges = {0: ranges}
+            self.domains = {worker: 0 for worker in self.workers}
+        ranges = {domain: [(start, stop) for start, stop in domain_ranges if stop > start]
+                  for domain, domain_ranges in ranges.items()}
+        self.total_rows = sum(stop - start for domain_ranges in ranges.values() for start, stop in domain_ranges)
+        self.domain_ranges = ranges
+
+        # Initial task size: aim for several tasks per worker until throughput is known
+        initial = self.total_rows // (len(self.workers) * 8) if self.total_rows else self.min_task_rows
+        self.initial_task_rows = self._clip(initial)
+
+        for domain, domain_ranges in ranges.items():
+            # Rows in a domain without workers are shared out among everybody
+            domain_workers = [w for w in self.workers if self.domains.get(w) == domain] or self.workers
+            self._assign_home_ranges(domain_workers, domain_ranges)
+
+    def _clip(self, rows):
+        rows = int(min(max(rows, self.min_task_rows), self.max_task_rows))
+        return max(self.granularity, rows - rows % self.granularity)
+
+    def _align(self, row, start, stop):
+        """Rounds a split point down to the task granularity, staying strictly inside (start, stop)."""
+        row -= row % self.granularity
+        return row if start < row < stop else None
+
+    def _assign_home_ranges(self, workers, ranges):
+        """Splits the ranges into one contiguous share of roughly equal size per worker."""
+        count = len(workers)
+        total_rows = sum(stop - start for start, stop in ranges)
+        targets = [total_rows * (k + 1) // count for k in range(count)]
+        worker_index = 0
+        covered = 0
+        for start, stop in ranges:
+            while start < stop:
+                split = stop
+                if worker_index < count - 1:
+                    wanted = start + targets[worker_index] - covered
+                    if wanted < stop:
+                        split = self._align(wanted, start, stop) or stop
+                self.queues[workers[worker_index]].append((start, split))
+                covered += split - start
+                if split < stop or covered >= targets[worker_index]:
+                    worker_index = min(worker_index + 1, count - 1)
+                start = split
+
+    def task_rows_for(self, worker):
+        """Returns the number of rows the next task for this worker should contain."""
+        rate = self.throughput.get(worker)
+        if rate is None:
+            return self.initial_task_rows
+        return self._clip(rate * self.target_task_seconds)
+
+    def remaining_rows(self):
+        rows = sum(stop - start for queue in self.queues.values() for start, stop in queue)
+        return rows + sum(stop - start for start, stop in self.retry)
+
+    def has_work(self):
+        return bool(self.retry) or any(self.queues.values())
+
+    def requeue(self, task_range):
+        """Hands a range back to the scheduler so that the next worker asking for work runs it again."""
+        self.retry.append(task_range)
+
+    def remove_worker(self, worker):
+        """Drops a failed worker; its untouched share is moved to the retry queue."""
+        self.retry.extend(self.queues.pop(worker, ()))
+        self.throughput.pop(worker, None)
+        if worker in self.workers:
+            self.workers.remove(worker)
+
+    def _steal(self, thief):
+        """Moves the back half of the largest range owned by another worker into the thief's queue."""
+        victim = None
+        victim_key = (False, 0)
+        for worker, queue in self.queues.items():
+            if worker == thief or not queue:
+                continue
+            if not self.cross_domain and self.domains.get(worker) != self.domains.get(thief):
+                continue
+            # Prefer victims in the thief's own domain, then the largest remaining share
+            key = (self.domains.get(worker) == self.domains.get(thief), sum(stop - start for start, stop in queue))
+            if key > victim_key:
+                victim, victim_key = worker, key
+        if victim is None:
+            return False
+
+        victim_queue = self.queues[victim]
+        if len(victim_queue) > 1:
+            # Take whole ranges from the back first
+            self.queues[thief].append(victim_queue.pop())
+        else:
+            start, stop = victim_queue[0]
+            split = self._align(start + (stop - start) // 2, start, stop)
+            if split is None:
+                self.queues[thief].append(victim_queue.pop())
+            else:
+                victim_queue[0] = (start, split)
+                self.queues[thief].append((split, stop))
+
+        self.steals += 1
+        return True
+
+    def next_task(self, worker, avoid=()):
+        """
+        Cuts the next task for a worker.
+
+        Args:
+            worker (int): The rank asking for work.
+            avoid (collection): Requeued ranges this worker must not be given again.
+
+        Returns:
+            tuple: A (start, stop) row range, or None when no work is left anywhere.
+        """
+        for task_range in self.retry:
+            if task_range not in avoid and self.reachable(worker, task_range):
+                self.retry.remove(task_range)
+                self.tasks_issued += 1
+                return task_range
+
+        queue = self.queues[worker]
+        if not queue and not self._steal(worker):
+            return None
+
+        start, stop = queue[0]
+        split = self._align(start + self.task_rows_for(worker), start, stop) or stop
+        if split >= stop:
+            queue.popleft()
+        else:
+            queue[0] = (split, stop)
+
+        self.tasks_issued += 1
+        return start, split
+
+    def reachable(self, worker, task_range):
+        """Whether a range may run on a worker: always, unless rows are bound to their domain."""
+        if self.cross_domain:
+            return True
+        start, stop = task_range
+        return any(domain_start <= start and stop <= domain_stop
+                   for domain_start, domain_stop in self.domain_ranges.get(self.domains.get(worker), ()))
+
+    def record(self, worker, rows, seconds):
+        """Feeds an observed task duration back into the worker's throughput estimate."""
+        if rows <= 0 or seconds <= 0:
+            return
+        rate = rows / seconds
+        previous = self.throughput.get(worker)
+        self.throughput[worker] = rate if previous is None else 0.5 * previous + 0.5 * rate
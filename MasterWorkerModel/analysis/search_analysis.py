@@ -1,15 +1,93 @@
-import pickle
+import threading
+import time
+from collections import deque
 
+import numpy as np
 import pandas as pd
-from mpi4py import MPI
+
+try:
+    from mpi4py import MPI
+except ImportError:  # The shared-memory backend runs without MPI
+    MPI = None
+
+from analysis.aggregates import RegionalCounters, RegionalPassRates, combine, create_aggregate, finalize, summarize
+from analysis.export import clear_export, part_name, split_exports, write_manifest, write_part
+from analysis.lookup import FrameSource, IdIndex, history, lookup_key
+from analysis.query_stats import QueryStats
+from analysis.transport import codec
+from analysis.scheduler import TaskScheduler
+from data.modules.column_store import categoricals_to_objects
+from data.modules.data_frames import DataFrameCreator
+from data.modules.date_index import DateIndex, date_mask, date_values
+from data.modules.zone_maps import ZoneMap, search_conditions
+from tracing import tracer
+
+# Message tags used between the master and the workers
+TASK_TAG = 1
+RESULT_TAG = 6
+TERMINATE_TAG = 7
+HEARTBEAT_TAG = 8
+# Keys of a task sent in the clear next to its encoded message, so that a worker can answer for
+# a task it failed to decode
+TASK_TAG_KEYS = ('query_id', 'task_id', 'start', 'stop')
+
+
+# Columns of every search result, in display order
+RESULT_COLUMNS = ['test_id', 'vehicle_id', 'test_date', 'test_class_id', 'test_type',
+                  'test_result', 'test_mileage', 'postcode_area', 'make', 'model',
+                  'colour', 'fuel_type', 'cylinder_capacity', 'first_use_date']
+
+
+def test_date_bounds(min_test_date=None, max_test_date=None):
+    """
+    The Timestamps [start, stop) a test-date search keeps tests in, None for an open end.
+
+    Dates are 'YYYY-MM-DD' strings; max_test_date is inclusive, so stop is the day after it.
+    """
+    start = pd.Timestamp(min_test_date) if min_test_date else None
+    stop = pd.Timestamp(max_test_date) + pd.Timedelta(days=1) if max_test_date else None
+    return start, stop
+
+
+class QueryError(Exception):
+    """Raised on the master when a query cannot be completed by the workers."""
 
 
 class SearchAnalyzer:
-    def __init__(self, comm, rank, size):
+    def __init__(self, comm, rank, size, backend=None, partition=None):
         self.comm = comm
         self.rank = rank
         self.size = size
-        self.num_blocks = self.size * 4  # You can adjust the number of blocks
+        self.backend = backend  # None for MPI, else a local execution backend such as SharedMemoryBackend
+        self.partition = partition  # NodeSharedFrames or MappedColumnStore when workers read rows themselves
+        # Task sizing for the dynamic scheduler
+        self.min_task_rows = 256
+        self.max_task_rows = 50000
+        self.target_task_seconds = 0.25
+        self.query_id = 0
+        # Fault handling
+        self.heartbeat_interval = 1.0
+        self.heartbeat_timeout = 30.0
+        self.query_timeout = 600.0
+        self.poll_interval = 0.001
+        self.max_task_attempts = 3
+        self.max_worker_errors = 3
+        self.straggler_factor = 4.0
+        self.straggler_min_seconds = 2.0
+        self.failed_workers = set()
+        self.worker_errors = {}
+        self.speculative_tasks = 0
+        self.pending_sends = []
+        self._prepared = None
+        self._prepared_source = None
+        self._prepared_zone_map = None
+        # Indexes built and reused by the last combined_search_batch, reported in QueryStats
+        self.index_counters = {'indexes_built': 0, 'index_lookups': 0}
+        # (source, IdIndex, Bloom filters by rank): the master's own index or the workers' filters,
+        # a worker's own index; built by the first lookup
+        self._lookup = None
+        # (vehicle_df, test_df, RegionalCounters) of the rows counted by the first regional search
+        self._regional = None
 
     def search_by_make(self, df, make):
         """Searches for vehicles of a specific make."""
@@ -27,8 +105,20 @@ class SearchAnalyzer:
         """Searches for tests within a specific mileage range."""
         return df[(df['test_mileage'] >= min_mileage) & (df['test_mileage'] <= max_mileage)]
 
+    def search_by_test_date(self, df, min_test_date=None, max_test_date=None, date_index=None):
+        """
+        Searches for tests taken between two dates, both included; a missing date leaves that end open.
+
+        With the partition's date_index over df's rows they are found by binary search instead of
+        comparing every row.
+        """
+        start, stop = test_date_bounds(min_test_date, max_test_date)
+        if date_index is None:
+            return df[date_mask(df['test_date'], start, stop)]
+        return df[date_index.mask(start, stop, df['test_date'])]
+
     def combined_search(self, local_vehicle_df, local_test_df, make=None, model=None, year=None, min_mileage=None,
-                        max_mileage=None):
+                        max_mileage=None, min_test_date=None, max_test_date=None, date_index=None):
         """
         Performs a combined search based on multiple criteria.
 
@@ -40,9 +130,13 @@ class SearchAnalyzer:
             year (int, optional): The year of first use to search for.
             min_mileage (int, optional): The minimum mileage.
             max_mileage (int, optional): The maximum mileage.
+            min_test_date (str, optional): The first test date, as YYYY-MM-DD.
+            max_test_date (str, optional): The last test date, as YYYY-MM-DD.
+            date_index (DateIndex, optional): The partition's date index over the local tests.
 
         Returns:
-            pd.DataFrame: A DataFrame containing the matching results.
+            pd.DataFrame: A DataFrame containing the matching results. With a test date range only
+            the tests taken in it are returned.
         """
 
         print(f"Rank {self.rank}: Entering combined_search")
@@ -66,52 +160,209 @@ class SearchAnalyzer:
             # Filter vehicles based on the vehicle_ids from the filtered tests
             filtered_vehicles = filtered_vehicles[filtered_vehicles['vehicle_id'].isin(filtered_vehicle_ids)]
 
+        # A test date range keeps only the tests taken in it
+        matching_tests = local_test_df
+        if min_test_date or max_test_date:
+            matching_tests = self.search_by_test_date(local_test_df, min_test_date, max_test_date, date_index)
+
         # Merge to get all details
-        if not filtered_vehicles.empty and not local_test_df.empty:
-            merged_df = pd.merge(filtered_vehicles, local_test_df, on='vehicle_id')
+        if not filtered_vehicles.empty and not matching_tests.empty:
+            merged_df = pd.merge(filtered_vehicles, matching_tests, on='vehicle_id')
         else:
             # Create an empty DataFrame with the desired columns if one of them is empty
-            merged_df = pd.DataFrame(columns=['test_id', 'vehicle_id', 'test_date', 'test_class_id', 'test_type',
-                                              'test_result', 'test_mileage', 'postcode_area', 'make', 'model',
-                                              'colour', 'fuel_type', 'cylinder_capacity', 'first_use_date'])
+            merged_df = pd.DataFrame(columns=RESULT_COLUMNS)
 
         # Select and reorder columns to match the desired output
-        columns_to_display = ['test_id', 'vehicle_id', 'test_date', 'test_class_id', 'test_type',
-                              'test_result', 'test_mileage', 'postcode_area', 'make', 'model',
-                              'colour', 'fuel_type', 'cylinder_capacity', 'first_use_date']
-
         # More robust column selection
-        merged_df = merged_df.reindex(columns=columns_to_display, fill_value=None)
+        merged_df = merged_df.reindex(columns=RESULT_COLUMNS, fill_value=None)
 
         print(f"Rank {self.rank}: Exiting combined_search")
         return merged_df
 
-    def master_process(self, vehicle_df, test_df, search_criteria):
-        """Handles the master process logic with Block-Cyclic and Dynamic Mapping."""
-        print("Master: Entering master_process for combined search")
+    def combined_search_batch(self, local_vehicle_df, local_test_df, search_kwargs_batch, date_index=None):
+        """
+        Answers several combined searches in a single scan over the local vehicles and tests.
 
-        # 1. Block-Cyclic Decomposition
-        vehicle_chunks = [pd.DataFrame() for _ in range(self.size)]
-        test_chunks = [pd.DataFrame() for _ in range(self.size)]
+        Everything the searches filter on is prepared once for the whole batch: vehicle positions
+        grouped by make and by model, the first-use year, the tests sorted by mileage and by test
+        date, and the tests grouped by vehicle. A test date range is a binary search per run of the
+        partition's date_index, which is sorted once at load time; frames from elsewhere are sorted
+        by date here. Each search then picks its vehicles from those indexes and gathers their
+        tests from the per-vehicle runs instead of filtering and merging the frames again, so extra
+        searches cost little more than the size of their results.
 
-        vehicle_block_size = len(vehicle_df) // self.num_blocks
-        test_block_size = len(test_df) // self.num_blocks
+        Args:
+            local_vehicle_df (pd.DataFrame): The local vehicle DataFrame.
+            local_test_df (pd.DataFrame): The local test DataFrame.
+            search_kwargs_batch (list): combined_search keyword arguments, one dict per search.
+            date_index (DateIndex, optional): The partition's date index over the local tests.
 
-        for i in range(self.num_blocks):
-            vehicle_start = i * vehicle_block_size
-            vehicle_end = (i + 1) * vehicle_block_size
-            test_start = i * test_block_size
-            test_end = (i + 1) * test_block_size
+        Returns:
+            list: For each search, the DataFrame combined_search would return for it.
+        """
+        self.index_counters = {'indexes_built': 0, 'index_lookups': 0}
+        if len(search_kwargs_batch) < 2 or local_vehicle_df.empty or local_test_df.empty:
+            return [self.combined_search(local_vehicle_df, local_test_df, date_index=date_index, **search_kwargs)
+                    for search_kwargs in search_kwargs_batch]
 
-            process_id = i % self.size
+        print(f"Rank {self.rank}: Entering combined_search_batch with {len(search_kwargs_batch)} searches")
+        num_vehicles = len(local_vehicle_df)
 
-            vehicle_chunks[process_id] = pd.concat([vehicle_chunks[process_id], vehicle_df[vehicle_start:vehicle_end]])
-            test_chunks[process_id] = pd.concat([test_chunks[process_id], test_df[test_start:test_end]])
+        # vehicle_id codes shared by both frames; missing ids match each other, as in pd.merge
+        codes, uniques = pd.factorize(pd.concat([local_vehicle_df['vehicle_id'], local_test_df['vehicle_id']],
+                                                ignore_index=True), use_na_sentinel=False)
+        vehicle_codes, test_codes = codes[:num_vehicles], codes[num_vehicles:]
+        # Tests grouped by vehicle, keeping their order within each vehicle
+        tests_by_vehicle = np.argsort(test_codes, kind='stable')
+        test_counts = np.bincount(test_codes, minlength=len(uniques))
+        test_starts = np.concatenate(([0], np.cumsum(test_counts)[:-1]))
 
-        print("Master: Block-Cyclic Decomposition complete")
+        make_groups = model_groups = years = None
+        mileage_order = sorted_mileage = None
 
-        # 2. Create a single list of search criteria (not sub-queries)
-        print("Master: Creating search criteria list")
+        results = []
+        for search_kwargs in search_kwargs_batch:
+            make, model, year = search_kwargs.get('make'), search_kwargs.get('model'), search_kwargs.get('year')
+            min_mileage, max_mileage = search_kwargs.get('min_mileage'), search_kwargs.get('max_mileage')
+            min_test_date, max_test_date = search_kwargs.get('min_test_date'), search_kwargs.get('max_test_date')
+            selected = None  # Sorted vehicle positions; None while every vehicle still matches
+            test_mask = None  # Test rows in the test date range; None without one
+
+            if make:
+                if make_groups is None:
+                    make_groups = local_vehicle_df.groupby('make', observed=True, sort=False).indices
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                selected = self._select(selected, make_groups.get(make.upper()))
+            if model:
+                if model_groups is None:
+                    model_groups = local_vehicle_df.groupby('model', observed=True, sort=False).indices
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                selected = self._select(selected, model_groups.get(model.upper()))
+            if year:
+                if years is None:
+                    years = pd.to_datetime(local_vehicle_df['first_use_date']).dt.year.to_numpy()
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                selected = np.flatnonzero(years == year) if selected is None else selected[years[selected] == year]
+            if min_mileage is not None and max_mileage is not None:
+                if mileage_order is None:
+                    mileage = pd.to_numeric(local_test_df['test_mileage'], errors='coerce').to_numpy(dtype=float)
+                    mileage_order = np.argsort(mileage, kind='stable')  # NaN sorts last and never matches
+                    sorted_mileage = mileage[mileage_order][:np.count_nonzero(~np.isnan(mileage))]
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                low = np.searchsorted(sorted_mileage, min_mileage, side='left')
+                high = np.searchsorted(sorted_mileage, max_mileage, side='right')
+                tested = np.zeros(len(uniques), dtype=bool)
+                tested[test_codes[mileage_order[low:high]]] = True
+                selected = np.flatnonzero(tested[vehicle_codes]) if selected is None \
+                    else selected[tested[vehicle_codes[selected]]]
+            if min_test_date or max_test_date:
+                if date_index is None:
+                    date_index = DateIndex.build(date_values(local_test_df['test_date']))
+                    self.index_counters['indexes_built'] += 1
+                self.index_counters['index_lookups'] += 1
+                start, stop = test_date_bounds(min_test_date, max_test_date)
+                test_mask = date_index.mask(start, stop, local_test_df['test_date'])
+                dated = np.zeros(len(uniques), dtype=bool)
+                dated[test_codes[test_mask]] = True
+                selected = np.flatnonzero(dated[vehicle_codes]) if selected is None \
+                    else selected[dated[vehicle_codes[selected]]]
+
+            if selected is None:
+                selected = np.arange(num_vehicles)
+            results.append(self._gather_matches(local_vehicle_df, local_test_df, selected, vehicle_codes,
+                                                tests_by_vehicle, test_counts, test_starts, test_mask))
+
+        print(f"Rank {self.rank}: Exiting combined_search_batch")
+        return results
+
+    @staticmethod
+    def _select(selected, positions):
+        """Narrows a sorted array of vehicle positions (None meaning all) to those in positions."""
+        if positions is None:
+            return np.empty(0, dtype=np.intp)
+        if selected is None:
+            return positions
+        return np.intersect1d(selected, positions, assume_unique=True)
+
+    @staticmethod
+    def _gather_matches(vehicle_df, test_df, selected, vehicle_codes, tests_by_vehicle, test_counts, test_starts,
+                        test_mask=None):
+        """
+        Pairs the selected vehicles with all of their tests (only those in test_mask when given), in
+        the row order pd.merge produces: vehicles in their own order, and each vehicle's tests in theirs.
+        """
+        if len(selected) == 0:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        selected_codes = vehicle_codes[selected]
+        counts = test_counts[selected_codes]
+        total = int(counts.sum())
+        vehicle_take = np.repeat(selected, counts)
+        run_offsets = np.repeat(test_starts[selected_codes] - (np.cumsum(counts) - counts), counts)
+        test_take = tests_by_vehicle[run_offsets + np.arange(total)]
+        if test_mask is not None:
+            keep = test_mask[test_take]
+            vehicle_take, test_take = vehicle_take[keep], test_take[keep]
+
+        data = {}
+        for column in RESULT_COLUMNS:
+            if column == 'vehicle_id' or (column in vehicle_df.columns and column not in test_df.columns):
+                data[column] = vehicle_df[column].array.take(vehicle_take)
+            elif column in test_df.columns and column not in vehicle_df.columns:
+                data[column] = test_df[column].array.take(test_take)
+        return pd.DataFrame(data).reindex(columns=RESULT_COLUMNS, fill_value=None)
+
+
+    def scan_blocks(self, blocks, search_kwargs_batch, aggregates=None):
+        """
+        Runs a batch of searches over (vehicle_df, test_df, date_index) blocks one after another.
+
+        Each search's matches are joined in block order, or for an aggregated search (aggregates
+        holds an Aggregate or None per search) turned into a partial per block and merged.
+        index_counters sums the counters of all blocks. Out of core only one block of the column
+        store is decoded at a time.
+
+        Returns:
+            tuple: (results or partials per search, vehicles scanned, tests scanned, rows matched)
+        """
+        aggregates = aggregates or [None] * len(search_kwargs_batch)
+        block_results = [[] for _ in search_kwargs_batch]
+        counters = {'indexes_built': 0, 'index_lookups': 0}
+        vehicles_scanned = tests_scanned = rows_matched = num_blocks = 0
+        for local_vehicle_df, local_test_df, date_index in blocks:
+            with tracer.span("scan block", "compute", rows=len(local_vehicle_df)):
+                results = [categoricals_to_objects(search_results) for search_results in
+                           self.combined_search_batch(local_vehicle_df, local_test_df, search_kwargs_batch,
+                                                      date_index)]
+            rows_matched += sum(len(search_results) for search_results in results)
+            for index, search_results in enumerate(summarize(results, aggregates)):
+                block_results[index].append(search_results)
+            for name, count in self.index_counters.items():
+                counters[name] += count
+            vehicles_scanned += len(local_vehicle_df)
+            tests_scanned += len(local_test_df)
+            num_blocks += 1
+        if num_blocks > 1:
+            counters['blocks_scanned'] = num_blocks
+        self.index_counters = counters
+        local_results = [parts[0] if len(parts) == 1 and aggregate is None else combine(parts, aggregate)
+                         for parts, aggregate in zip(block_results, aggregates)]
+        return local_results, vehicles_scanned, tests_scanned, rows_matched
+
+    def partition_blocks(self, ranges):
+        """
+        The partition's blocks over vehicle row ranges as scan_blocks takes them: a block per range,
+        or per block_rows vehicles out of core, each with the date index of its tests.
+        """
+        for range_start, range_stop in ranges:
+            for start, stop in self.partition.block_ranges(range_start, range_stop):
+                yield (*self.partition.frames(start, stop), self.partition.date_index(start, stop))
+
+    def build_search_criteria_list(self, search_criteria):
+        """Turns the GUI's search_criteria dict into the list of criteria shipped to the workers."""
         search_criteria_list = []
         if search_criteria.get('make'):
             search_criteria_list.append({'type': 'make', 'value': search_criteria['make']})
@@ -122,126 +373,855 @@ class SearchAnalyzer:
         if search_criteria.get('min_mileage') is not None and search_criteria.get('max_mileage') is not None:
             search_criteria_list.append({'type': 'mileage', 'min_value': search_criteria['min_mileage'],
                                          'max_value': search_criteria['max_mileage']})
-        print(f"Master: Created search criteria list with {len(search_criteria_list)} criteria")
-
-        # 3. Dynamic Task Assignment
-        print("Master: Assigning tasks to workers")
-        tasks = []
-        for i in range(1, self.size):
-            tasks.append({
-                'vehicle_chunk': vehicle_chunks[i - 1],
-                'test_chunk': test_chunks[i - 1],
-                'search_criteria_list': search_criteria_list  # Send the entire list
-            })
-
-        print(f"Master: Created {len(tasks)} tasks")
-
-        available_workers = list(range(1, self.size))
-        task_counter = 0
-        results = []
+        if search_criteria.get('min_test_date') or search_criteria.get('max_test_date'):
+            search_criteria_list.append({'type': 'test_date', 'min_value': search_criteria.get('min_test_date'),
+                                         'max_value': search_criteria.get('max_test_date')})
+        return search_criteria_list
 
-        while True:
-            # Send tasks to available workers
-            while available_workers and task_counter < len(tasks):
-                worker_id = available_workers.pop(0)
-                task = tasks[task_counter]
-
-                # Serialize DataFrames using pickle to bytes
-                vehicle_bytes = pickle.dumps(task['vehicle_chunk'])
-                test_bytes = pickle.dumps(task['test_chunk'])
-                search_criteria_bytes = pickle.dumps(task['search_criteria_list'])  # Serialize the list
-
-                # Send data size first, then data
-                self.comm.send(len(vehicle_bytes), dest=worker_id, tag=0)  # Vehicle size
-                self.comm.send(vehicle_bytes, dest=worker_id, tag=1)  # Vehicle data
-                self.comm.send(len(test_bytes), dest=worker_id, tag=2)  # Test size
-                self.comm.send(test_bytes, dest=worker_id, tag=3)  # Test data
-                self.comm.send(len(search_criteria_bytes), dest=worker_id, tag=4)  # Search criteria size
-                self.comm.send(search_criteria_bytes, dest=worker_id, tag=5)  # Search criteria
-
-                task_counter += 1
-
-            if task_counter >= len(tasks) and len(results) == len(tasks):
-                print("Master: All tasks sent and results received. Breaking loop.")
-                break
+    def criteria_list_to_kwargs(self, search_criteria_list):
+        """Turns a shipped criteria list back into combined_search keyword arguments."""
+        search_kwargs = {}
+        for criteria in search_criteria_list:
+            if criteria['type'] == 'make':
+                search_kwargs['make'] = criteria['value']
+            elif criteria['type'] == 'model':
+                search_kwargs['model'] = criteria['value']
+            elif criteria['type'] == 'year':
+                search_kwargs['year'] = criteria['value']
+            elif criteria['type'] == 'mileage':
+                search_kwargs['min_mileage'] = criteria['min_value']
+                search_kwargs['max_mileage'] = criteria['max_value']
+            elif criteria['type'] == 'test_date':
+                search_kwargs['min_test_date'] = criteria['min_value']
+                search_kwargs['max_test_date'] = criteria['max_value']
+        return search_kwargs
 
-            # Receive results
-            if len(results) < task_counter:
-                print("Master: Waiting for results...")
-                result = self.comm.recv(source=MPI.ANY_SOURCE, tag=6)
-                results.append(result)
-                print(f"Master: Received result from worker {result[1]}")
+    def prepare_frames(self, vehicle_df, test_df):
+        """
+        Aligns the master's DataFrames by vehicle_id once and caches the result, so that every
+        task can be cut as a vehicle row range with its matching test rows. The ZoneMap of the
+        aligned rows is built along with it.
+        """
+        if not self.frames_prepared(vehicle_df, test_df):
+            print("Master: Aligning vehicle and test DataFrames by vehicle_id")
+            with tracer.span("align frames", "partition", rows=len(vehicle_df)):
+                self._prepared = DataFrameCreator().align_by_vehicle(vehicle_df, test_df)
+                self._prepared_zone_map = ZoneMap.build(*self._prepared)
+            self._prepared_source = (vehicle_df, test_df)
+        return self._prepared
+
+    def aligned_frames(self, vehicle_df, test_df, stats):
+        """prepare_frames, counting once per query whether the aligned copy was there already."""
+        if 'aligned_frames_hit' not in stats.cache and 'aligned_frames_miss' not in stats.cache:
+            hit = self.frames_prepared(vehicle_df, test_df)
+            stats.count('aligned_frames_hit' if hit else 'aligned_frames_miss')
+        return self.prepare_frames(vehicle_df, test_df)
+
+    def zone_map(self, vehicle_df, test_df, stats):
+        """The ZoneMap of the rows tasks are cut from: the partition's, else that of the aligned frames."""
+        if self.partition is not None:
+            return self.partition.zone_map
+        self.aligned_frames(vehicle_df, test_df, stats)
+        return self._prepared_zone_map
+
+    def frames_prepared(self, vehicle_df, test_df):
+        """Whether prepare_frames already holds the aligned copy of these DataFrames."""
+        return self._prepared_source is not None and self._prepared_source[0] is vehicle_df \
+            and self._prepared_source[1] is test_df
+
+    def send_task(self, worker_id, task, counters=None):
+        """
+        Serializes a task and sends it to a worker in a single non-blocking message.
+
+        A blocking send could deadlock against a busy worker that is itself blocked sending a large
+        result back, so the request is kept until the worker has picked the task up. The message
+        is compressed when the codec expects that to pay off; counters gets what it saved. The
+        task's TASK_TAG_KEYS travel along unencoded.
+
+        Returns:
+            int: The size of the message in bytes.
+        """
+        self.pending_sends = [request for request in self.pending_sends if not request.Test()]
+        with tracer.span("serialize task", "serialize", worker=worker_id):
+            message = codec.dumps(task, counters)
+        with tracer.span("send task", "comm", worker=worker_id, bytes=len(message)):
+            tag = {key: task[key] for key in TASK_TAG_KEYS}
+            self.pending_sends.append(self.comm.isend((tag, message), dest=worker_id, tag=TASK_TAG))
+        return len(message)
+
+    def search(self, vehicle_df, test_df, search_criteria):
+        """
+        Runs a search on whichever execution backend the application was started with.
+
+        Args:
+            vehicle_df (pd.DataFrame): The vehicle DataFrame held by the master.
+            test_df (pd.DataFrame): The test DataFrame held by the master.
+            search_criteria (dict): The search_criteria dict built by MainWindow.search.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        return self.search_batch(vehicle_df, test_df, [search_criteria])[0]
 
-                worker_id = result[1]
-                available_workers.append(worker_id)
+    def search_batch(self, vehicle_df, test_df, search_criteria_batch):
+        """
+        Runs several searches in one pass over the workers.
+
+        With MPI every task carries all of the searches, so the batch costs one round of tasks
+        instead of one per search. A search whose criteria name an 'aggregate' (see
+        analysis.aggregates) returns the aggregate's DataFrame instead of its matching rows; workers
+        send back only the aggregate's partials.
+
+        Args:
+            vehicle_df (pd.DataFrame): The vehicle DataFrame held by the master.
+            test_df (pd.DataFrame): The test DataFrame held by the master.
+            search_criteria_batch (list): search_criteria dicts as built by MainWindow.search.
 
-        # 4. Aggregate Results
-        print("Master: Aggregating results")
-        received_results = []
-        for r in results:
-            received_results.append(r[0])
+        Returns:
+            list: The matching rows of each search, in the same order.
+        """
+        return self.search_batch_with_stats(vehicle_df, test_df, search_criteria_batch)[0]
 
-        combined_results = pd.concat(received_results)
+    def search_with_stats(self, vehicle_df, test_df, search_criteria):
+        """
+        Runs a search like search() and also returns what it cost.
+
+        Returns:
+            tuple: (pd.DataFrame of matching rows, QueryStats)
+        """
+        results, stats = self.search_batch_with_stats(vehicle_df, test_df, [search_criteria])
+        return results[0], stats
+
+    def search_batch_with_stats(self, vehicle_df, test_df, search_criteria_batch):
+        """
+        Runs several searches like search_batch and also returns what the query cost: rows scanned
+        and matched per worker, bytes shipped each way, wall time per phase and cache/index hits.
+
+        Returns:
+            tuple: (list of matching rows per search, QueryStats)
+        """
+        stats = QueryStats(len(search_criteria_batch))
+        try:
+            with tracer.span("query", "query", searches=len(search_criteria_batch)):
+                lookups = [lookup_key(search_criteria) for search_criteria in search_criteria_batch]
+                if any(lookups):
+                    results = self.lookup_batch(vehicle_df, test_df, search_criteria_batch, lookups, stats)
+                elif self.backend is None:
+                    results = self.master_process_batch(vehicle_df, test_df, search_criteria_batch, stats)
+                else:
+                    results = self.backend_search_batch(vehicle_df, test_df, search_criteria_batch, stats)
+        finally:
+            # Rank 0 rewrites the trace with the spans the workers sent back during the query
+            tracer.flush()
+        return results, stats.finish(results)
+
+    def backend_search_batch(self, vehicle_df, test_df, search_criteria_batch, stats):
+        """Runs a batch of searches on the local execution backend; rank 0 writes any exports itself."""
+        aggregates = [create_aggregate(search_criteria.get('aggregate')) for search_criteria in search_criteria_batch]
+        _, exports = split_exports(search_criteria_batch)
+        for export in filter(None, exports):
+            clear_export(export)
+        if vehicle_df is None or vehicle_df.empty or test_df is None or test_df.empty:
+            results = summarize([self.combined_search(pd.DataFrame(), pd.DataFrame())
+                                 for _ in search_criteria_batch], aggregates)
+        else:
+            with stats.phase("backend search"):
+                results = self.backend.search_batch(vehicle_df, test_df, [
+                    self.criteria_list_to_kwargs(self.build_search_criteria_list(search_criteria))
+                    for search_criteria in search_criteria_batch], aggregates)
+        return self.finish_exports(search_criteria_batch, exports,
+                                   finalize(self.export_results(results, exports, 0), aggregates))
+
+    def lookup_batch(self, vehicle_df, test_df, search_criteria_batch, lookups, stats):
+        """
+        Answers the lookups of a batch from the id indexes; its other searches run as usual.
+
+        Each worker indexes the rows it reads itself and shows the master the Bloom filters of its
+        ids. A lookup then goes only to the workers whose filters may hold the id, in one task per
+        worker carrying all of its lookups of the batch; a false positive costs one empty answer.
+        Where the master holds all rows itself it answers from its own index without any messages.
+        """
+        results = [None] * len(search_criteria_batch)
+        searches = [position for position, key in enumerate(lookups) if key is None]
+        if searches:
+            search_criteria_searches = [search_criteria_batch[position] for position in searches]
+            if self.backend is None:
+                search_results = self.master_process_batch(vehicle_df, test_df, search_criteria_searches, stats)
+            else:
+                search_results = self.backend_search_batch(vehicle_df, test_df, search_criteria_searches, stats)
+            for position, rows in zip(searches, search_results):
+                results[position] = rows
+
+        with tracer.span("lookup", "query", lookups=len(lookups) - len(searches)), stats.phase("lookup"):
+            source, index, filters = self.lookup_directory(vehicle_df, test_df, stats)
+            candidates = {}
+            tasks = {}  # rank -> {position: (field, id)}
+            for position, key in enumerate(lookups):
+                if key is not None:
+                    candidates[position] = [rank for rank, rank_filters in filters.items()
+                                            if key[1] in rank_filters[key[0]]]
+                    for rank in candidates[position]:
+                        tasks.setdefault(rank, {})[position] = key
+
+            answers = {0: {position: history(source, index, *key, RESULT_COLUMNS)
+                           for position, key in tasks.pop(0, {}).items()}}
+            if tasks:
+                self.query_id += 1
+                for worker_id, worker_lookups in tasks.items():
+                    task = {'query_id': self.query_id, 'task_id': 0, 'start': 0, 'stop': 0, 'lookups': worker_lookups}
+                    counters = stats.worker(worker_id)
+                    counters['bytes_sent'] += self.send_task(worker_id, task, counters)
+                for worker_id, reply in self.collect_replies(set(tasks), stats).items():
+                    answers[worker_id] = reply['lookups']
+            for rank, rank_answers in answers.items():
+                if rank_answers:
+                    counters = stats.worker(rank)
+                    counters['tasks'] += 1
+                    counters['rows_matched'] += sum(len(rows) for rows in rank_answers.values())
+
+            for position, ranks in candidates.items():
+                found = [answers[rank][position] for rank in ranks if not answers[rank][position].empty]
+                results[position] = found[0] if found else self.combined_search(pd.DataFrame(), pd.DataFrame())
+                stats.count('lookups')
+                stats.count('lookup_ranks_contacted', len(ranks))
+                stats.count('bloom_false_positives', len(ranks) - len(found))
+        return results
+
+    def lookup_directory(self, vehicle_df, test_df, stats):
+        """
+        The id index of the master and the Bloom filters of every rank that holds rows, built on
+        first use.
+
+        The master indexes the frames it holds, or the whole partition in a single process run;
+        otherwise every worker indexes its own share of the partition (rank_range) and sends back
+        only the Bloom filters of its ids.
+
+        Returns:
+            tuple: (source of the master's rows, its IdIndex, {rank: Bloom filters})
+        """
+        if self._lookup is not None:
+            return self._lookup
+        if vehicle_df is not None and not vehicle_df.empty or self.partition is None or self.size == 1:
+            with tracer.span("build lookup index", "partition"):
+                if vehicle_df is not None and not vehicle_df.empty:
+                    source = FrameSource(vehicle_df, test_df)
+                    index = IdIndex(source.blocks())
+                elif self.partition is not None:
+                    source = self.partition
+                    index = IdIndex(self.partition.blocks(0, self.partition.node_ranges[-1][1]))
+                else:
+                    source = index = None
+            if index is not None:
+                print(f"Master: Lookup index over {len(index)} vehicles")
+            self._lookup = (source, index, {0: index.filters} if index is not None else {})
+            return self._lookup
+
+        workers = list(range(1, self.size))
+        if self.failed_workers:
+            raise QueryError(f"Workers {sorted(self.failed_workers)} have failed, so their rows cannot be "
+                             "indexed for lookups; restart the application.")
+        self.drain_stale_messages()
+        self.query_id += 1
+        for worker_id in workers:
+            task = {'query_id': self.query_id, 'task_id': 0, 'start': 0, 'stop': 0, 'lookup_index': True}
+            counters = stats.worker(worker_id)
+            counters['bytes_sent'] += self.send_task(worker_id, task, counters)
+        replies = self.collect_replies(set(workers), stats)
+        print(f"Master: Lookup index summarised from the Bloom filters of {len(workers)} workers")
+        self._lookup = (None, None, {worker_id: replies[worker_id]['filters'] for worker_id in workers})
+        return self._lookup
+
+    def regional_counters(self, vehicle_df, test_df, stats):
+        """
+        The RegionalCounters of all rows, built on first use and kept for later regional searches.
+
+        The master counts the frames it holds, or the whole partition in a single process run;
+        otherwise every worker counts its own share of the partition (rank_range) and the master
+        merges what they send back, which is far less than the rows themselves.
+
+        Returns:
+            RegionalCounters: None if a worker has failed, in which case the search is scanned.
+        """
+        has_frames = vehicle_df is not None and not vehicle_df.empty
+        if self._regional is not None and self._regional[0] is vehicle_df and self._regional[1] is test_df:
+            return self._regional[2]
+        if has_frames or self.partition is None or self.size == 1:
+            with tracer.span("build regional counters", "partition"), stats.phase("count regions"):
+                if has_frames:
+                    counters = RegionalCounters.build([(vehicle_df, test_df)])
+                else:
+                    counters = RegionalCounters.build(self.partition.blocks(0, self.partition.node_ranges[-1][1]))
+            print(f"Master: Regional counters over {len(counters.counts)} groups")
+            self._regional = (vehicle_df, test_df, counters)
+            return counters
+
+        workers = list(range(1, self.size))
+        if self.failed_workers:
+            return None
+        self.drain_stale_messages()
+        self.query_id += 1
+        with stats.phase("count regions"):
+            for worker_id in workers:
+                task = {'query_id': self.query_id, 'task_id': 0, 'start': 0, 'stop': 0, 'regional_counters': True}
+                counters = stats.worker(worker_id)
+                counters['bytes_sent'] += self.send_task(worker_id, task, counters)
+            replies = self.collect_replies(set(workers), stats)
+            counters = RegionalCounters.merge([replies[worker_id]['counters'] for worker_id in workers])
+        print(f"Master: Regional counters merged from {len(workers)} workers, {len(counters.counts)} groups")
+        self._regional = (vehicle_df, test_df, counters)
+        return counters
+
+    def collect_replies(self, waiting, stats):
+        """
+        Receives the reply of every worker in waiting to a task of the current query, skipping
+        heartbeats and late results of earlier queries.
+
+        Raises:
+            QueryError: If a worker reports an error, or nothing arrives for heartbeat_timeout seconds.
+        """
+        replies = {}
+        status = MPI.Status()
+        deadline = time.perf_counter() + self.heartbeat_timeout
+        while waiting:
+            if not self.comm.iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
+                if time.perf_counter() > deadline:
+                    raise QueryError(f"Workers {sorted(waiting)} did not answer within "
+                                     f"{self.heartbeat_timeout:.0f} seconds.")
+                time.sleep(self.poll_interval)
+                continue
+            worker_id, tag = status.Get_source(), status.Get_tag()
+            with tracer.span("recv result", "comm", worker=worker_id):
+                message = self.comm.recv(source=worker_id, tag=tag)
+            deadline = time.perf_counter() + self.heartbeat_timeout
+            if tag == HEARTBEAT_TAG:
+                continue
+            result = codec.loads(message, stats.worker(worker_id))
+            tracer.collect(result.pop('trace', None))
+            if result['query_id'] != self.query_id:
+                continue  # Late answer to an earlier query
+            stats.worker(worker_id)['bytes_received'] += len(message)
+            if 'error' in result:
+                raise QueryError(f"Worker {worker_id} failed: {result['error']}")
+            replies[worker_id] = result
+            waiting.discard(worker_id)
+        return replies
+
+    def worker_holds(self, worker_id, start, stop):
+        """Whether a worker can read a vehicle row range itself, from its node window or the column store."""
+        if self.partition is None:
+            return False
+        node_start, node_stop = self.partition.node_ranges[self.partition.rank_nodes[worker_id]]
+        return node_start <= start and stop <= node_stop
+
+    def rows_movable(self):
+        """
+        Whether any worker can run any row range, with rows the master ships or a shared mapping.
+
+        Not so for distributed tables, whose shards only their owning worker holds.
+        """
+        return self.partition is None or self.partition.cross_domain
+
+    def master_process(self, vehicle_df, test_df, search_criteria):
+        """Runs a single search on the workers; see master_process_batch."""
+        return self.master_process_batch(vehicle_df, test_df, [search_criteria])[0]
+
+    def master_process_batch(self, vehicle_df, test_df, search_criteria_batch, stats=None):
+        """
+        Handles the master process logic with fine-grained dynamic scheduling.
+
+        The aligned frames are cut into many small vehicle row ranges which are handed out on demand
+        by a TaskScheduler: each worker works through its own share, steals from the largest
+        remaining share once it runs dry, and gets task sizes matched to its measured throughput.
+
+        Workers that stop sending heartbeats are declared failed and their tasks are reassigned,
+        tasks that raise on a worker are retried elsewhere, and stragglers get a speculative copy
+        on an idle worker. If the query cannot complete a QueryError is raised instead of hanging.
+
+        Every task carries all searches of the batch, and the worker answers them with one shared
+        scan of its rows (combined_search_batch). Zones of rows that the ZoneMap rules out for every
+        search of the batch are never handed out; their number is counted as zones_skipped.
+
+        Args:
+            stats (QueryStats, optional): Filled in with what the query cost.
+
+        Returns:
+            list: The matching rows of each search, in batch order.
+        """
+        print("Master: Entering master_process for combined search")
+        if stats is None:
+            stats = QueryStats(len(search_criteria_batch))
+
+        search_criteria_lists = [self.build_search_criteria_list(search_criteria)
+                                 for search_criteria in search_criteria_batch]
+        aggregates = [create_aggregate(search_criteria.get('aggregate')) for search_criteria in search_criteria_batch]
+        _, exports = split_exports(search_criteria_batch)
+        for export in filter(None, exports):
+            clear_export(export)
+        search_kwargs_batch = [self.criteria_list_to_kwargs(search_criteria_list)
+                               for search_criteria_list in search_criteria_lists]
+        # Only searches on zone mapped columns (year, mileage or test date range) can rule rows out
+        prunable = any(search_conditions(search_kwargs) for search_kwargs in search_kwargs_batch)
+        print(f"Master: Created {len(search_criteria_lists)} search criteria lists")
+
+        has_frames = not (vehicle_df is None or vehicle_df.empty or test_df is None or test_df.empty)
+        if has_frames:
+            total_rows = len(vehicle_df)
+        elif self.partition is not None:
+            # The master may hold no rows at all when every rank maps the column store
+            total_rows = self.partition.node_ranges[-1][1]
+        else:
+            total_rows = 0
+        if total_rows == 0:
+            print("Master: No data loaded. Returning empty results.")
+            return self.finish_exports(search_criteria_batch, exports, finalize(self.export_results(summarize(
+                [self.combined_search(pd.DataFrame(), pd.DataFrame()) for _ in search_criteria_lists], aggregates),
+                exports, 0), aggregates))
+
+        if all(isinstance(aggregate, RegionalPassRates) and RegionalCounters.covers(search_kwargs)
+               for search_kwargs, aggregate in zip(search_kwargs_batch, aggregates)):
+            counters = self.regional_counters(vehicle_df, test_df, stats)
+            if counters is not None:
+                stats.count('regional_counters_used', len(search_kwargs_batch))
+                with stats.phase("merge"):
+                    return finalize([counters.partial(search_kwargs) for search_kwargs in search_kwargs_batch],
+                                    aggregates)
+
+        self.drain_stale_messages()
+        workers = [w for w in range(1, self.size) if w not in self.failed_workers]
+        if not workers:
+            if self.size > 1:
+                raise QueryError("All workers have failed; restart the application.")
+            # Single process run: nobody to hand tasks to
+            if has_frames:
+                blocks = [(vehicle_df, test_df, None)]
+            else:
+                ranges = [(0, total_rows)]
+                if prunable and self.partition.zone_map is not None:
+                    ranges, skipped = self.partition.zone_map.ranges(0, total_rows, search_kwargs_batch)
+                    stats.count('zones_skipped', skipped)
+                    ranges = ranges or [(0, 0)]
+                if self.partition.block_rows is None:
+                    with tracer.span("read rows", "partition", rows=total_rows), stats.phase("read rows"):
+                        blocks = list(self.partition_blocks(ranges))
+                else:
+                    # Out of core: the column store is read block by block while it is scanned
+                    blocks = self.partition_blocks(ranges)
+            with tracer.span("search", "compute", rows=total_rows), stats.phase("scan"):
+                local_results, vehicles_scanned, tests_scanned, rows_matched = \
+                    self.scan_blocks(blocks, search_kwargs_batch, aggregates)
+            counters = stats.worker(self.rank)
+            counters.update(tasks=1, vehicles_scanned=vehicles_scanned, tests_scanned=tests_scanned,
+                            rows_matched=rows_matched, scan_seconds=stats.phases['scan'])
+            for name, count in self.index_counters.items():
+                stats.count(name, count)
+            return self.finish_exports(search_criteria_batch, exports,
+                                       finalize(self.export_results(local_results, exports, 0), aggregates))
+
+        if self.partition is not None:
+            # Workers start on the rows of their own node's shared window
+            domains = {worker_id: self.partition.rank_nodes[worker_id] for worker_id in workers}
+            ranges = {node: [node_range] for node, node_range in enumerate(self.partition.node_ranges)}
+            if not self.rows_movable():
+                orphaned = [node for node, (start, stop) in enumerate(self.partition.node_ranges)
+                            if stop > start and node not in domains.values()]
+                if orphaned:
+                    raise QueryError(f"The table shards of ranks {orphaned} are held by failed workers; "
+                                     "restart the application.")
+        else:
+            domains = None
+            ranges = [(0, total_rows)]
+        zone_map = self.zone_map(vehicle_df, test_df, stats) if prunable else None
+        if zone_map is not None:
+            # Zones no search of the batch can match are left out of the tasks altogether
+            if isinstance(ranges, dict):
+                skipped = 0
+                for node, [(start, stop)] in ranges.items():
+                    ranges[node], node_skipped = zone_map.ranges(start, stop, search_kwargs_batch)
+                    skipped += node_skipped
+                remaining = any(ranges.values())
+            else:
+                ranges, skipped = zone_map.ranges(0, total_rows, search_kwargs_batch)
+                remaining = bool(ranges)
+            stats.count('zones_skipped', skipped)
+            if not remaining:
+                print("Master: No rows can match. Returning empty results.")
+                return self.finish_exports(search_criteria_batch, exports, finalize(self.export_results(summarize(
+                    [self.combined_search(pd.DataFrame(), pd.DataFrame()) for _ in search_criteria_lists],
+                    aggregates), exports, 0), aggregates))
+        max_task_rows = self.max_task_rows
+        if self.partition is not None and self.partition.block_rows is not None:
+            # Out of core: a task reads no more rows than a worker can scan within the memory budget
+            max_task_rows = min(max_task_rows, self.partition.block_rows)
+        with tracer.span("plan tasks", "partition", workers=len(workers)), stats.phase("plan"):
+            scheduler = TaskScheduler(workers, ranges, min_task_rows=self.min_task_rows,
+                                      max_task_rows=max_task_rows,
+                                      target_task_seconds=self.target_task_seconds, domains=domains,
+                                      cross_domain=self.rows_movable())
+        self.query_id += 1
+        query_started = time.perf_counter()
+
+        running = {}    # task_id -> {'range', 'attempts', 'started': {worker_id: time}}
+        busy = {}       # worker_id -> task_id
+        last_seen = {worker_id: query_started for worker_id in workers}
+        task_ids = {}   # (start, stop) -> task_id, so that retried ranges keep their identity
+        attempts = {}   # task_id -> number of failed attempts
+        finished = {}   # task_id -> result
+        failed_on = {}  # worker_id -> ranges that already failed there
+        durations = []
+
+        def send(worker_id, task_id, task_range):
+            start, stop = task_range
+            task = {
+                'query_id': self.query_id,
+                'task_id': task_id,
+                'start': start,
+                'stop': stop,
+                'search_criteria_lists': search_criteria_lists,
+                'aggregates': [aggregate.spec() if aggregate is not None else None for aggregate in aggregates],
+            }
+            if any(exports):
+                task['exports'] = exports
+            with stats.phase("ship"):
+                if self.worker_holds(worker_id, start, stop):
+                    stats.count('tasks_read_locally')
+                else:
+                    # Only rows outside the worker's node window have to travel
+                    stats.count('tasks_shipped')
+                    aligned_vehicle_df, aligned_test_df, test_offsets = \
+                        self.aligned_frames(vehicle_df, test_df, stats)
+                    with tracer.span("cut chunk", "partition", rows=stop - start):
+                        task['vehicle_chunk'] = aligned_vehicle_df.iloc[start:stop]
+                        task['test_chunk'] = aligned_test_df.iloc[test_offsets[start]:test_offsets[stop]]
+                counters = stats.worker(worker_id)
+                counters['bytes_sent'] += self.send_task(worker_id, task, counters)
+            running.setdefault(task_id, {'range': task_range, 'started': {}})['started'][worker_id] = \
+                time.perf_counter()
+            busy[worker_id] = task_id
+            last_seen[worker_id] = time.perf_counter()
+
+        def dispatch(worker_id):
+            if worker_id not in scheduler.queues:
+                return False
+            task_range = scheduler.next_task(worker_id, avoid=failed_on.get(worker_id, ()))
+            if task_range is None:
+                return False
+            task_id = task_ids.setdefault(task_range, len(task_ids) + 1)
+            send(worker_id, task_id, task_range)
+            return True
+
+        def release(worker_id, task_id):
+            if busy.get(worker_id) == task_id:
+                del busy[worker_id]
+            task = running.get(task_id)
+            if task is not None:
+                task['started'].pop(worker_id, None)
+
+        def fail_task(task_id, reason):
+            attempts[task_id] = attempts.get(task_id, 0) + 1
+            if attempts[task_id] >= self.max_task_attempts:
+                raise QueryError(f"Task {task_id} failed {attempts[task_id]} times: {reason}")
+            if task_id in running and not running[task_id]['started']:
+                scheduler.requeue(running.pop(task_id)['range'])
+
+        def fail_worker(worker_id, reason):
+            print(f"Master: Worker {worker_id} failed ({reason}); reassigning its tasks")
+            self.failed_workers.add(worker_id)
+            scheduler.remove_worker(worker_id)
+            last_seen.pop(worker_id, None)
+            task_id = busy.get(worker_id)
+            if task_id is not None:
+                release(worker_id, task_id)
+                fail_task(task_id, reason)
+            if not self.rows_movable():
+                raise QueryError(f"Worker {worker_id} failed ({reason}) and no other rank holds its table shard.")
+
+        loop_started = time.perf_counter()
+        for worker_id in workers:
+            dispatch(worker_id)
+
+        status = MPI.Status()
+        while running or scheduler.has_work():
+            now = time.perf_counter()
+            if now - query_started > self.query_timeout:
+                raise QueryError(f"Query timed out after {self.query_timeout:.0f} seconds.")
+
+            live_workers = [w for w in scheduler.workers if w not in self.failed_workers]
+            if not live_workers:
+                raise QueryError("All workers have failed; the query cannot complete.")
+
+            # Hand out work to anybody who is idle, e.g. after a task was requeued
+            for worker_id in live_workers:
+                if worker_id not in busy:
+                    dispatch(worker_id)
+
+            if not self.comm.iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
+                self.check_workers(now, busy, running, last_seen, durations, scheduler, fail_worker, send)
+                time.sleep(self.poll_interval)
+                continue
+
+            worker_id = status.Get_source()
+            tag = status.Get_tag()
+            receive_started = time.perf_counter()
+            with tracer.span("recv result", "comm", worker=worker_id):
+                message = self.comm.recv(source=worker_id, tag=tag)
+
+            if worker_id in self.failed_workers:
+                # A worker we gave up on is alive after all: take it back
+                print(f"Master: Worker {worker_id} responded again; re-admitting it")
+                self.failed_workers.discard(worker_id)
+                if worker_id not in scheduler.queues:
+                    scheduler.queues[worker_id] = deque()
+                    scheduler.workers.append(worker_id)
+            last_seen[worker_id] = time.perf_counter()
+
+            if tag == HEARTBEAT_TAG:
+                continue
+
+            with tracer.span("deserialize result", "serialize", worker=worker_id, bytes=len(message)):
+                result = codec.loads(message, stats.worker(worker_id))
+            tracer.collect(result.pop('trace', None))
+            stats.add_time("receive", time.perf_counter() - receive_started)
+            stats.worker(worker_id)['bytes_received'] += len(message)
+            if result['query_id'] != self.query_id:
+                continue  # Late answer to an earlier query
+
+            task_id = result['task_id']
+            release(worker_id, task_id)
+
+            if 'error' in result:
+                print(f"Master: Task {task_id} failed on worker {worker_id}: {result['error']}")
+                self.worker_errors[worker_id] = self.worker_errors.get(worker_id, 0) + 1
+                if self.worker_errors[worker_id] >= self.max_worker_errors:
+                    fail_worker(worker_id, "too many task errors")
+                if self.rows_movable():
+                    # Run it elsewhere next time; distributed shards can only be retried by their owner
+                    failed_on.setdefault(worker_id, set()).add(running[task_id]['range'] if task_id in running
+                                                               else (result['start'], result['stop']))
+                fail_task(task_id, result['error'])
+            elif task_id not in finished:
+                self.worker_errors[worker_id] = 0
+                finished[task_id] = result
+                durations.append(result['seconds'])
+                counters = stats.worker(worker_id)
+                counters['tasks'] += 1
+                counters['vehicles_scanned'] += result['stop'] - result['start']
+                counters['tests_scanned'] += result['tests']
+                counters['rows_matched'] += result['rows_matched']
+                counters['scan_seconds'] += result['seconds']
+                for name, count in result['indexes'].items():
+                    stats.count(name, count)
+                scheduler.record(worker_id, result['stop'] - result['start'], result['seconds'])
+                running.pop(task_id, None)
+
+            if worker_id not in self.failed_workers:
+                dispatch(worker_id)
+
+        print(f"Master: {len(finished)} tasks completed by {len(workers)} workers "
+              f"({scheduler.steals} steals, {self.speculative_tasks} speculative copies so far)")
+        # Whatever the loop did besides shipping tasks and reading results was waiting for workers
+        stats.add_time("wait", time.perf_counter() - loop_started - stats.phases.get("ship", 0.0)
+                       - stats.phases.get("receive", 0.0))
+
+        # Aggregate Results in row order so the output does not depend on scheduling
+        with tracer.span("aggregate results", "aggregate", tasks=len(finished)), stats.phase("merge"):
+            results = sorted(finished.values(), key=lambda r: r['start'])
+            combined_results = finalize([combine([r['results'][index] for r in results], aggregate)
+                                         for index, aggregate in enumerate(aggregates)], aggregates)
         print("Master: Exiting master_process")
-        return combined_results
+        return self.finish_exports(search_criteria_batch, exports, combined_results)
+
+    @staticmethod
+    def export_results(results, exports, index):
+        """
+        Writes the rows of every exported search to the file of the index-th share of its export,
+        and puts the file's part row (see analysis.export) in place of the rows.
+        """
+        return [rows if export is None else write_part(rows, export, part_name(index, export))
+                for rows, export in zip(results, exports)]
+
+    @staticmethod
+    def finish_exports(search_criteria_batch, exports, results):
+        """Writes the manifest of every exported search, whose result is the list of its files in row order."""
+        return [parts if export is None else write_manifest(export, parts, search_criteria)
+                for search_criteria, export, parts in zip(search_criteria_batch, exports, results)]
+
+    def check_workers(self, now, busy, running, last_seen, durations, scheduler, fail_worker, send):
+        """
+        Declares silent workers failed and launches speculative copies of straggling tasks.
+
+        A worker is silent when nothing (heartbeat or result) has arrived from it for
+        heartbeat_timeout seconds while it holds a task. A task straggles when it has run for
+        straggler_factor times the median task duration and there is an idle worker with nothing
+        else to do.
+        """
+        for worker_id, task_id in list(busy.items()):
+            if now - last_seen.get(worker_id, now) > self.heartbeat_timeout:
+                fail_worker(worker_id, f"no heartbeat for {self.heartbeat_timeout:.0f} seconds")
+
+        if scheduler.has_work() or not durations:
+            return
+        idle = [w for w in scheduler.workers if w not in busy and w not in self.failed_workers]
+        if not idle:
+            return
+
+        median = sorted(durations)[len(durations) // 2]
+        threshold = max(self.straggler_min_seconds, self.straggler_factor * median)
+        for task_id, task in list(running.items()):
+            if not idle:
+                break
+            if len(task['started']) != 1:
+                continue  # Already has a copy (or is waiting to be resent)
+            started = next(iter(task['started'].values()))
+            candidates = [w for w in idle if self.rows_movable() or self.worker_holds(w, *task['range'])]
+            if now - started > threshold and candidates:
+                worker_id = candidates[0]
+                idle.remove(worker_id)
+                print(f"Master: Task {task_id} is straggling; running a speculative copy on worker {worker_id}")
+                self.speculative_tasks += 1
+                send(worker_id, task_id, task['range'])
+
+    def drain_stale_messages(self):
+        """Throws away heartbeats and late results left over from earlier queries."""
+        status = MPI.Status()
+        while self.comm.iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
+            self.comm.recv(source=status.Get_source(), tag=status.Get_tag())
 
     def worker_process(self, vehicle_df, test_df):
+        """
+        Runs tasks sent by the master until the termination signal arrives.
+
+        Every task is answered, a failed one with an error reply. That includes a task whose
+        message cannot be decoded: the reply then names it by the tag it came with, so the master
+        retries it or fails the query at once instead of waiting for heartbeat_timeout.
+        """
+        status = MPI.Status()
         while True:
-            try:
-                # Signal availability to the master
-                print(f"Worker {self.rank}: Signaling availability to master")
-                self.comm.send(None, dest=0, tag=0)
-
-
-
-                    # Receive vehicle data size and data
-                print(f"Worker {self.rank}: Waiting for vehicle data size")
-                vehicle_size = self.comm.recv(source=0, tag=0)
-                print(f"Worker {self.rank}: Received vehicle data size: {vehicle_size}")
-                vehicle_data = self.comm.recv(source=0, tag=1)
-                local_vehicle_df = pickle.loads(vehicle_data)
-
-                # Receive test data size and data
-                print(f"Worker {self.rank}: Waiting for test data size")
-                test_size = self.comm.recv(source=0, tag=2)
-                print(f"Worker {self.rank}: Received test data size: {test_size}")
-                test_data = self.comm.recv(source=0, tag=3)
-                local_test_df = pickle.loads(test_data)
-
-                # Receive search criteria size and data
-                print(f"Worker {self.rank}: Waiting for search criteria size")
-                search_criteria_size = self.comm.recv(source=0, tag=4)
-                print(f"Worker {self.rank}: Received search criteria size: {search_criteria_size}")
-                search_criteria_data = self.comm.recv(source=0, tag=5)
-                search_criteria_list = pickle.loads(search_criteria_data)  # Deserialize the list
-
-                # Perform Search with ALL criteria
-                print(f"Worker {self.rank}: Performing search with criteria: {search_criteria_list}")
-                search_kwargs = {}
-                for criteria in search_criteria_list:
-                    if criteria['type'] == 'make':
-                        search_kwargs['make'] = criteria['value']
-                    elif criteria['type'] == 'model':
-                        search_kwargs['model'] = criteria['value']
-                    elif criteria['type'] == 'year':
-                        search_kwargs['year'] = criteria['value']
-                    elif criteria['type'] == 'mileage':
-                        search_kwargs['min_mileage'] = criteria['min_value']
-                        search_kwargs['max_mileage'] = criteria['max_value']
-
-                local_results = self.combined_search(local_vehicle_df, local_test_df, **search_kwargs)
-
-                # Send results back to master along with worker ID
-                print(f"Worker {self.rank}: Sending results back to master")
-                self.comm.send((local_results, self.rank), dest=0, tag=6)  # Tag 6 for results
-
-                # Check for termination signal
-                if self.comm.iprobe(source=0, tag=7):  # Tag 7 for termination
-                    print(f"Worker {self.rank}: Received termination signal.")
-                    self.comm.recv(source=0, tag=7)  # Actually receive the signal
-                    print(f"Worker {self.rank}: Exiting.")
-                    break
+            message = self.comm.recv(source=0, tag=MPI.ANY_TAG, status=status)
+            if status.Get_tag() == TERMINATE_TAG:
+                print(f"Worker {self.rank}: Received termination signal. Exiting.")
+                # The acknowledgement carries the spans recorded since the last reply
+                self.comm.send(tracer.drain(), dest=0, tag=TERMINATE_TAG)
+                break
 
+            tag, message = message
+            heartbeat = None
+            try:
+                with tracer.span("deserialize task", "serialize", bytes=len(message)):
+                    task = codec.loads(message)
+                heartbeat = self.start_heartbeat(tag)
+                if 'lookups' in task or 'lookup_index' in task:
+                    reply = self.worker_lookup(task)
+                elif 'regional_counters' in task:
+                    with tracer.span("build regional counters", "partition"):
+                        start, stop = self.partition.rank_range(exclude_root=True)
+                        reply = {'counters': RegionalCounters.build(self.partition.blocks(start, stop))}
+                else:
+                    started = time.perf_counter()
+                    if 'vehicle_chunk' in task:
+                        vehicle_chunk, test_chunk, date_index = task['vehicle_chunk'], task['test_chunk'], None
+                    else:
+                        with tracer.span("read rows", "partition", rows=task['stop'] - task['start']):
+                            vehicle_chunk, test_chunk = self.partition.frames(task['start'], task['stop'])
+                            date_index = self.partition.date_index(task['start'], task['stop'])
+                    search_kwargs_batch = [self.criteria_list_to_kwargs(criteria_list)
+                                           for criteria_list in task['search_criteria_lists']]
+                    aggregates = [create_aggregate(spec) for spec in task['aggregates']]
+                    with tracer.span("search", "compute", task=task['task_id'], rows=len(vehicle_chunk)):
+                        local_results = [categoricals_to_objects(results) for results in
+                                         self.combined_search_batch(vehicle_chunk, test_chunk, search_kwargs_batch,
+                                                                    date_index)]
+                    if 'exports' in task:
+                        # The worker writes the rows itself; only the names of its files travel
+                        with tracer.span("export rows", "serialize", task=task['task_id']):
+                            exported = self.export_results(local_results, task['exports'], task['start'])
+                    else:
+                        exported = local_results
+                    reply = {
+                        'results': summarize(exported, aggregates),
+                        'rows_matched': sum(len(results) for results in local_results),
+                        'seconds': time.perf_counter() - started,
+                        'tests': len(test_chunk),
+                        'indexes': dict(self.index_counters),
+                    }
             except Exception as e:
                 print(f"Worker {self.rank}: Error occurred: {e}")
-                break
\ No newline at end of file
+                reply = {'error': f"{type(e).__name__}: {e}"}
+            finally:
+                self.stop_heartbeat(heartbeat)
+
+            reply.update(tag)
+            if tracer.enabled:
+                # Spans of sending this reply travel with the next one
+                reply['trace'] = tracer.drain()
+            with tracer.span("serialize result", "serialize", task=tag['task_id']):
+                message = codec.dumps(reply)
+            with tracer.span("send result", "comm", task=tag['task_id'], bytes=len(message)):
+                self.comm.send(message, dest=0, tag=RESULT_TAG)
+
+    def worker_lookup(self, task):
+        """
+        Sends the master the Bloom filters of this worker's id index (a 'lookup_index' task) or
+        answers the task's lookups from it. The index covers the worker's own share of the
+        partition and is built on first use.
+        """
+        if self._lookup is None:
+            with tracer.span("build lookup index", "partition"):
+                start, stop = self.partition.rank_range(exclude_root=True)
+                self._lookup = (self.partition, IdIndex(self.partition.blocks(start, stop), start), None)
+            print(f"Worker {self.rank}: Lookup index over {len(self._lookup[1])} vehicles")
+        source, index, _ = self._lookup
+        if 'lookup_index' in task:
+            return {'filters': index.filters}
+        return {'lookups': {position: history(source, index, field, value, RESULT_COLUMNS)
+                            for position, (field, value) in task['lookups'].items()}}
+
+    def start_heartbeat(self, task):
+        """
+        Starts a thread that tells the master this worker is alive while a task runs.
+
+        The main thread makes no MPI calls until stop_heartbeat has joined the thread, so
+        THREAD_SERIALIZED support is enough.
+        """
+        if self.heartbeat_interval <= 0 or MPI.Query_thread() < MPI.THREAD_SERIALIZED:
+            return None
+
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat_interval):
+                self.comm.send((task['query_id'], task['task_id']), dest=0, tag=HEARTBEAT_TAG)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        return stop, thread
+
+    def stop_heartbeat(self, heartbeat):
+        if heartbeat is not None:
+            stop, thread = heartbeat
+            stop.set()
+            thread.join()
+
+    def terminate_workers(self):
+        """
+        Tells every worker to leave worker_process and waits for them to acknowledge.
+
+        Workers still busy with an abandoned task finish it first, so results arriving in the
+        meantime are drained to keep them from blocking on their send.
+        """
+        waiting = set(range(1, self.size))
+        for worker_id in waiting:
+            self.comm.isend(None, dest=worker_id, tag=TERMINATE_TAG)
+
+        status = MPI.Status()
+        deadline = time.perf_counter() + self.heartbeat_timeout
+        while waiting and time.perf_counter() < deadline:
+            if not self.comm.iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
+                time.sleep(self.poll_interval)
+                continue
+            message = self.comm.recv(source=status.Get_source(), tag=status.Get_tag())
+            if status.Get_tag() == TERMINATE_TAG:
+                tracer.collect(message)
+                waiting.discard(status.Get_source())
+        if waiting:
+            print(f"Master: Workers {sorted(waiting)} did not acknowledge termination")
+        tracer.flush()
@@ -0,0 +1,204 @@
+import lzma
+import pickle
+import struct
+import time
+import zlib
+
+# Codec ids written in the first byte of every frame
+RAW, ZLIB_FAST, ZLIB, LZMA = range(4)
+CODEC_NAMES = {RAW: 'raw', ZLIB_FAST: 'zlib-1', ZLIB: 'zlib-6', LZMA: 'lzma-1'}
+MODES = {
+    'off': (),
+    'zlib': (ZLIB_FAST, ZLIB),
+    'lzma': (LZMA,),
+    'auto': (ZLIB_FAST, ZLIB, LZMA),
+}
+
+# Frame header: codec id, uncompressed size, seconds the sender spent compressing
+HEADER = struct.Struct('<BQd')
+
+
+def _compressor(codec_id):
+    if codec_id == ZLIB_FAST:
+        return zlib.compressobj(1)
+    if codec_id == ZLIB:
+        return zlib.compressobj(6)
+    return lzma.LZMACompressor(preset=1)
+
+
+def _compress(codec_id, data):
+    compressor = _compressor(codec_id)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(codec_id, data):
+    if codec_id in (ZLIB_FAST, ZLIB):
+        return zlib.decompress(data)
+    return lzma.decompress(data)
+
+
+class _Frame:
+    """A file object that pickles or compresses straight into a frame after room for its header."""
+
+    def __init__(self):
+        self.frame = bytearray(HEADER.size)
+
+    def write(self, data):
+        self.frame += data
+
+
+class MessageCodec:
+    """
+    Pickles the messages ranks exchange and compresses them when that is expected to pay off.
+
+    Every message becomes a frame: a small header naming the codec, followed by the pickle as is
+    or compressed. Which codec a message gets is decided per message: messages below min_size
+    go raw, and for the others the expected time to compress and transfer is estimated for
+    every codec the mode allows, from the compression ratio and throughput measured on earlier
+    messages and the configured link bandwidth. The estimates start from (and are refreshed
+    every probe_every messages by) compressing a sample from the middle of the message.
+
+    Frames describe themselves, so ranks with different settings can still read each other's
+    messages. Totals of bytes saved and seconds spent are kept in counters; the headers are
+    counted apart from the savings, so a raw frame saves nothing rather than a little less.
+    """
+
+    SAMPLE_BYTES = 64 * 1024
+
+    def __init__(self, mode='off', bandwidth=1000e6, min_size=32 * 1024, probe_every=32):
+        self.configure(mode, bandwidth, min_size, probe_every)
+        self.counters = {'messages': 0, 'compressed': 0, 'raw_bytes': 0, 'wire_bytes': 0, 'header_bytes': 0,
+                         'compress_seconds': 0.0, 'decompress_seconds': 0.0}
+
+    def configure(self, mode, bandwidth=1000e6, min_size=32 * 1024, probe_every=32):
+        """
+        Args:
+            mode (str): 'off', 'zlib', 'lzma' or 'auto' (any of them, picked per message).
+            bandwidth (float): Bytes per second one message gets on the interconnect.
+            min_size (int): Messages smaller than this are never compressed.
+            probe_every (int): Messages between two samples of every codec.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown compression mode {mode!r}; expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.candidates = MODES[mode]
+        self.bandwidth = bandwidth
+        self.min_size = min_size
+        self.probe_every = probe_every
+        self.estimates = {}  # codec id -> [compressed/raw ratio, bytes compressed per second]
+        self.since_probe = 0
+
+    @property
+    def enabled(self):
+        return bool(self.candidates)
+
+    def choose(self, data):
+        """The codec expected to get data across fastest."""
+        size = len(data)
+        if size < self.min_size or not self.candidates:
+            return RAW
+        if self.since_probe >= self.probe_every or any(c not in self.estimates for c in self.candidates):
+            self.probe(data)
+        self.since_probe += 1
+
+        best, best_seconds = RAW, size / self.bandwidth
+        for codec_id in self.candidates:
+            ratio, throughput = self.estimates[codec_id]
+            seconds = size / throughput + size * ratio / self.bandwidth
+            if seconds < best_seconds:
+                best, best_seconds = codec_id, seconds
+        return best
+
+    def probe(self, data):
+        """Measures every candidate codec on a sample of data."""
+        middle = max(len(data) // 2 - self.SAMPLE_BYTES // 2, 0)
+        sample = bytes(data[middle:middle + self.SAMPLE_BYTES])
+        for codec_id in self.candidates:
+            started = time.perf_counter()
+            compressed = _compress(codec_id, sample)
+            self.record(codec_id, len(sample), len(compressed), time.perf_counter() - started)
+        self.since_probe = 0
+
+    def record(self, codec_id, raw_size, compressed_size, seconds):
+        """Folds one measurement into the running estimates of a codec."""
+        ratio = compressed_size / max(raw_size, 1)
+        throughput = raw_size / max(seconds, 1e-9)
+        if codec_id not in self.estimates:
+            self.estimates[codec_id] = [ratio, throughput]
+        else:
+            estimate = self.estimates[codec_id]
+            estimate[0] = 0.7 * estimate[0] + 0.3 * ratio
+            estimate[1] = 0.7 * estimate[1] + 0.3 * throughput
+
+    def dumps(self, obj, counters=None, compress=True):
+        """
+        Pickles obj into a frame, a bytearray.
+
+        The pickle and the compressed payload are written straight into the frame behind the
+        space left for the header, so a message is not copied again to prepend it. counters (a
+        QueryStats.worker dict) gets the bytes saved and the compression time. Pass
+        compress=False for messages that never leave the process, such as rank 0's own share
+        of a gather.
+        """
+        raw = _Frame()
+        pickle.Pickler(raw, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+        message = raw.frame
+        with memoryview(message)[HEADER.size:] as data:
+            raw_size = len(data)
+            codec_id = self.choose(data) if compress else RAW
+            seconds = 0.0
+            if codec_id != RAW:
+                started = time.perf_counter()
+                compressed = _Frame()
+                compressor = _compressor(codec_id)
+                compressed.write(compressor.compress(data))
+                compressed.write(compressor.flush())
+                seconds = time.perf_counter() - started
+                self.record(codec_id, raw_size, len(compressed.frame) - HEADER.size, seconds)
+                if len(compressed.frame) < len(message):
+                    message = compressed.frame
+                else:
+                    codec_id = RAW
+        HEADER.pack_into(message, 0, codec_id, raw_size, seconds)
+        saved = raw_size + HEADER.size - len(message)
+
+        self.counters['messages'] += 1
+        self.counters['compressed'] += codec_id != RAW
+        self.counters['raw_bytes'] += raw_size
+        self.counters['wire_bytes'] += len(message)
+        self.counters['header_bytes'] += HEADER.size
+        self.counters['compress_seconds'] += seconds
+        if counters is not None:
+            counters['bytes_saved'] += saved
+            counters['compress_seconds'] += seconds
+        return message
+
+    def loads(self, message, counters=None):
+        """
+        Unpickles a frame made by dumps.
+
+        counters gets the bytes the sender saved and the time spent on both ends.
+        """
+        codec_id, raw_size, sender_seconds = HEADER.unpack_from(message)
+        payload = memoryview(message)[HEADER.size:]
+        started = time.perf_counter()
+        data = payload if codec_id == RAW else _decompress(codec_id, payload)
+        seconds = time.perf_counter() - started
+        self.counters['decompress_seconds'] += seconds
+        if counters is not None:
+            counters['bytes_saved'] += raw_size - len(payload)
+            counters['compress_seconds'] += sender_seconds + seconds
+        return pickle.loads(data)
+
+    def summary(self):
+        """One line with the totals, e.g. for the end of a run."""
+        counters = self.counters
+        saved = counters['raw_bytes'] + counters['header_bytes'] - counters['wire_bytes']
+        return (f"Compression ({self.mode}): {counters['compressed']} of {counters['messages']} messages "
+                f"compressed, {saved / 1e6:.1f} MB saved of {counters['raw_bytes'] / 1e6:.1f} MB, "
+                f"{counters['header_bytes'] / 1e3:.1f} KB of frame headers, "
+                f"{counters['compress_seconds'] * 1000:.0f} ms compressing, "
+                f"{counters['decompress_seconds'] * 1000:.0f} ms decompressing")
+
+
+codec = MessageCodec()
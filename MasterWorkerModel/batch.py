@@ -0,0 +1,76 @@
+import argparse
+import os
+
+from app import start_backend, load_data
+from tracing import tracer
+from analysis.backends import BACKENDS
+from analysis.transport import codec, MODES as COMPRESSION_MODES
+from analysis.batch_runner import BatchRunner, read_queries
+from analysis.export import EXPORT_FORMATS
+from analysis.search_analysis import SearchAnalyzer, QueryError
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a file of searches without the GUI (master-worker model)")
+    parser.add_argument("queries", help="JSON lines file, one search_criteria object per line")
+    parser.add_argument("--output", default="batch_results", help="Directory for the results and summary.json")
+    parser.add_argument("--group", type=int, default=1,
+                        help="Send this many queries to the workers at a time, answered in one shared scan")
+    parser.add_argument("--summary-only", action="store_true",
+                        help="Write analyses and the summary but not the matching rows")
+    parser.add_argument("--export", choices=EXPORT_FORMATS, default=None,
+                        help="Have the workers write each query's matching rows in parallel, into a "
+                             "query_NNNN directory with a manifest, instead of sending them to rank 0")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.environ.get("MOT_BACKEND", "mpi"),
+                        help="'mpi' runs under mpiexec, 'shm' runs on a local process pool without MPI")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of pool processes for the 'shm' backend (default: all cores)")
+    parser.add_argument("--no-shared-windows", action="store_true",
+                        help="Ship every task's rows from rank 0 instead of using per-node MPI shared windows")
+    parser.add_argument("--distributed-tables", action="store_true",
+                        help="Build the vehicle and test tables as per-rank shards (hashed by vehicle_id) "
+                             "instead of on rank 0, and cache them per rank")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="Out-of-core mode: spill the ingest to disk and scan the column store in blocks so "
+                             "that each rank stays within about this many MB")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="Record per-rank spans and write them as a Chrome trace (chrome://tracing, Perfetto)")
+    parser.add_argument("--compression", choices=COMPRESSION_MODES, default="off",
+                        help="Compress result frames and partitions sent between ranks; 'auto' picks zlib, lzma "
+                             "or no compression per message")
+    parser.add_argument("--link-bandwidth", type=float, default=1000,
+                        help="MB/s a message gets on the interconnect; lower values make compression pay off sooner")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    backend, comm, rank, size = start_backend(args)
+    if args.trace:
+        tracer.enable(rank, args.trace)
+    codec.configure(args.compression, args.link_bandwidth * 1e6)
+    vehicle_df, test_df, partition = load_data(args, backend, comm, rank, size)
+
+    if rank != 0:
+        from worker import worker_main
+        worker_main(comm, rank, size, vehicle_df, test_df, partition)
+        if codec.enabled:
+            print(f"Rank {rank}: {codec.summary()}")
+        return
+
+    search_analyzer = SearchAnalyzer(comm, rank, size, backend, partition)
+    try:
+        runner = BatchRunner(search_analyzer, vehicle_df, test_df, args.output, write_rows=not args.summary_only,
+                             group_size=args.group, export_format=args.export)
+        runner.run(read_queries(args.queries), errors=(QueryError,))
+    finally:
+        if backend is not None:
+            backend.close()
+        else:
+            search_analyzer.terminate_workers()
+    if codec.enabled:
+        print(f"Rank {rank}: {codec.summary()}")
+
+
+if __name__ == "__main__":
+    main()
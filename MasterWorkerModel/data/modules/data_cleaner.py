@@ -4,8 +4,17 @@ import pandas as pd
 class DataCleaner:
     """
     Handles cleaning of MOT data, with a separate function for each column.
+
+    Values that cannot be cleaned are replaced as before and counted per column in bad_values,
+    which the ingest progress reports instead of printing a warning for each.
     """
 
+    def __init__(self):
+        self.bad_values = {}
+
+    def count_bad(self, column):
+        self.bad_values[column] = self.bad_values.get(column, 0) + 1
+
     def clean_test_id(self, value):
         # No specific cleaning needed for test_id, assuming it's a unique identifier
         return value
@@ -18,7 +27,7 @@ class DataCleaner:
         try:
             return pd.to_datetime(value)
         except ValueError:
-            print(f"Warning: Invalid date format: {value}")
+            self.count_bad('test_date')
             return None
 
     def clean_test_class_id(self, value):
@@ -37,11 +46,11 @@ class DataCleaner:
         try:
             mileage = int(value)
             if mileage < 0:
-                print(f"Warning: Negative mileage found: {mileage}")
+                self.count_bad('test_mileage')
                 return 0  # Or handle it differently (e.g., set to 0, set to a specific value, etc.)
             return mileage
         except (ValueError, TypeError):
-            # print(f"Warning: Invalid mileage value: {value}")
+            self.count_bad('test_mileage')
             return 0
 
     def clean_postcode_area(self, value):
@@ -68,14 +77,14 @@ class DataCleaner:
         try:
             return int(value)
         except (ValueError, TypeError):
-            # print(f"Warning: Invalid cylinder capacity: {value}")
+            self.count_bad('cylinder_capacity')
             return 0
 
     def clean_first_use_date(self, value):
         try:
             return pd.to_datetime(value)
         except ValueError:
-            print(f"Warning: Invalid date format: {value}")
+            self.count_bad('first_use_date')
             return None
 
     def clean_row(self, row):
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 class DataFrameCreator:
@@ -49,4 +50,25 @@ class DataFrameCreator:
 
         print("Vehicle and Test DataFrames created.")
 
-        return vehicle_df, test_df
\ No newline at end of file
+        return vehicle_df, test_df
+
+    def align_by_vehicle(self, vehicle_df, test_df):
+        """
+        Sorts both DataFrames by vehicle_id so that any contiguous range of vehicle rows
+        maps onto a contiguous range of test rows.
+
+        Args:
+            vehicle_df (pd.DataFrame): The vehicle DataFrame.
+            test_df (pd.DataFrame): The test DataFrame.
+
+        Returns:
+            tuple: (vehicle_df, test_df, test_offsets) where the tests of vehicle row i are
+            test_df[test_offsets[i]:test_offsets[i + 1]].
+        """
+        vehicle_df = vehicle_df.sort_values('vehicle_id', kind='stable').reset_index(drop=True)
+        test_df = test_df.sort_values('vehicle_id', kind='stable').reset_index(drop=True)
+
+        test_offsets = np.searchsorted(test_df['vehicle_id'].to_numpy(), vehicle_df['vehicle_id'].to_numpy(),
+                                       side='left')
+        test_offsets = np.append(test_offsets, len(test_df)).astype(np.int64)
+        return vehicle_df, test_df, test_offsets
\ No newline at end of file
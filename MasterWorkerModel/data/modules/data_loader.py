@@ -1,21 +1,119 @@
 import pandas as pd
 import csv
 import os
-from mpi4py import MPI
+from data.modules.column_store import MappedColumnStore, write_column_store
 from data.modules.data_frames import DataFrameCreator
+from data.modules.distributed_frames import DistributedDataFrameCreator, DistributedFrames
+from data.modules.ingest_progress import IngestProgress, PROGRESS_TAG
+from data.modules.spill import SpillWriter, build_column_store, bucket_count, chunk_rows
+from tracing import tracer
+
+try:
+    from mpi4py import MPI
+except ImportError:  # The shared-memory backend runs without MPI
+    MPI = None
+
+# Rows parsed between two progress updates; the update itself only checks the clock
+PROGRESS_ROWS = 1000
+
+
+def read_csv_file(filename, data_cleaner, rows_per_file, start_row=0, progress=None):
+    """
+    Reads and cleans up to rows_per_file rows of a CSV file, starting at start_row.
+
+    Kept at module level so that process pools can run it without a loader instance. Every
+    PROGRESS_ROWS rows the counts are handed to progress (an IngestProgress), which decides
+    itself whether it is time to report.
+    """
+    frames = list(iter_csv_chunks(filename, data_cleaner, rows_per_file, rows_per_file, start_row, progress))
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def iter_csv_chunks(filename, data_cleaner, rows_per_file, chunk_rows, start_row=0, progress=None):
+    """
+    Reads and cleans a portion of a CSV file like read_csv_file, handing the rows out in chunks.
+
+    Only one chunk of cleaned rows is held at a time, so files larger than memory can be parsed.
+
+    Args:
+        chunk_rows (int): Maximum number of rows per DataFrame.
+        (The other arguments are those of read_csv_file.)
+
+    Yields:
+        pandas.DataFrame: The cleaned rows, at least one (possibly empty) DataFrame per file.
+    """
+    data = []
+    rows = reported_rows = reported_bytes = 0
+    with open(filename, 'r') as f:
+        reader = csv.DictReader(f)
+        for i, row in enumerate(reader):
+            if i < start_row:
+                continue
+            if i >= start_row + rows_per_file:
+                break
+
+            cleaned_row = data_cleaner.clean_row(row)
+            data.append(cleaned_row)
+            rows += 1
+
+            if progress is not None and rows % PROGRESS_ROWS == 0:
+                consumed = f.buffer.tell()  # Bytes handed to the text decoder so far
+                progress.update(rows - reported_rows, consumed - reported_bytes, data_cleaner.bad_values)
+                reported_rows, reported_bytes = rows, consumed
+
+            if len(data) >= chunk_rows:
+                yield pd.DataFrame(data)
+                data = []
+
+    if progress is not None:
+        # The rest of the file counts as done, even when rows_per_file stopped reading early
+        progress.file_done()
+        progress.update(rows - reported_rows, os.path.getsize(filename) - reported_bytes,
+                        data_cleaner.bad_values)
+    if data or rows == 0:
+        yield pd.DataFrame(data)
+
 
 class MasterWorkerDataLoader:
-    def __init__(self, data_cleaner, rows_per_file=1000000):
+    def __init__(self, data_cleaner, rows_per_file=1000000, backend=None):
         self.data_cleaner = data_cleaner
         self.rows_per_file = rows_per_file
-        self.comm = MPI.COMM_WORLD
-        self.rank = self.comm.Get_rank()
-        self.size = self.comm.Get_size()
+        self.backend = backend
+        if backend is not None or MPI is None:
+            # Single process driving a local backend
+            self.comm = None
+            self.rank = 0
+            self.size = 1
+        else:
+            self.comm = MPI.COMM_WORLD
+            self.rank = self.comm.Get_rank()
+            self.size = self.comm.Get_size()
         self.num_workers = self.size - 1
         self.vehicle_df = None
         self.test_df = None
+        self.store = None  # MappedColumnStore once every rank can map the column files
+        self.progress = None  # IngestProgress while CSV files are parsed
+        self.keep_parsed = False  # Workers keep the files they parse instead of sending them to the master
+        self.parsed = []
+        self.memory_budget = None  # Bytes per rank in out-of-core mode
+        self.spill = None  # SpillWriter while an out-of-core ingest parses
 
     def load_data(self):
+        """
+        Loads the data on every rank.
+
+        When the memory-mapped column store exists every rank maps it and nothing is parsed or
+        unpickled; the master then holds no rows itself and workers read their task ranges from the
+        store. Otherwise the data comes from the Pickle cache or the CSV files, and the column store
+        is written for the next start.
+
+        Returns:
+            tuple: (vehicle_df, test_df) on the master, (None, None) on workers or when the store is used.
+        """
+        if self.backend is None and self.open_column_store():
+            print(f"Rank {self.rank}: Mapped column store with {self.store.num_vehicles} vehicles")
+            return self.vehicle_df, self.test_df
+
         if self.rank == 0:
             # Master process
             if os.path.isfile("database/local_db/vehicle_df.pkl"):
@@ -23,6 +121,8 @@ class MasterWorkerDataLoader:
                 vehicle_df = pd.read_pickle("database/local_db/vehicle_df.pkl")
                 test_df = pd.read_pickle("database/local_db/test_df.pkl")
                 print("DataFrames loaded from Pickle files.")
+            elif self.backend is not None:
+                vehicle_df, test_df = self.backend_process_data_loading()
             else:
                 vehicle_df, test_df = self.master_process_data_loading()
             self.vehicle_df = vehicle_df
@@ -37,13 +137,133 @@ class MasterWorkerDataLoader:
                 print("DataFrames loaded from Pickle files.")
             else:
                 self.worker_process_data_loading()
+
+        if self.backend is None:
+            if self.rank == 0 and self.vehicle_df is not None:
+                with tracer.span("write column store", "ingest"):
+                    write_column_store(self.vehicle_df, self.test_df)
+            self.open_column_store()
         return self.vehicle_df, self.test_df
 
+    def open_column_store(self):
+        """
+        Collective: maps the column store if every rank can see it.
+
+        Ranks on a host without the store files (no shared filesystem) make everyone fall back to
+        rank 0's in-memory frames.
+        """
+        with tracer.span("open column store", "ingest"):
+            if self.comm is not None:
+                self.comm.Barrier()
+            visible = MappedColumnStore.exists()
+            if self.comm is not None:
+                visible = all(self.comm.allgather(visible))
+            if visible:
+                self.store = MappedColumnStore(rank=self.rank, size=self.size, exclude_root=True,
+                                               memory_budget=self.memory_budget)
+        return visible
+
+
+    def distribute_tables(self):
+        """
+        Collective: builds the vehicle and test tables as shards on the workers instead of on the master.
+
+        The master still deals the CSV files out, but workers keep the rows they parse and only
+        report how many there were. DistributedDataFrameCreator then moves each vehicle with its
+        tests to the worker its vehicle_id hashes to; the master owns no shard. The shards are
+        cached per rank, and later starts with the same number of ranks load them directly.
+
+        Returns:
+            DistributedFrames: This rank's shard (empty on the master).
+        """
+        owners = range(1, self.size)
+        partition = DistributedFrames.open(self.comm, owners)
+        if partition is not None:
+            return partition
+
+        self.keep_parsed = True
+        if self.rank == 0:
+            self.master_process_data_loading()
+        else:
+            self.worker_process_data_loading()
+        local_df = pd.concat(self.parsed, ignore_index=True) if self.parsed else pd.DataFrame()
+        self.parsed = []
+
+        vehicle_df, test_df = DistributedDataFrameCreator(self.comm, owners).create_data_frames(local_df)
+        partition = DistributedFrames(self.comm, vehicle_df, test_df, owners)
+        partition.save()
+        return partition
+
+    def load_out_of_core(self, memory_budget):
+        """
+        Collective: opens the column store for reads in blocks that fit memory_budget bytes per
+        rank, building it out of core first when there is none.
+
+        Files are dealt out as usual, but whoever parses them spills every chunk to hash buckets
+        by vehicle_id right away (see SpillWriter) and only reports a row count. The master then
+        turns one bucket at a time into vehicle and test tables and appends them to the column
+        store, so no rank ever holds the full tables. Like the column store itself, this needs a
+        filesystem shared by all ranks.
+
+        Returns:
+            MappedColumnStore: The store, reading at most block_rows vehicles at a time.
+        """
+        self.memory_budget = memory_budget
+        if not self.open_column_store():
+            self.spill_ingest()
+            self.open_column_store()
+        print(f"Rank {self.rank}: Out-of-core column store with {self.store.num_vehicles} vehicles, "
+              f"{self.store.block_rows} per block")
+        return self.store
+
+    def spill_ingest(self):
+        """Collective: parses the files into spill buckets and builds the column store on the master."""
+        num_buckets = None
+        if self.rank == 0:
+            num_buckets = bucket_count(sum(map(os.path.getsize, self.list_csv_files())), self.memory_budget)
+        if self.comm is not None:
+            num_buckets = self.comm.bcast(num_buckets, root=0)
+        self.spill = SpillWriter(self.rank, num_buckets)
+        if self.rank == 0:
+            self.master_process_data_loading()
+        else:
+            self.worker_process_data_loading()
+        spilled = self.spill.close()
+        spilled = self.comm.gather(spilled, root=0) if self.comm is not None else [spilled]
+        self.spill = None
+
+        error = None
+        if self.rank == 0:
+            missing = [path for paths in spilled for path in paths.values() if not os.path.exists(path)]
+            if missing:
+                error = (f"{len(missing)} spill files of the workers are not visible on the master "
+                         f"(e.g. {missing[0]}); out-of-core ingest needs a shared filesystem")
+        if self.comm is not None:
+            error = self.comm.bcast(error, root=0)
+        if error is not None:
+            raise RuntimeError(error)
+        if self.rank == 0:
+            with tracer.span("build column store", "ingest"):
+                build_column_store(spilled, num_buckets)
 
     def master_process_data_loading(self):
-            csv_files = [f"database/test_result_2022/{f}" for f in os.listdir('database/test_result_2022') if
-                         f.endswith('.csv')]
+            csv_files = self.list_csv_files()
             num_files = len(csv_files)
+            self.progress = IngestProgress(self.comm, self.rank, total_bytes=sum(map(os.path.getsize, csv_files)))
+
+            if self.num_workers == 0 and self.spill is not None:
+                # Started on a single rank out of core: spill the files here
+                rows = sum(self.spill_file(csv_file) for csv_file in csv_files)
+                self.progress.finish()
+                self.progress.print_summary()
+                print(f"Master: Spilled {rows} rows")
+                return None, None
+            if self.num_workers == 0:
+                # Started on a single rank: nobody to hand the files to, so parse them here
+                processed_data = [self.process_file(csv_file, 0) for csv_file in csv_files]
+                self.progress.finish()
+                self.progress.print_summary()
+                return self.create_and_save_data_frames(processed_data)
 
             # Send data to workers
             file_index = 0
@@ -61,8 +281,7 @@ class MasterWorkerDataLoader:
                 index = MPI.Request.Waitany(requests)
 
                 # Receive the processed data from the worker
-                worker_data = self.comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG,
-                                             status=status)  # Corrected line: receive with status
+                worker_data = self.receive_file(status)
                 processed_data.append(worker_data)
 
                 # Get worker rank from the status object
@@ -79,22 +298,59 @@ class MasterWorkerDataLoader:
 
             # Receive the last batch of processed data
             for _ in range(min(self.num_workers, num_files)):
-                worker_data = self.comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG)  # Don't need status here
+                worker_data = self.receive_file(status)
                 processed_data.append(worker_data)
 
-            # Concatenate all processed data
+            # Tell every worker that there are no more files
+            for i in range(1, self.size):
+                self.comm.send(None, dest=i, tag=0)
+            self.progress.wait_for(range(1, self.size))
+            self.progress.print_summary()
+
+            if self.keep_parsed or self.spill is not None:
+                # The workers kept or spilled their rows; processed_data only holds row counts
+                print(f"Master: Workers parsed {sum(processed_data)} rows")
+                return None, None
+            return self.create_and_save_data_frames(processed_data)
+
+    def receive_file(self, status):
+        """Receives the next parsed file from any worker, taking in progress reports that come first."""
+        with tracer.span("recv file", "comm"):
+            while True:
+                message = self.comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
+                if status.Get_tag() != PROGRESS_TAG:
+                    return message
+                self.progress.merge(status.Get_source(), message)
+
+    def backend_process_data_loading(self):
+        """Parses the CSV files on the local process pool of the execution backend."""
+        csv_files = self.list_csv_files()
+        self.progress = IngestProgress(total_bytes=sum(map(os.path.getsize, csv_files)))
+        processed_data = self.backend.load_files(csv_files, self.data_cleaner, self.rows_per_file, self.progress)
+        self.progress.print_summary()
+        return self.create_and_save_data_frames(processed_data)
+
+    def list_csv_files(self):
+        return [f"database/test_result_2022/{f}" for f in os.listdir('database/test_result_2022') if
+                f.endswith('.csv')]
+
+    def create_and_save_data_frames(self, processed_data):
+        """Concatenates the parsed files, builds the vehicle and test DataFrames and caches them."""
+        with tracer.span("build frames", "ingest", files=len(processed_data)):
             combined_df = pd.concat(processed_data, ignore_index=True)
             df_creator = DataFrameCreator()
             vehicle_df, test_df = df_creator.create_data_frames(combined_df)
 
+        with tracer.span("write pickle cache", "serialize"):
             if not os.path.exists("database/local_db"):
                 os.makedirs("database/local_db")
             vehicle_df.to_pickle("database/local_db/vehicle_df.pkl")
             test_df.to_pickle("database/local_db/test_df.pkl")
 
-            return vehicle_df, test_df
+        return vehicle_df, test_df
 
     def worker_process_data_loading(self):
+        self.progress = IngestProgress(self.comm, self.rank)
         while True:
             # Receive a file from the master
             file_to_process = self.comm.recv(source=0, tag=MPI.ANY_TAG)
@@ -103,28 +359,40 @@ class MasterWorkerDataLoader:
                 # No more files to process
                 break
 
+            if self.spill is not None:
+                self.comm.send(self.spill_file(file_to_process), dest=0, tag=self.rank)
+                continue
+
             # Process the file
             local_df = pd.DataFrame()
             df_chunk = self.process_file(file_to_process, 0)
             local_df = pd.concat([local_df, df_chunk], ignore_index=True)
 
+            if self.keep_parsed:
+                self.parsed.append(local_df)
+                self.comm.send(len(local_df), dest=0, tag=self.rank)
+                continue
+
             # Send the processed data back to the master
-            self.comm.send(local_df, dest=0, tag=self.rank)
+            with tracer.span("send file", "comm", rows=len(local_df)):
+                self.comm.send(local_df, dest=0, tag=self.rank)
+        self.progress.finish()
 
     def process_file(self, filename, start_row):
-        data = []
-        with open(filename, 'r') as f:
-            reader = csv.DictReader(f)
-            for i, row in enumerate(reader):
-                if i < start_row:
-                    continue
-                if i >= start_row + self.rows_per_file:
-                    break
-
-                cleaned_row = self.data_cleaner.clean_row(row)
-                data.append(cleaned_row)
-
-                if (i + 1) % 1000 == 0:
-                    print(f"Rank {self.rank}: Processed {i + 1} rows from {filename}")
-
-        return pd.DataFrame(data)
\ No newline at end of file
+        with tracer.span("parse file", "ingest", file=os.path.basename(filename)):
+            return read_csv_file(filename, self.data_cleaner, self.rows_per_file, start_row, self.progress)
+
+    def spill_file(self, filename):
+        """
+        Parses a CSV file in chunks that fit the memory budget and spills each one right away.
+
+        Returns:
+            int: The number of rows spilled.
+        """
+        rows = 0
+        with tracer.span("parse file", "ingest", file=os.path.basename(filename)):
+            for df_chunk in iter_csv_chunks(filename, self.data_cleaner, self.rows_per_file,
+                                            chunk_rows(self.memory_budget), 0, self.progress):
+                self.spill.add(df_chunk)
+                rows += len(df_chunk)
+        return rows
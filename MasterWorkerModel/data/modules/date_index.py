@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Files of a DateIndex saved with a column store, raw int64 like the column files: the bounds of
+# its runs, and the tests' rows and dates in date order
+DATE_INDEX_FILES = {'bounds': "test_date_runs", 'order': "test_date_order", 'dates': "test_date_sorted"}
+
+# int64 nanoseconds of a missing date; it sorts before every real one
+NAT = np.iinfo(np.int64).min
+
+# Dates compared directly in the time the binary searches of one run take; windows whose runs are
+# shorter than that on average are compared instead
+RUN_ROWS = 256
+
+
+def date_values(test_dates):
+    """Test dates as int64 nanoseconds, NAT for missing ones."""
+    return pd.to_datetime(test_dates).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def date_mask(test_dates, start=None, stop=None):
+    """
+    Which test dates lie in [start, stop), comparing every one of them.
+
+    start and stop are Timestamps, None leaving that end open; missing dates never match.
+    """
+    values = date_values(test_dates)
+    mask = values != NAT
+    if start is not None:
+        mask &= values >= start.value
+    if stop is not None:
+        mask &= values < stop.value
+    return mask
+
+
+class DateIndex:
+    """
+    The tests of a partition in test date order, built once when the partition is loaded.
+
+    Tests are numbered as the partition stores them and split into runs of consecutive rows: one
+    per part the column store was written in, a single one elsewhere. Within run i, which covers
+    rows bounds[i]:bounds[i + 1], order holds those rows sorted by date (missing dates first) and
+    dates their dates as int64 nanoseconds, so the tests of a date range are two binary searches
+    per run away. window() restricts the index to the tests of one block without copying it.
+    """
+
+    def __init__(self, bounds, order, dates, start=0, stop=None):
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.order = order
+        self.dates = dates
+        self.start = start  # The window: rows start:stop, which rows() numbers from 0
+        self.stop = int(self.bounds[-1]) if stop is None else stop
+
+    @classmethod
+    def build(cls, values, start=0):
+        """A single run over int64 nanosecond test dates (see date_values) whose first row is start."""
+        order = np.argsort(values, kind='stable')
+        return cls([start, start + len(values)], order + start, values[order])
+
+    def window(self, start, stop):
+        """The index of the tests in rows start:stop."""
+        return DateIndex(self.bounds, self.order, self.dates, start, stop)
+
+    def rows(self, start=None, stop=None):
+        """
+        The window's tests dated in [start, stop), as positions from its first row in no particular order.
+
+        Runs that reach past the window have their matches filtered down to it. When the window
+        spans many short runs, or those matches outnumber its rows, comparing its dates is cheaper
+        and None is returned instead.
+        """
+        low_value = NAT + 1 if start is None else start.value
+        first = max(int(np.searchsorted(self.bounds, self.start, side='right')) - 1, 0)
+        last = int(np.searchsorted(self.bounds, self.stop, side='left'))
+        if (last - first) * RUN_ROWS > self.stop - self.start:
+            return None
+        pieces = []
+        filtered = 0
+        for run in range(first, last):
+            run_start, run_stop = int(self.bounds[run]), int(self.bounds[run + 1])
+            dates = self.dates[run_start:run_stop]
+            low = run_start + int(np.searchsorted(dates, low_value, side='left'))
+            high = run_stop if stop is None else run_start + int(np.searchsorted(dates, stop.value, side='left'))
+            rows = np.asarray(self.order[low:high])
+            if run_start < self.start or run_stop > self.stop:
+                filtered += high - low
+                if filtered > self.stop - self.start:
+                    return None
+                rows = rows[(rows >= self.start) & (rows < self.stop)]
+            pieces.append(rows - self.start)
+        return np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+
+    def mask(self, start, stop, test_dates):
+        """date_mask for the window's tests, whose dates test_dates are, by binary search where that pays off."""
+        rows = self.rows(start, stop)
+        if rows is None:
+            return date_mask(test_dates, start, stop)
+        mask = np.zeros(self.stop - self.start, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def save(self, directory):
+        """Writes the index next to the column store it describes, each file replaced in one step."""
+        for name, filename in DATE_INDEX_FILES.items():
+            path = os.path.join(directory, f"{filename}.bin")
+            np.ascontiguousarray(getattr(self, name), dtype=np.int64).tofile(path + f".{os.getpid()}")
+            os.replace(path + f".{os.getpid()}", path)
+
+    @classmethod
+    def load(cls, directory):
+        """The index saved in directory, mapped rather than read, or None when there is none."""
+        paths = {name: os.path.join(directory, f"{filename}.bin") for name, filename in DATE_INDEX_FILES.items()}
+        if not all(os.path.isfile(path) for path in paths.values()):
+            return None
+        arrays = {name: np.fromfile(path, dtype=np.int64) if name == 'bounds' or os.path.getsize(path) == 0
+                  else np.memmap(path, dtype=np.int64, mode='r') for name, path in paths.items()}
+        return cls(**arrays)
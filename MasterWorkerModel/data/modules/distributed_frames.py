@@ -0,0 +1,194 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data.modules.data_frames import DataFrameCreator
+from data.modules.date_index import DateIndex, date_values
+from data.modules.zone_maps import ZoneMap
+from tracing import tracer
+
+SHARD_DIR = "database/local_db/shards"
+
+
+def owner_ranks(vehicle_ids, owners):
+    """
+    The rank (or spill bucket) owning each vehicle_id: a stable hash of the id picks one of owners.
+
+    The hash does not depend on the process, so every rank sends a vehicle to the same owner.
+    """
+    hashes = pd.util.hash_pandas_object(pd.Series(vehicle_ids).astype(str), index=False).to_numpy()
+    return np.asarray(owners)[hashes % np.uint64(len(owners))]
+
+
+def shard_directory(size, owners, rank, directory=SHARD_DIR):
+    """Where a rank caches its shard; shards are only valid for the same ranks and owners."""
+    return os.path.join(directory, f"ranks{size}_owners{len(owners)}", f"rank{rank}")
+
+
+class DistributedDataFrameCreator(DataFrameCreator):
+    """
+    Builds the vehicle and test DataFrames in parallel, leaving every owner rank with a shard.
+
+    Each rank first deduplicates the vehicles of the rows it parsed itself. Vehicles and tests are
+    then sent to the owner of their vehicle_id (see owner_ranks) in one all-to-all per table, and
+    each owner deduplicates the vehicles it received. The tests of a vehicle end up on the same
+    rank as the vehicle, so a shard can be searched on its own. Receiving in rank order keeps the
+    first row of a vehicle the same as when rank 0 concatenated everything.
+    """
+
+    def __init__(self, comm, owners=None):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.owners = list(owners) if owners is not None else list(range(self.size))
+
+    def exchange(self, df):
+        """Collective: sends every row to the owner of its vehicle_id and returns the rows received."""
+        parts = [None] * self.size
+        if 'vehicle_id' in df.columns:
+            owners = owner_ranks(df['vehicle_id'], self.owners)
+            for owner in self.owners:
+                parts[owner] = df[owners == owner]
+        with tracer.span("exchange rows", "comm", rows=len(df)):
+            received = [part for part in self.comm.alltoall(parts) if part is not None]
+        return pd.concat(received, ignore_index=True) if received else pd.DataFrame()
+
+    def create_data_frames(self, df):
+        """
+        Collective: builds this rank's shard of the vehicle and test DataFrames.
+
+        Args:
+            df (pd.DataFrame): The cleaned rows this rank parsed (may be empty).
+
+        Returns:
+            tuple: (vehicle_df, test_df) holding the vehicles owned by this rank and all their tests.
+        """
+        with tracer.span("build local frames", "ingest", rows=len(df)):
+            if 'vehicle_id' in df.columns:
+                vehicle_df, test_df = self.create_vehicle_df(df), self.create_test_df(df)
+            else:
+                vehicle_df = test_df = pd.DataFrame()
+
+        vehicle_df = self.exchange(vehicle_df)
+        test_df = self.exchange(test_df)
+        if 'vehicle_id' in vehicle_df.columns:
+            with tracer.span("deduplicate vehicles", "ingest", rows=len(vehicle_df)):
+                vehicle_df = self.create_vehicle_df(vehicle_df)
+
+        print(f"Rank {self.rank}: Built shard with {len(vehicle_df)} vehicles and {len(test_df)} tests")
+        return vehicle_df, test_df
+
+
+class DistributedFrames:
+    """
+    One rank's shard of the vehicle and test tables, kept in memory and cached on disk per rank.
+
+    Offers the frames/holds/rank_range/local_frames interface of NodeSharedFrames with every rank
+    as a node of its own: global vehicle rows are numbered shard after shard in rank order, and a
+    rank can only read the rows of its own shard. Every rank summarises its shard in a ZoneMap and
+    gets those of all shards, so any rank can tell which rows a search may match, and sorts its
+    tests by date once into a DateIndex.
+    """
+
+    # Rows of one domain cannot be served to ranks of another: only their owner holds them
+    cross_domain = False
+    # The shard is in memory already, so it is scanned as a single block
+    block_rows = None
+
+    def __init__(self, comm, vehicle_df, test_df, owners=None):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.owners = list(owners) if owners is not None else list(range(self.size))
+        if 'vehicle_id' in vehicle_df.columns:
+            vehicle_df, test_df, test_offsets = DataFrameCreator().align_by_vehicle(vehicle_df, test_df)
+        else:
+            test_offsets = np.zeros(1, dtype=np.int64)
+        self.vehicle_df = vehicle_df
+        self.test_df = test_df
+        self.test_offsets = test_offsets
+
+        counts = comm.allgather(len(vehicle_df))
+        bounds = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.node_ranges = [(int(bounds[r]), int(bounds[r + 1])) for r in range(self.size)]
+        self.rank_nodes = list(range(self.size))
+        self.node_range = self.node_ranges[self.rank]
+        self.num_vehicles = int(bounds[-1])
+
+        zone_map = None
+        if 'vehicle_id' in vehicle_df.columns:
+            zone_map = ZoneMap.build(vehicle_df, test_df, test_offsets, start=self.node_range[0])
+        self.zone_map = ZoneMap.concat(comm.allgather(zone_map))
+        self._date_index = DateIndex.build(date_values(test_df['test_date'])) if 'test_date' in test_df.columns else None
+
+    @classmethod
+    def open(cls, comm, owners=None, directory=SHARD_DIR):
+        """
+        Collective: loads every rank's cached shard.
+
+        Returns:
+            DistributedFrames: The shards, or None on every rank when any rank lacks its own.
+        """
+        size = comm.Get_size()
+        owners = list(owners) if owners is not None else list(range(size))
+        path = shard_directory(size, owners, comm.Get_rank(), directory)
+        visible = os.path.isfile(os.path.join(path, "test_df.pkl"))
+        if not all(comm.allgather(visible)):
+            return None
+        with tracer.span("load shard", "ingest"):
+            vehicle_df = pd.read_pickle(os.path.join(path, "vehicle_df.pkl"))
+            test_df = pd.read_pickle(os.path.join(path, "test_df.pkl"))
+        print(f"Rank {comm.Get_rank()}: Loaded shard with {len(vehicle_df)} vehicles from {path}")
+        return cls(comm, vehicle_df, test_df, owners)
+
+    def save(self, directory=SHARD_DIR):
+        """Caches this rank's shard; test_df is written last and marks the shard as complete."""
+        path = shard_directory(self.size, self.owners, self.rank, directory)
+        os.makedirs(path, exist_ok=True)
+        with tracer.span("write shard", "serialize", rows=len(self.vehicle_df)):
+            self.vehicle_df.to_pickle(os.path.join(path, "vehicle_df.pkl"))
+            self.test_df.to_pickle(os.path.join(path, "test_df.pkl"))
+
+    def frames(self, start, stop):
+        """
+        A global vehicle row range of this rank's shard, with the matching tests.
+
+        Returns:
+            tuple: (vehicle_df, test_df) sliced from the shard without copying.
+        """
+        node_start = self.node_range[0]
+        start, stop = start - node_start, stop - node_start
+        test_start, test_stop = self.test_offsets[start], self.test_offsets[stop]
+        return self.vehicle_df.iloc[start:stop], self.test_df.iloc[test_start:test_stop]
+
+    def date_index(self, start, stop):
+        """The DateIndex of the tests of a global vehicle row range of this rank's shard, or None without test dates."""
+        if self._date_index is None:
+            return None
+        node_start = self.node_range[0]
+        return self._date_index.window(int(self.test_offsets[start - node_start]),
+                                       int(self.test_offsets[stop - node_start]))
+
+    def holds(self, start, stop):
+        """Whether a global vehicle row range lies inside this rank's shard."""
+        return self.node_range[0] <= start and stop <= self.node_range[1]
+
+    def rank_range(self, exclude_root=False):
+        """This rank scans its whole shard."""
+        return self.node_range
+
+    def local_frames(self):
+        return self.vehicle_df, self.test_df
+
+    def blocks(self, start, stop):
+        return [self.frames(start, stop)]
+
+    def block_ranges(self, start, stop):
+        return [(start, stop)]
+
+    def local_blocks(self):
+        return [self.local_frames()]
+
+    def free(self):
+        pass
@@ -0,0 +1,129 @@
+import time
+
+try:
+    from mpi4py import MPI
+except ImportError:  # The shared-memory backend runs without MPI
+    MPI = None
+
+# Tag of progress messages; above any rank or file index the loaders use as a tag
+PROGRESS_TAG = 32000
+
+
+class IngestProgress:
+    """
+    Ingest progress counters of one rank, combined into a single view on rank 0.
+
+    Parse loops report every few rows through update(), which only adds to the counters until
+    interval seconds have passed. Then a rank sends rank 0 its running totals (rows, bytes and bad
+    values per column) in one small message, and rank 0 prints one line for all ranks with the
+    rows per second and an ETA based on the bytes left to read.
+
+    Every rank other than 0 that reported must call finish(), and rank 0 must call wait_for() on
+    those ranks before it moves on, so that no progress message is left unreceived.
+    """
+
+    def __init__(self, comm=None, rank=0, total_bytes=0, interval=2.0):
+        self.comm = comm
+        self.rank = rank
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.rows = 0
+        self.bytes = 0
+        self.files = 0
+        self.bad = {}
+        self.ranks = {}  # Rank 0: the latest totals of every rank
+        self.finished = set()
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def update(self, rows, bytes_read, bad_values=None):
+        """Adds rows and bytes parsed since the last call; bad_values are the cleaner's running totals."""
+        self.rows += rows
+        self.bytes += bytes_read
+        if bad_values is not None:
+            self.bad = bad_values
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def file_done(self):
+        self.files += 1
+
+    def totals(self, done=False):
+        return {'rows': self.rows, 'bytes': self.bytes, 'files': self.files, 'bad': dict(self.bad), 'done': done}
+
+    def report(self):
+        """Sends this rank's totals to rank 0, or on rank 0 takes in what arrived and prints the view."""
+        if self.rank != 0:
+            self.comm.send(self.totals(), dest=0, tag=PROGRESS_TAG)
+            return
+        self.ranks[0] = self.totals()
+        self.poll()
+        print(self.format_view())
+
+    def finish(self):
+        """Sends the final totals to rank 0 (rank 0 itself only records them)."""
+        if self.rank != 0:
+            self.comm.send(self.totals(done=True), dest=0, tag=PROGRESS_TAG)
+        else:
+            self.ranks[0] = self.totals(done=True)
+
+    def merge(self, source, totals):
+        """Rank 0: records the totals received from another rank."""
+        self.ranks[source] = totals
+        if totals['done']:
+            self.finished.add(source)
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(self.format_view())
+
+    def poll(self):
+        """Rank 0: takes in every progress message that has already arrived."""
+        if self.comm is None:
+            return
+        status = MPI.Status()
+        while self.comm.iprobe(source=MPI.ANY_SOURCE, tag=PROGRESS_TAG, status=status):
+            source = status.Get_source()
+            self.merge(source, self.comm.recv(source=source, tag=PROGRESS_TAG))
+
+    def wait_for(self, ranks):
+        """Rank 0: receives progress messages until every given rank has finished."""
+        waiting = set(ranks) - self.finished - {0}
+        status = MPI.Status() if waiting else None
+        while waiting:
+            totals = self.comm.recv(source=MPI.ANY_SOURCE, tag=PROGRESS_TAG, status=status)
+            self.merge(status.Get_source(), totals)
+            waiting -= self.finished
+
+    def combined(self):
+        """Rank 0: the totals of all ranks added up."""
+        combined = {'rows': 0, 'bytes': 0, 'files': 0, 'bad': {}}
+        for totals in self.ranks.values():
+            for key in ('rows', 'bytes', 'files'):
+                combined[key] += totals[key]
+            for column, count in totals['bad'].items():
+                combined['bad'][column] = combined['bad'].get(column, 0) + count
+        return combined
+
+    def format_view(self, final=False):
+        combined = self.combined()
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        rate = combined['rows'] / elapsed
+        line = f"Ingest: {combined['rows']:,} rows, {combined['files']} files, {combined['bytes'] / 1e6:.1f} MB"
+        if final:
+            line += f" in {elapsed:.1f}s ({rate:,.0f} rows/s)"
+        else:
+            line += f" from {len(self.ranks)} ranks, {rate:,.0f} rows/s"
+            if self.total_bytes and combined['bytes']:
+                remaining = max(self.total_bytes - combined['bytes'], 0)
+                line += (f", {100 * combined['bytes'] / self.total_bytes:.0f}% of "
+                         f"{self.total_bytes / 1e6:.1f} MB, ETA {remaining * elapsed / combined['bytes']:.0f}s")
+        if combined['bad']:
+            line += "; bad values: " + ", ".join(f"{column} {count}" for column, count in sorted(combined['bad'].items()))
+        return line
+
+    def print_summary(self):
+        """Rank 0: prints the final line once every rank has finished."""
+        print(self.format_view(final=True))
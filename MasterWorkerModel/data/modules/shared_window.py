@@ -0,0 +1,191 @@
+import numpy as np
+from mpi4py import MPI
+
+from data.modules.column_store import encode_columns, decode_columns
+from data.modules.data_frames import DataFrameCreator
+from data.modules.date_index import DateIndex
+from data.modules.zone_maps import ZoneMap
+from tracing import tracer
+
+
+class NodeSharedFrames:
+    """
+    Keeps one copy per node of the vehicle and test columns in MPI shared-memory windows.
+
+    COMM_WORLD is split by host. Rank 0 aligns the frames by vehicle_id, cuts them into one
+    contiguous vehicle row range per node and sends each node leader only that node's columns.
+    The leader places them in a single MPI.Win.Allocate_shared window, and every other rank on the
+    host maps the same memory instead of receiving its own pickled chunk. Every rank also gets the
+    ZoneMap of all rows, which rank 0 builds while encoding, and the window holds the DateIndex of
+    the node's tests next to their columns.
+    """
+
+    # Rank 0 keeps the full frames, so rows of one node can still be shipped to ranks of another
+    cross_domain = True
+    # The node's copy is in memory already, so a share is scanned as a single block
+    block_rows = None
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=self.rank)
+        self.node_rank = self.node_comm.Get_rank()
+        self.node_size = self.node_comm.Get_size()
+        # One leader per node; the leaders carry all cross-node traffic
+        self.leader_comm = comm.Split(0 if self.node_rank == 0 else MPI.UNDEFINED, key=self.rank)
+
+        self.node_id = self.node_comm.bcast(
+            self.leader_comm.Get_rank() if self.node_rank == 0 else None, root=0)
+        self.rank_nodes = comm.allgather(self.node_id)  # node id of every rank
+
+        self.window = None
+        self.arrays = None
+        self.meta = None
+        self.node_range = (0, 0)    # global vehicle rows held by this node
+        self.node_ranges = None     # global vehicle rows of every node, indexed by node id
+        self.zone_map = None
+        self._date_index = None
+        self._local_frames = None
+
+    def distribute(self, vehicle_df, test_df, exclude_root=False):
+        """
+        Collective: moves rank 0's frames into the per-node windows.
+
+        Args:
+            vehicle_df (pd.DataFrame): The full vehicle DataFrame (rank 0 only).
+            test_df (pd.DataFrame): The full test DataFrame (rank 0 only).
+            exclude_root (bool): Leave rank 0 out when sizing node shares, for master-worker runs
+                where rank 0 does not scan.
+        """
+        scanners = self.node_size - (1 if exclude_root and self.rank == 0 else 0)
+        weights = self.leader_comm.gather(scanners, root=0) if self.node_rank == 0 else None
+
+        payloads = None
+        zone_map = None
+        if self.rank == 0:
+            with tracer.span("encode windows", "partition", rows=len(vehicle_df)):
+                vehicle_df, test_df, test_offsets = DataFrameCreator().align_by_vehicle(vehicle_df, test_df)
+                vehicle_arrays, vehicle_meta = encode_columns(vehicle_df)
+                test_arrays, test_meta = encode_columns(test_df)
+                zone_map = ZoneMap.build(vehicle_df, test_df, test_offsets)
+
+            bounds = np.concatenate(([0], np.cumsum(weights))) * len(vehicle_df) // max(1, sum(weights))
+            self.node_ranges = [(int(bounds[i]), int(bounds[i + 1])) for i in range(len(weights))]
+
+            payloads = []
+            for start, stop in self.node_ranges:
+                test_start, test_stop = test_offsets[start], test_offsets[stop]
+                arrays = {f"vehicle/{column}": values[start:stop] for column, values in vehicle_arrays.items()}
+                arrays.update({f"test/{column}": values[test_start:test_stop]
+                               for column, values in test_arrays.items()})
+                arrays['test_offsets'] = test_offsets[start:stop + 1] - test_start
+                if test_meta['kinds'].get('test_date') == 'datetime':
+                    date_index = DateIndex.build(test_arrays['test_date'][test_start:test_stop])
+                    arrays['test_date_order'], arrays['test_date_sorted'] = date_index.order, date_index.dates
+                payloads.append({'arrays': arrays, 'vehicle_meta': vehicle_meta, 'test_meta': test_meta,
+                                 'node_range': (start, stop)})
+
+        with tracer.span("scatter windows", "comm"):
+            payload = self.leader_comm.scatter(payloads, root=0) if self.node_rank == 0 else None
+        with tracer.span("fill windows", "partition"):
+            self._allocate(payload)
+        self.node_range = self.node_comm.bcast(payload['node_range'] if payload else None, root=0)
+        self.node_ranges = self.comm.bcast(self.node_ranges, root=0)
+        self.zone_map = self.comm.bcast(zone_map, root=0)
+        self._local_frames = None
+
+    def _allocate(self, payload):
+        """Creates the node window on the leader, fills it, and maps it on every rank of the node."""
+        layout = None
+        total = 0
+        if self.node_rank == 0:
+            layout = {}
+            for name, values in payload['arrays'].items():
+                layout[name] = (total, values.dtype.str, len(values))
+                total += (values.nbytes + 7) // 8 * 8
+            layout = (layout, payload['vehicle_meta'], payload['test_meta'])
+        layout = self.node_comm.bcast(layout, root=0)
+
+        self.free()
+        self.window = MPI.Win.Allocate_shared(max(total, 1) if self.node_rank == 0 else 0, 1,
+                                              comm=self.node_comm)
+        buffer, _ = self.window.Shared_query(0)
+
+        offsets, vehicle_meta, test_meta = layout
+        self.arrays = {name: np.ndarray((length,), dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+                       for name, (offset, dtype, length) in offsets.items()}
+        if self.node_rank == 0:
+            for name, values in payload['arrays'].items():
+                self.arrays[name][:] = values
+        self.node_comm.Barrier()
+
+        self.meta = {'vehicle': vehicle_meta, 'test': test_meta}
+        order = self.arrays.get('test_date_order')
+        if order is not None:
+            self._date_index = DateIndex([0, len(order)], order, self.arrays['test_date_sorted'])
+
+    def _table(self, table):
+        prefix = f"{table}/"
+        return {name[len(prefix):]: values for name, values in self.arrays.items() if name.startswith(prefix)}
+
+    def frames(self, start, stop):
+        """
+        Decodes a global vehicle row range held by this node, with the matching tests.
+
+        Returns:
+            tuple: (vehicle_df, test_df) built over the shared window without copying the columns.
+        """
+        node_start = self.node_range[0]
+        start, stop = start - node_start, stop - node_start
+        test_offsets = self.arrays['test_offsets']
+        vehicle_df = decode_columns(self._table('vehicle'), self.meta['vehicle'], start, stop)
+        test_df = decode_columns(self._table('test'), self.meta['test'], test_offsets[start], test_offsets[stop])
+        return vehicle_df, test_df
+
+    def date_index(self, start, stop):
+        """The DateIndex of the tests of a global vehicle row range held by this node, or None without test dates."""
+        if self._date_index is None:
+            return None
+        node_start = self.node_range[0]
+        test_offsets = self.arrays['test_offsets']
+        return self._date_index.window(int(test_offsets[start - node_start]), int(test_offsets[stop - node_start]))
+
+    def holds(self, start, stop):
+        """Whether a global vehicle row range lies inside this node's window."""
+        return self.node_range[0] <= start and stop <= self.node_range[1]
+
+    def rank_range(self, exclude_root=False):
+        """The disjoint share of this node's vehicle rows scanned by this rank."""
+        start, stop = self.node_range
+        scanners = list(range(self.node_size))
+        if exclude_root and self.node_id == 0:
+            scanners = scanners[1:]
+        if self.node_rank not in scanners:
+            return start, start
+        index = scanners.index(self.node_rank)
+        rows = stop - start
+        return start + rows * index // len(scanners), start + rows * (index + 1) // len(scanners)
+
+    def local_frames(self):
+        """The frames over this rank's own share, decoded once and cached."""
+        if self._local_frames is None:
+            self._local_frames = self.frames(*self.rank_range())
+        return self._local_frames
+
+    def blocks(self, start, stop):
+        return [self.frames(start, stop)]
+
+    def block_ranges(self, start, stop):
+        return [(start, stop)]
+
+    def local_blocks(self):
+        return [self.local_frames()]
+
+    def free(self):
+        if self.window is not None:
+            self.arrays = None
+            self._date_index = None
+            self._local_frames = None
+            self.window.Free()
+            self.window = None
+
@@ -0,0 +1,106 @@
+import math
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from data.modules.column_store import ColumnStoreWriter
+from data.modules.data_frames import DataFrameCreator
+from data.modules.distributed_frames import owner_ranks
+from tracing import tracer
+
+SPILL_DIR = "database/local_db/spill"
+
+# Parsed DataFrames take about this many bytes per byte of CSV, mostly in Python strings
+FRAME_BYTES_PER_CSV_BYTE = 8
+# Turning a bucket into vehicle and test tables holds about this many copies of its rows at once
+BUILD_COPIES = 3
+# Bytes per row while a chunk is parsed: the cleaned dicts plus the DataFrame made from them
+PARSED_ROW_BYTES = 2000
+
+
+def bucket_count(total_csv_bytes, memory_budget):
+    """How many buckets the rows are spilled into, so that building any one fits in memory_budget bytes."""
+    return max(1, math.ceil(total_csv_bytes * FRAME_BYTES_PER_CSV_BYTE * BUILD_COPIES / memory_budget))
+
+
+def chunk_rows(memory_budget):
+    """Rows parsed before they are spilled, keeping a parse chunk to a quarter of memory_budget bytes."""
+    return max(1000, int(memory_budget / 4 / PARSED_ROW_BYTES))
+
+
+class SpillWriter:
+    """
+    Spills one rank's parsed rows into hash buckets on disk.
+
+    Every row goes to the bucket its vehicle_id hashes to, so a bucket holds all rows of its
+    vehicles and can be turned into vehicle and test tables on its own. A bucket file is a
+    sequence of pickled DataFrames, appended one parse chunk at a time.
+    """
+
+    def __init__(self, rank, num_buckets, directory=SPILL_DIR):
+        self.path = os.path.join(directory, f"rank{rank}")
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+        self.num_buckets = num_buckets
+        self.files = {}
+        self.rows = 0
+
+    def add(self, df):
+        if df.empty:
+            return
+        with tracer.span("spill chunk", "serialize", rows=len(df)):
+            buckets = owner_ranks(df['vehicle_id'], range(self.num_buckets))
+            for bucket in np.unique(buckets):
+                if bucket not in self.files:
+                    self.files[bucket] = open(os.path.join(self.path, f"bucket{bucket}.pkl"), 'ab')
+                pickle.dump(df[buckets == bucket], self.files[bucket], protocol=pickle.HIGHEST_PROTOCOL)
+        self.rows += len(df)
+
+    def close(self):
+        """Closes the bucket files and returns their paths by bucket number."""
+        for f in self.files.values():
+            f.close()
+        paths = {int(bucket): f.name for bucket, f in self.files.items()}
+        self.files = {}
+        return paths
+
+
+def read_bucket(paths):
+    """Reads the spilled chunks of one bucket from several ranks' files, in the order given."""
+    frames = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    frames.append(pickle.load(f))
+                except EOFError:
+                    break
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def build_column_store(spilled, num_buckets, directory=SPILL_DIR):
+    """
+    Builds the column store from the spilled buckets with only one bucket in memory at a time.
+
+    Args:
+        spilled (list): For every rank in rank order, the {bucket: path} dict its SpillWriter
+            returned. Within a bucket rows keep the order the ranks parsed them in.
+        num_buckets (int): The number of buckets the rows were spilled into.
+        directory (str): The spill directory, removed once the store is written.
+    """
+    writer = ColumnStoreWriter()
+    creator = DataFrameCreator()
+    for bucket in range(num_buckets):
+        df = read_bucket([paths[bucket] for paths in spilled if bucket in paths])
+        if df is None:
+            continue
+        with tracer.span("build bucket", "ingest", bucket=bucket, rows=len(df)):
+            vehicle_df, test_df = creator.create_vehicle_df(df), creator.create_test_df(df)
+            del df
+            writer.append(vehicle_df, test_df)
+        print(f"Bucket {bucket + 1}/{num_buckets}: {len(vehicle_df)} vehicles, {len(test_df)} tests")
+    writer.close()
+    shutil.rmtree(directory, ignore_errors=True)
@@ -1,8 +1,11 @@
 import sys
+import os
+import time
+from datetime import date
 
 from PyQt5.QtWidgets import (
     QWidget, QHBoxLayout, QVBoxLayout, QGroupBox, QMessageBox, QLabel, QLineEdit, QTableView, QAbstractItemView,
-    QPushButton, QRadioButton, QScrollArea
+    QPushButton, QRadioButton, QScrollArea, QComboBox, QFileDialog
 )
 import mpi4py as MPI
 from PyQt5.QtCore import Qt
@@ -12,20 +15,26 @@ from gui.components.search_criteria import SearchCriteriaGroup
 from gui.components.analysis_type import AnalysisTypeGroup
 from gui.components.results_display import ResultsGroup
 from gui.components.plot_view import PlotGroup
-from gui.utils import PandasModel, draw_figure, MatplotlibCanvas
-from analysis.search_analysis import SearchAnalyzer
+from gui.components.query_stats import QueryStatsGroup
+from gui.utils import (
+    PandasModel, draw_figure, draw_quantiles, draw_ranking, draw_distinct, draw_regional, MatplotlibCanvas
+)
+from analysis.search_analysis import SearchAnalyzer, QueryError
 from gui.styles import app_style_sheet  # Import the stylesheet
 from gui.components.plot_view import PlotGroup, MatplotlibCanvas
 
 
 class MainWindow(QWidget):
-    def __init__(self, comm, rank, size, vehicle_df, test_df):
+    def __init__(self, comm, rank, size, vehicle_df, test_df, backend=None, partition=None, service=None,
+                 completion=None):
         super().__init__()
 
         self.comm = comm
         self.rank = rank
         self.size = size
-        self.search_analyzer = SearchAnalyzer(comm, rank, size)
+        # With the query service running, the window is one more client of its engine
+        self.service = service
+        self.search_analyzer = service.search_analyzer if service else SearchAnalyzer(comm, rank, size, backend, partition)
         self.vehicle_df = vehicle_df
         self.test_df = test_df
 
@@ -34,10 +43,11 @@ class MainWindow(QWidget):
         self.setWindowTitle("MOT Data Analysis")
 
         # --- Components ---
-        self.search_group = SearchCriteriaGroup(self.search)
+        self.search_group = SearchCriteriaGroup(self.search, completion)
         self.analysis_type_group = AnalysisTypeGroup()
         self.results_group = ResultsGroup()
         self.plot_group = PlotGroup()
+        self.stats_group = QueryStatsGroup()
 
         # --- Analysis Mode Toggle ---
         self.analysis_mode_button = QPushButton("Analysis Mode")
@@ -51,6 +61,17 @@ class MainWindow(QWidget):
         sidebar_layout.addWidget(self.analysis_mode_button)  # Add analysis mode toggle here
         sidebar_layout.addWidget(self.analysis_type_group)  # Analysis options below search
 
+        # --- Export: the workers write the rows matching the form to files ---
+        export_layout = QHBoxLayout()
+        self.export_format_combo = QComboBox()
+        for label, export_format in (("CSV", "csv"), ("Columnar (.npz)", "npz")):
+            self.export_format_combo.addItem(label, export_format)
+        export_button = QPushButton("Export Results...")
+        export_button.clicked.connect(self.export_results)
+        export_layout.addWidget(self.export_format_combo)
+        export_layout.addWidget(export_button)
+        sidebar_layout.addLayout(export_layout)
+
         # --- Close Button ---
         close_button = QPushButton("Close")
         close_button.clicked.connect(self.force_close)
@@ -73,6 +94,7 @@ class MainWindow(QWidget):
         results_layout = QVBoxLayout()  # Vertical layout for stacked results and plot
         results_layout.addWidget(self.results_group)
         results_layout.addWidget(self.plot_group)
+        results_layout.addWidget(self.stats_group)
 
         # Add Results and Plot to the right side
         main_layout.addLayout(results_layout)
@@ -89,58 +111,126 @@ class MainWindow(QWidget):
         else:
             self.analysis_mode_button.setText("Analysis Mode OFF")
 
+    def read_criteria(self):
+        """The search keys filled in on the form, or None after telling the user what is wrong."""
+        make = self.search_group.make_edit.text()
+        model = self.search_group.model_edit.text()
+        try:
+            year = int(self.search_group.year_edit.text()) if self.search_group.year_edit.text() else None
+        except ValueError:
+            QMessageBox.warning(self, "Input Error", "Year must be a number.")
+            return None
+
+        try:
+            min_mileage = int(
+                self.search_group.min_mileage_edit.text()) if self.search_group.min_mileage_edit.text() else None
+        except ValueError:
+            QMessageBox.warning(self, "Input Error", "Minimum mileage must be a number.")
+            return None
+
+        try:
+            max_mileage = int(
+                self.search_group.max_mileage_edit.text()) if self.search_group.max_mileage_edit.text() else None
+        except ValueError:
+            QMessageBox.warning(self, "Input Error", "Maximum mileage must be a number.")
+            return None
+
+        if min_mileage is not None and max_mileage is not None and min_mileage > max_mileage:
+            QMessageBox.warning(self, "Input Error", "Minimum mileage cannot be greater than maximum mileage.")
+            return None
+
+        try:
+            min_test_date, max_test_date = (
+                date.fromisoformat(edit.text().strip()).isoformat() if edit.text().strip() else None
+                for edit in (self.search_group.min_test_date_edit, self.search_group.max_test_date_edit))
+        except ValueError:
+            QMessageBox.warning(self, "Input Error", "Test dates must be given as YYYY-MM-DD.")
+            return None
+
+        if min_test_date and max_test_date and min_test_date > max_test_date:
+            QMessageBox.warning(self, "Input Error", "The first test date cannot be after the last one.")
+            return None
+
+        # Package search criteria into a dictionary
+        return {
+            'make': make,
+            'model': model,
+            'year': year,
+            'min_mileage': min_mileage,
+            'max_mileage': max_mileage,
+            'min_test_date': min_test_date,
+            'max_test_date': max_test_date
+        }
+
     def search(self):
         # Only the master node (rank 0) gathers input and starts the search process
         if self.rank == 0:
-            make = self.search_group.make_edit.text()
-            model = self.search_group.model_edit.text()
-            try:
-                year = int(self.search_group.year_edit.text()) if self.search_group.year_edit.text() else None
-            except ValueError:
-                QMessageBox.warning(self, "Input Error", "Year must be a number.")
+            search_criteria = self.read_criteria()
+            if search_criteria is None:
                 return None
-
-            try:
-                min_mileage = int(
-                    self.search_group.min_mileage_edit.text()) if self.search_group.min_mileage_edit.text() else None
-            except ValueError:
-                QMessageBox.warning(self, "Input Error", "Minimum mileage must be a number.")
-                return None
-
+            lookup_id = self.search_group.lookup_edit.text().strip()
+            if lookup_id:
+                search_criteria[self.search_group.lookup_field_combo.currentData()] = lookup_id
+            # Aggregate analyses run on the workers; the search then returns their summary, not the rows
+            aggregate = self.analysis_type_group.aggregate() if self.analysis_mode_button.isChecked() else None
+            if aggregate is not None and not lookup_id:
+                search_criteria['aggregate'] = aggregate
+
+            # Master process performs search using dynamic mapping (or the local backend)
             try:
-                max_mileage = int(
-                    self.search_group.max_mileage_edit.text()) if self.search_group.max_mileage_edit.text() else None
-            except ValueError:
-                QMessageBox.warning(self, "Input Error", "Maximum mileage must be a number.")
+                if self.service is not None:
+                    results, stats = self.service.search_with_stats(search_criteria)
+                else:
+                    results, stats = self.search_analyzer.search_with_stats(self.vehicle_df, self.test_df,
+                                                                            search_criteria)
+            except QueryError as e:
+                QMessageBox.critical(self, "Search Error", f"The search could not be completed: {e}")
                 return None
 
-            if min_mileage is not None and max_mileage is not None and min_mileage > max_mileage:
-                QMessageBox.warning(self, "Input Error", "Minimum mileage cannot be greater than maximum mileage.")
-                return None
-
-            # Package search criteria into a dictionary
-            search_criteria = {
-                'make': make,
-                'model': model,
-                'year': year,
-                'min_mileage': min_mileage,
-                'max_mileage': max_mileage
-            }
-
-            # Master process performs search using dynamic mapping
-            results = self.search_analyzer.master_process(self.vehicle_df, self.test_df, search_criteria)
-
             # Display results and perform analysis
-            if results is not None and not results.empty:
+            render_started = time.perf_counter()
+            found = results is not None and not results.empty
+            if found:
                 model = PandasModel(results)
                 self.results_group.table.setModel(model)
 
                 # If Analysis Mode is ON, perform analysis and display plot
-                if self.analysis_mode_button.isChecked():
+                if 'aggregate' in search_criteria:
+                    self.display_aggregate(search_criteria, results)
+                elif self.analysis_mode_button.isChecked():
                     self.analyze_and_display(search_criteria, results)
-            else:
+            stats.add_time("render", time.perf_counter() - render_started)
+            self.stats_group.add(search_criteria, stats)
+            if not found:
                 QMessageBox.information(self, "Search Results", "No results found.")
 
+    def export_results(self):
+        """
+        Exports the rows matching the form into a chosen directory. Every worker writes its own
+        share, so the rows never pass through this process; a manifest lists the files.
+        """
+        search_criteria = self.read_criteria()
+        if search_criteria is None:
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Export Results To")
+        if not directory:
+            return
+        if not os.access(directory, os.W_OK):
+            QMessageBox.warning(self, "Export Error", f"{directory} is not writable.")
+            return
+        search_criteria['export'] = {'directory': directory, 'format': self.export_format_combo.currentData()}
+        try:
+            if self.service is not None:
+                results, stats = self.service.search_with_stats(search_criteria)
+            else:
+                results, stats = self.search_analyzer.search_with_stats(self.vehicle_df, self.test_df, search_criteria)
+        except QueryError as e:
+            QMessageBox.critical(self, "Export Error", f"The export could not be completed: {e}")
+            return
+        self.stats_group.add(search_criteria, stats)
+        QMessageBox.information(self, "Export", f"Exported {int(results['rows'].sum())} rows to "
+                                                f"{len(results)} files in {directory}.")
+
     def analyze_and_display(self, search_criteria, results):
         analysis_type = (
             "age" if self.analysis_type_group.analysis_age_radio.isChecked() else "mileage"
@@ -167,6 +257,21 @@ class MainWindow(QWidget):
         else:
             QMessageBox.information(self, "Analysis Results", "Could not generate analysis results.")
 
+    def display_aggregate(self, search_criteria, results):
+        """Plots the summary an aggregate search returned."""
+        name = search_criteria['aggregate']['name']
+        if name == 'mileage_quantiles':
+            draw_quantiles(self.plot_group.plot_canvas, results,
+                           search_criteria.get("make"), search_criteria.get("model"))
+        elif name == 'top_pass_rates':
+            draw_ranking(self.plot_group.plot_canvas, results, search_criteria['aggregate']['order'])
+        elif name == 'distinct_vehicles':
+            draw_distinct(self.plot_group.plot_canvas, results,
+                          search_criteria.get("make"), search_criteria.get("model"))
+        elif name == 'regional_pass_rates':
+            draw_regional(self.plot_group.plot_canvas, results, search_criteria['aggregate']['sort_by'],
+                          search_criteria.get("make"), search_criteria.get("model"))
+
     def force_close(self):
         """Forcefully close the application by terminating all processes."""
         # if self.rank == 0:
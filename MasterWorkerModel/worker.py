@@ -0,0 +1,13 @@
+from analysis.search_analysis import SearchAnalyzer
+
+
+def worker_main(comm, rank, size, vehicle_df, test_df, partition=None):
+    """
+    Headless entry point for worker ranks.
+
+    Workers never show a window, so only the data and analysis layers are imported here; PyQt5
+    and Matplotlib are left to rank 0.
+    """
+    print(f"Worker {rank} started")  # Print when a worker starts
+    search_analyzer = SearchAnalyzer(comm, rank, size, partition=partition)
+    search_analyzer.worker_process(vehicle_df, test_df)
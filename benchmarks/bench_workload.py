@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = ('DataParallelModel', 'MasterWorkerModel')
+
+# Searches in the shape MainWindow.search builds, spread over popular and rare values
+QUERIES = [
+    {'make': 'ford', 'model': '', 'year': None, 'min_mileage': None, 'max_mileage': None},
+    {'make': 'vauxhall', 'model': 'corsa', 'year': None, 'min_mileage': None, 'max_mileage': None},
+    {'make': 'bmw', 'model': 'x5', 'year': 2015, 'min_mileage': None, 'max_mileage': None},
+    {'make': '', 'model': '', 'year': None, 'min_mileage': 0, 'max_mileage': 20000},
+    {'make': 'toyota', 'model': '', 'year': None, 'min_mileage': 50000, 'max_mileage': 100000},
+    {'make': 'tesla', 'model': 'model 3', 'year': None, 'min_mileage': None, 'max_mileage': None},
+    {'make': '', 'model': '', 'year': 2010, 'min_mileage': None, 'max_mileage': None},
+    {'make': 'ford', 'model': 'focus', 'year': 2012, 'min_mileage': 60000, 'max_mileage': 120000},
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="One benchmark run of a model under mpiexec")
+    parser.add_argument("--model", choices=MODELS, required=True)
+    parser.add_argument("--rows-per-file", type=int, default=10 ** 9, help="Rows read from each CSV file")
+    parser.add_argument("--repeats", type=int, default=3, help="Times every search is repeated")
+    parser.add_argument("--output", required=True, help="JSON file written by rank 0")
+    return parser.parse_args()
+
+
+def barrier_time(comm):
+    """Synchronises the ranks and returns the time, so that phases are timed across all of them."""
+    if comm is not None:
+        comm.Barrier()
+    return time.perf_counter()
+
+
+def main():
+    """
+    Runs ingest, cache load, search and pass-rate analysis of one model in the current directory,
+    which must hold database/test_result_2022, and writes the timings from rank 0.
+    """
+    args = parse_args()
+    sys.path.insert(0, os.path.join(REPO_ROOT, args.model))
+    import pandas as pd
+    import app
+    from analysis.batch_runner import latency_summary
+    from analysis.core import calculate_pass_rate_by_age, calculate_pass_rate_by_mileage
+    from analysis.search_analysis import SearchAnalyzer
+
+    app_args = argparse.Namespace(backend='mpi', processes=None, no_shared_windows=False, distributed_tables=False,
+                                  memory_budget=None)
+    backend, comm, rank, size = app.start_backend(app_args)
+    phases = {}
+
+    # Ingest: parse and clean the CSV files, build the frames and write the caches
+    if rank == 0:
+        shutil.rmtree("database/local_db", ignore_errors=True)
+    started = barrier_time(comm)
+    app.load_data(app_args, backend, comm, rank, size, rows_per_file=args.rows_per_file)
+    phases['ingest_seconds'] = barrier_time(comm) - started
+
+    # Cache load the old way: rank 0 unpickles both frames
+    if rank == 0:
+        started = time.perf_counter()
+        pickled_vehicles = pd.read_pickle("database/local_db/vehicle_df.pkl")
+        pickled_tests = pd.read_pickle("database/local_db/test_df.pkl")
+        phases['pickle_load_seconds'] = time.perf_counter() - started
+        phases['vehicles'], phases['tests'] = len(pickled_vehicles), len(pickled_tests)
+        del pickled_vehicles, pickled_tests
+
+    # Cache load as the application starts now: every rank maps the column store
+    started = barrier_time(comm)
+    vehicle_df, test_df, partition = app.load_data(app_args, backend, comm, rank, size,
+                                                   rows_per_file=args.rows_per_file)
+    phases['cache_load_seconds'] = barrier_time(comm) - started
+
+    if rank != 0:
+        from worker import worker_main
+        worker_main(comm, rank, size, vehicle_df, test_df, partition)
+        return
+
+    search_analyzer = SearchAnalyzer(comm, rank, size, backend, partition)
+    try:
+        latencies = []
+        results = None
+        started = time.perf_counter()
+        for _ in range(args.repeats):
+            for search_criteria in QUERIES:
+                query_started = time.perf_counter()
+                found = search_analyzer.search(vehicle_df, test_df, search_criteria)
+                latencies.append(time.perf_counter() - query_started)
+                if results is None or len(found) > len(results):
+                    results = found
+        elapsed = time.perf_counter() - started
+        phases['search_latency'] = latency_summary(latencies)
+        phases['search_queries_per_second'] = len(latencies) / elapsed if elapsed > 0 else 0.0
+
+        # The same searches as one batch, answered with a shared scan
+        started = time.perf_counter()
+        search_analyzer.search_batch(vehicle_df, test_df, QUERIES)
+        phases['batch_search_seconds'] = time.perf_counter() - started
+
+        # Pass-rate analysis of the largest result
+        started = time.perf_counter()
+        calculate_pass_rate_by_age(results.copy())
+        phases['pass_rate_age_seconds'] = time.perf_counter() - started
+        started = time.perf_counter()
+        calculate_pass_rate_by_mileage(results.copy())
+        phases['pass_rate_mileage_seconds'] = time.perf_counter() - started
+        phases['analysed_rows'] = len(results)
+    finally:
+        if hasattr(search_analyzer, 'terminate_workers'):
+            search_analyzer.terminate_workers()
+        elif size > 1:
+            # Release the workers waiting for the next search criteria
+            comm.bcast(None, root=0)
+
+    with open(args.output, 'w') as f:
+        json.dump({'model': args.model, 'ranks': size, 'queries': len(QUERIES), 'repeats': args.repeats,
+                   **phases}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
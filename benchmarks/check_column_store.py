@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = ('DataParallelModel', 'MasterWorkerModel')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write and read back column stores whose category columns "
+                                                 "outgrow the writer's category lists")
+    parser.add_argument("--model", choices=MODELS, default=MODELS[0])
+    return parser.parse_args()
+
+
+def make_part(first_vehicle, num_vehicles, num_models, seed):
+    """Vehicles with num_models distinct model strings (fewer when there are fewer vehicles), two tests each."""
+    rng = np.random.default_rng(seed)
+    vehicle_ids = np.arange(first_vehicle, first_vehicle + num_vehicles).astype(str)
+    models = pd.Series([f"MODEL {code}" for code in rng.permutation(num_vehicles) % num_models], dtype=object)
+    models[rng.random(num_vehicles) < 0.001] = None
+    vehicle_df = pd.DataFrame({'vehicle_id': vehicle_ids, 'make': rng.choice(['FORD', 'BMW', None], num_vehicles),
+                               'model': models, 'first_use_date': pd.Timestamp('2010-01-01')})
+    test_df = pd.DataFrame({
+        'test_id': np.arange(2 * first_vehicle, 2 * (first_vehicle + num_vehicles)).astype(str),
+        'vehicle_id': np.repeat(vehicle_ids, 2),
+        'test_date': pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 365, 2 * num_vehicles), unit='D'),
+        'test_result': rng.choice(['P', 'F'], 2 * num_vehicles),
+        'test_mileage': rng.integers(0, 200000, 2 * num_vehicles),
+    })
+    return vehicle_df, test_df
+
+
+def without_nulls(df):
+    """The values of a frame as objects with None for every missing one, so NaN and None compare equal."""
+    return df.reset_index(drop=True).astype(object).where(df.reset_index(drop=True).notna(), None)
+
+
+def check(parts, label):
+    """Writes parts through a ColumnStoreWriter and compares the mapped store with them."""
+    from data.modules.column_store import ColumnStoreWriter, MappedColumnStore, categoricals_to_objects
+    from data.modules.data_frames import DataFrameCreator
+
+    with tempfile.TemporaryDirectory() as directory:
+        writer = ColumnStoreWriter(directory)
+        for vehicle_df, test_df in parts:
+            writer.append(vehicle_df, test_df)
+        writer.close()
+        store = MappedColumnStore(directory)
+        stored = [categoricals_to_objects(df.copy()) for df in store.frames(0, store.num_vehicles)]
+        kinds = store.manifest['tables']['vehicle']['kinds']
+
+    aligned = [DataFrameCreator().align_by_vehicle(vehicle_df, test_df)[:2] for vehicle_df, test_df in parts]
+    for index, expected in enumerate(zip(*aligned)):
+        expected = pd.concat(expected, ignore_index=True)
+        pd.testing.assert_frame_equal(without_nulls(stored[index]), without_nulls(expected))
+    print(f"{label}: model stored as {kinds['model']}, make as {kinds['make']}, "
+          f"{len(stored[0])} vehicles read back unchanged")
+    return kinds
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.join(REPO_ROOT, args.model))
+    from data.modules.column_store import MAX_CATEGORIES
+
+    few = MAX_CATEGORIES // 4
+    kinds = check([make_part(0, 2 * few, few, 0), make_part(2 * few, 2 * few, few, 1)], "Within the cap")
+    if kinds['model'] != 'category':
+        raise SystemExit("a column within MAX_CATEGORIES was not stored as categories")
+    many = MAX_CATEGORIES + 1000
+    for label, parts in (
+            ("Past the cap in the first part", [make_part(0, 2 * many, many, 2)]),
+            ("Past the cap in a later part", [make_part(0, few, few, 3), make_part(few, 2 * many, many, 4),
+                                             make_part(few + 2 * many, few, many, 5)])):
+        kinds = check(parts, label)
+        if kinds['model'] != 'bytes' or kinds['make'] != 'category':
+            raise SystemExit(f"{label}: expected model as bytes and make as category, got {kinds}")
+    print("Column store check passed")
+
+
+if __name__ == "__main__":
+    main()
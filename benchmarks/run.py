@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from synthetic_mot import write_dataset
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODELS = ('DataParallelModel', 'MasterWorkerModel')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scaling benchmarks of both models on synthetic MOT data")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[10000, 100000], help="Test rows per dataset")
+    parser.add_argument("--ranks", type=int, nargs='+', default=[1, 2, 4], help="MPI rank counts to run")
+    parser.add_argument("--models", nargs='+', choices=MODELS, default=list(MODELS))
+    parser.add_argument("--files", type=int, default=8, help="CSV files per dataset")
+    parser.add_argument("--repeats", type=int, default=3, help="Times every search is repeated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default="benchmark_data", help="Where datasets and logs are kept")
+    parser.add_argument("--output", default="scaling_report.json", help="Machine-readable report")
+    parser.add_argument("--mpiexec", default="mpiexec", help="MPI launcher command, e.g. 'mpiexec --oversubscribe'")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds allowed per run")
+    return parser.parse_args()
+
+
+def prepare_dataset(workdir, rows, files, seed):
+    """Generates a dataset once per size and seed; later runs reuse it."""
+    directory = os.path.join(workdir, f"rows_{rows}_seed_{seed}")
+    csv_directory = os.path.join(directory, "database", "test_result_2022")
+    if not os.path.isdir(csv_directory):
+        started = time.perf_counter()
+        write_dataset(csv_directory, rows, files, seed)
+        print(f"Generated {rows} rows in {time.perf_counter() - started:.1f}s at {csv_directory}")
+    return directory
+
+
+def run_once(args, directory, model, ranks, rows):
+    """Runs bench_workload.py under the MPI launcher and returns its JSON result."""
+    result_path = os.path.join(directory, f"result_{model}_{ranks}.json")
+    log_path = os.path.join(directory, f"log_{model}_{ranks}.txt")
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    command = shlex.split(args.mpiexec) + ["-n", str(ranks), sys.executable,
+                                           os.path.join(HERE, "bench_workload.py"), "--model", model,
+                                           "--repeats", str(args.repeats), "--output", result_path]
+    started = time.perf_counter()
+    with open(log_path, 'w') as log:
+        completed = subprocess.run(command, cwd=directory, stdout=log, stderr=subprocess.STDOUT,
+                                   timeout=args.timeout)
+    wall = time.perf_counter() - started
+    if completed.returncode != 0 or not os.path.exists(result_path):
+        print(f"  {model} with {ranks} ranks failed (exit code {completed.returncode}); see {log_path}")
+        return {'model': model, 'ranks': ranks, 'rows': rows, 'error': f"exit code {completed.returncode}",
+                'log': log_path}
+    with open(result_path) as f:
+        result = json.load(f)
+    result.update(rows=rows, wall_seconds=wall)
+    return result
+
+
+def add_scaling(runs):
+    """Adds speedup and parallel efficiency against the smallest rank count of each model and size."""
+    groups = {}
+    for run in runs:
+        if 'error' not in run:
+            groups.setdefault((run['model'], run['rows']), []).append(run)
+    for group in groups.values():
+        base = min(group, key=lambda run: run['ranks'])
+        for run in group:
+            scale = run['ranks'] / base['ranks']
+            for metric, value, base_value in (
+                    ('ingest', run['ingest_seconds'], base['ingest_seconds']),
+                    ('search_p50', run['search_latency']['p50'], base['search_latency']['p50'])):
+                speedup = base_value / value if value > 0 else 0.0
+                run[f'{metric}_speedup'] = speedup
+                run[f'{metric}_efficiency'] = speedup / scale
+
+
+def print_table(runs):
+    print(f"{'model':<18} {'rows':>8} {'ranks':>5} {'ingest s':>9} {'pickle s':>9} {'cache s':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'q/s':>7} {'batch s':>8} {'speedup':>8}")
+    for run in runs:
+        if 'error' in run:
+            print(f"{run['model']:<18} {run['rows']:>8} {run['ranks']:>5}  failed: {run['error']}")
+            continue
+        latency = run['search_latency']
+        print(f"{run['model']:<18} {run['rows']:>8} {run['ranks']:>5} {run['ingest_seconds']:>9.3f} "
+              f"{run['pickle_load_seconds']:>9.3f} {run['cache_load_seconds']:>8.3f} "
+              f"{latency['p50'] * 1000:>8.1f} {latency['p99'] * 1000:>8.1f} {run['search_queries_per_second']:>7.1f} "
+              f"{run['batch_search_seconds']:>8.3f} {run.get('search_p50_speedup', 1.0):>8.2f}")
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+    runs = []
+    for rows in args.sizes:
+        directory = prepare_dataset(args.workdir, rows, args.files, args.seed)
+        for model in args.models:
+            for ranks in args.ranks:
+                print(f"Running {model} on {rows} rows with {ranks} ranks")
+                runs.append(run_once(args, directory, model, ranks, rows))
+
+    add_scaling(runs)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'settings': {'sizes': args.sizes, 'ranks': args.ranks, 'files': args.files, 'repeats': args.repeats,
+                     'seed': args.seed, 'mpiexec': args.mpiexec},
+        'runs': runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_table(runs)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+# Column order of the test_result CSV files in the MOT dump
+CSV_COLUMNS = ['test_id', 'vehicle_id', 'test_date', 'test_class_id', 'test_type', 'test_result',
+               'test_mileage', 'postcode_area', 'make', 'model', 'colour', 'fuel_type',
+               'cylinder_capacity', 'first_use_date']
+
+# Makes in rough order of popularity; selection follows a Zipf law over this order
+MAKES = {
+    'FORD': ['FIESTA', 'FOCUS', 'KA', 'MONDEO', 'KUGA', 'TRANSIT', 'C-MAX', 'S-MAX', 'GALAXY', 'ECOSPORT'],
+    'VAUXHALL': ['CORSA', 'ASTRA', 'INSIGNIA', 'ZAFIRA', 'MERIVA', 'MOKKA', 'VIVARO', 'AGILA'],
+    'VOLKSWAGEN': ['GOLF', 'POLO', 'PASSAT', 'TIGUAN', 'UP', 'TRANSPORTER', 'TOURAN', 'SCIROCCO'],
+    'BMW': ['320D', '118D', '520D', 'X5', 'X3', '116I', '330D', 'X1'],
+    'TOYOTA': ['YARIS', 'AYGO', 'AURIS', 'PRIUS', 'COROLLA', 'RAV4', 'C-HR'],
+    'PEUGEOT': ['207', '208', '308', '3008', '2008', '107', '5008'],
+    'NISSAN': ['QASHQAI', 'MICRA', 'JUKE', 'NOTE', 'LEAF', 'X-TRAIL'],
+    'AUDI': ['A3', 'A4', 'A1', 'A6', 'Q5', 'Q3', 'TT'],
+    'MERCEDES-BENZ': ['C220', 'A180', 'E220', 'SPRINTER', 'B180', 'GLC'],
+    'RENAULT': ['CLIO', 'MEGANE', 'CAPTUR', 'SCENIC', 'KANGOO', 'TRAFIC'],
+    'CITROEN': ['C3', 'C1', 'BERLINGO', 'C4', 'DS3', 'C5'],
+    'HONDA': ['CIVIC', 'JAZZ', 'CR-V', 'ACCORD', 'HR-V'],
+    'KIA': ['SPORTAGE', 'PICANTO', 'CEED', 'RIO', 'SORENTO'],
+    'HYUNDAI': ['I10', 'I20', 'I30', 'TUCSON', 'IX35'],
+    'SKODA': ['OCTAVIA', 'FABIA', 'SUPERB', 'YETI', 'CITIGO'],
+    'FIAT': ['500', 'PUNTO', 'PANDA', 'DUCATO', 'TIPO'],
+    'MINI': ['COOPER', 'ONE', 'COUNTRYMAN', 'COOPER S'],
+    'MAZDA': ['MAZDA3', 'MAZDA2', 'CX-5', 'MX-5', 'MAZDA6'],
+    'SEAT': ['IBIZA', 'LEON', 'ATECA', 'ALHAMBRA'],
+    'LAND ROVER': ['DISCOVERY', 'FREELANDER', 'RANGE ROVER EVOQUE', 'DEFENDER'],
+    'VOLVO': ['XC60', 'V40', 'XC90', 'V70', 'S60'],
+    'SUZUKI': ['SWIFT', 'VITARA', 'ALTO', 'SX4'],
+    'JAGUAR': ['XF', 'XE', 'F-PACE', 'XJ'],
+    'MITSUBISHI': ['OUTLANDER', 'L200', 'ASX', 'SHOGUN'],
+    'DACIA': ['SANDERO', 'DUSTER', 'LOGAN'],
+    'LEXUS': ['IS', 'RX', 'CT', 'NX'],
+    'PORSCHE': ['911', 'CAYENNE', 'MACAN', 'BOXSTER'],
+    'SMART': ['FORTWO', 'FORFOUR'],
+    'ALFA ROMEO': ['GIULIETTA', 'MITO', '159', 'GIULIA'],
+    'TESLA': ['MODEL 3', 'MODEL S', 'MODEL X'],
+}
+COLOURS = (['SILVER', 'BLACK', 'BLUE', 'GREY', 'WHITE', 'RED', 'GREEN', 'YELLOW', 'ORANGE', 'BROWN', 'PURPLE',
+            'GOLD', 'BEIGE', 'MULTI-COLOUR'],
+           [0.19, 0.18, 0.17, 0.13, 0.1, 0.1, 0.05, 0.02, 0.015, 0.015, 0.01, 0.01, 0.005, 0.005])
+FUEL_TYPES = (['PE', 'DI', 'HY', 'EL', 'LP', 'OT'], [0.55, 0.38, 0.04, 0.01, 0.005, 0.015])
+CYLINDER_CAPACITIES = [998, 1199, 1242, 1398, 1461, 1598, 1796, 1968, 1995, 2143, 2993]
+POSTCODE_AREAS = ['B', 'M', 'LS', 'S', 'BS', 'NG', 'L', 'CF', 'G', 'EH', 'SW', 'SE', 'E', 'N', 'NW', 'W', 'CR',
+                  'BN', 'RG', 'SO', 'PO', 'OX', 'CB', 'NR', 'IP', 'CO', 'CM', 'SS', 'ME', 'CT', 'TN', 'GU',
+                  'KT', 'SM', 'TW', 'HA', 'UB', 'WD', 'AL', 'SG', 'LU', 'MK', 'NN', 'LE', 'CV', 'WV', 'DY',
+                  'WS', 'ST', 'DE', 'SK', 'WA', 'CH', 'PR', 'BB', 'BL', 'OL', 'HD', 'HX', 'BD', 'HG', 'YO',
+                  'HU', 'DN', 'LN', 'PE', 'NE', 'SR', 'DH', 'TS', 'DL', 'CA', 'LA', 'EX', 'PL', 'TR', 'TQ',
+                  'TA', 'BA', 'SN', 'GL', 'HR', 'WR', 'SY', 'LD', 'SA', 'NP', 'LL', 'AB', 'DD', 'KY', 'FK',
+                  'PA', 'KA', 'DG', 'TD', 'IV', 'PH', 'BT']
+TEST_CLASSES = ([4, 7, 5, 2, 1], [0.9, 0.06, 0.01, 0.02, 0.01])
+
+
+def zipf_weights(count, exponent):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_rows(num_tests, seed=0, bad_fraction=0.01):
+    """
+    Generates a deterministic MOT-like test table.
+
+    Vehicles get Zipf-skewed makes and models, one or more tests in the year (failed tests are
+    usually followed by a retest a few days later with a little more mileage), mileage growing with
+    age, and a share of malformed dates, mileages and capacities like the ones in the real dump.
+
+    Args:
+        num_tests (int): Number of test rows to generate.
+        seed (int): Seed of the random generator; the same seed gives the same rows.
+        bad_fraction (float): Rough fraction of rows with a malformed field.
+
+    Returns:
+        pd.DataFrame: The rows as strings, in test date order, with the CSV_COLUMNS columns.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Vehicles: about 1.4 tests each on average
+    num_vehicles = max(1, int(num_tests / 1.4))
+    makes = list(MAKES)
+    make_index = rng.choice(len(makes), size=num_vehicles, p=zipf_weights(len(makes), 1.1))
+    model_rank = rng.zipf(1.6, size=num_vehicles) - 1
+    vehicle_make = np.array(makes, dtype=object)[make_index]
+    vehicle_model = np.array([MAKES[make][rank % len(MAKES[make])] for make, rank in zip(vehicle_make, model_rank)],
+                             dtype=object)
+    vehicle_colour = rng.choice(COLOURS[0], size=num_vehicles, p=COLOURS[1])
+    vehicle_fuel = rng.choice(FUEL_TYPES[0], size=num_vehicles, p=FUEL_TYPES[1])
+    vehicle_capacity = rng.choice(CYLINDER_CAPACITIES, size=num_vehicles).astype(object)
+    vehicle_capacity[vehicle_fuel == 'EL'] = ''
+    vehicle_class = rng.choice(TEST_CLASSES[0], size=num_vehicles, p=TEST_CLASSES[1])
+    vehicle_area = rng.choice(POSTCODE_AREAS, size=num_vehicles, p=zipf_weights(len(POSTCODE_AREAS), 0.6))
+    # Cars are first tested three years after first use; older vehicles get rarer with age
+    days_in_use = np.minimum(1095 + rng.exponential(2500, size=num_vehicles), 40 * 365).astype(int)
+    first_use = pd.Timestamp('2022-07-01') - pd.to_timedelta(days_in_use, unit='D')
+    age_years = (pd.Timestamp('2022-07-01') - first_use).days.to_numpy() / 365.25
+    yearly_mileage = rng.lognormal(np.log(7500), 0.5, size=num_vehicles)
+
+    # Tests: every vehicle gets an initial test, then extra tests go to randomly chosen vehicles
+    test_vehicle = np.concatenate([np.arange(num_vehicles),
+                                   rng.integers(0, num_vehicles, size=max(0, num_tests - num_vehicles))])[:num_tests]
+    test_vehicle.sort(kind='stable')
+    test_day = rng.integers(0, 365 - 14, size=num_tests)
+    # A vehicle's later tests follow its first one by a few days (retests)
+    first_of_vehicle = np.r_[True, test_vehicle[1:] != test_vehicle[:-1]]
+    run_start = np.maximum.accumulate(np.where(first_of_vehicle, np.arange(num_tests), 0))
+    test_day = np.where(first_of_vehicle, test_day, test_day[run_start] + rng.integers(1, 14, size=num_tests))
+    test_date = pd.Timestamp('2022-01-01') + pd.to_timedelta(test_day, unit='D')
+
+    age = age_years[test_vehicle]
+    fail_probability = np.clip(0.12 + 0.015 * age, 0.05, 0.6)
+    outcome = rng.random(num_tests)
+    test_result = np.where(outcome < fail_probability, 'F', 'P').astype(object)
+    test_result[(outcome >= fail_probability) & (outcome < fail_probability + 0.05)] = 'PRS'
+    test_result[rng.random(num_tests) < 0.003] = 'ABA'
+    # Retests after a failure mostly pass
+    test_result[~first_of_vehicle & (rng.random(num_tests) < 0.8)] = 'P'
+    test_type = np.where(first_of_vehicle, 'NT', 'RT').astype(object)
+
+    mileage = (age * yearly_mileage[test_vehicle] + (test_day - test_day[run_start]) * 20).astype(np.int64)
+    mileage_text = mileage.astype(str).astype(object)
+
+    frame = pd.DataFrame({
+        'test_id': rng.permutation(np.arange(num_tests) * 7 + 10000001).astype(str),
+        'vehicle_id': (test_vehicle * 13 + 1000003).astype(str),
+        'test_date': test_date.strftime('%Y-%m-%d').to_numpy(dtype=object),
+        'test_class_id': vehicle_class[test_vehicle].astype(str),
+        'test_type': test_type,
+        'test_result': test_result,
+        'test_mileage': mileage_text,
+        'postcode_area': vehicle_area[test_vehicle],
+        'make': vehicle_make[test_vehicle],
+        'model': vehicle_model[test_vehicle],
+        'colour': vehicle_colour[test_vehicle],
+        'fuel_type': vehicle_fuel[test_vehicle],
+        'cylinder_capacity': vehicle_capacity[test_vehicle].astype(str),
+        'first_use_date': first_use.strftime('%Y-%m-%d').to_numpy(dtype=object)[test_vehicle],
+    })
+
+    # Damage a share of the rows the way the real dump is damaged
+    def damage(column, values):
+        rows = np.flatnonzero(rng.random(num_tests) < bad_fraction / 4)
+        frame.loc[rows, column] = rng.choice(np.array(values, dtype=object), size=len(rows))
+
+    damage('test_date', ['', '2022-02-30', '2022-13-01', 'NULL'])
+    damage('first_use_date', ['', '1971-01-01', '2022-00-00', 'NULL'])
+    damage('test_mileage', ['', '-1', 'NULL', '99999999'])
+    damage('cylinder_capacity', ['', '0', 'NULL'])
+
+    # The dump is ordered by test date, not by vehicle
+    order = np.argsort(test_day + rng.random(num_tests), kind='stable')
+    return frame.iloc[order].reset_index(drop=True)
+
+
+def write_dataset(directory, num_tests, num_files=4, seed=0, bad_fraction=0.01):
+    """
+    Writes a synthetic test_result_2022 directory of num_files CSV files.
+
+    Returns:
+        list: The paths of the files written.
+    """
+    frame = generate_rows(num_tests, seed=seed, bad_fraction=bad_fraction)
+    os.makedirs(directory, exist_ok=True)
+    bounds = np.linspace(0, len(frame), num_files + 1).astype(int)
+    paths = []
+    for index, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]), start=1):
+        path = os.path.join(directory, f"test_result_2022_{index:03d}.csv")
+        frame.iloc[start:stop].to_csv(path, index=False, columns=CSV_COLUMNS, quoting=csv.QUOTE_MINIMAL)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic MOT test_result dataset")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of test rows")
+    parser.add_argument("--files", type=int, default=4, help="Number of CSV files")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bad-fraction", type=float, default=0.01, help="Rough fraction of malformed rows")
+    parser.add_argument("--output", default="database/test_result_2022", help="Directory for the CSV files")
+    args = parser.parse_args()
+
+    paths = write_dataset(args.output, args.rows, args.files, args.seed, args.bad_fraction)
+    print(f"Wrote {args.rows} rows to {len(paths)} files in {args.output}")
+
+
+if __name__ == "__main__":
+    main()